@@ -0,0 +1,300 @@
+"""Aggregatore centrale: riceve la telemetria di più controller (uplink.py) e
+serve una dashboard e un'API per tutta la flotta.
+
+Uso:
+    python aggregatore.py [--porta 5100] [--threads 8] [--campioni 3600]
+                          [--max-siti 1000] [--token SEGRETO] [--siti casa garage ...]
+e su ogni controller CONFIG['AGGREGATORE_URL'] = 'http://<host>:5100' (più
+CONFIG['AGGREGATORE_TOKEN'] = 'SEGRETO' se l'aggregatore ne chiede uno).
+"""
+import argparse
+import gzip
+import hmac
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from flask import Flask, jsonify, request
+
+from rollup import RollupPyramid, storico_finestra
+from static_assets import AssetStatici
+from telemetry import TelemetryRing
+from web_server import ServerWeb, comprimi_risposte
+
+# -----------------------------------------------------------
+# AGGREGATORE DI FLOTTA
+# -----------------------------------------------------------
+# Ogni sito ha il suo storico grezzo e i suoi aggregati, allocati una volta
+# sola al primo lotto: la memoria per sito è fissa e nota (memoria()). Per
+# stare in centinaia di siti lo storico grezzo è più corto di quello di un
+# controller e la piramide parte da 1 minuto. I lotti di siti diversi si
+# elaborano in parallelo: il lock globale serve solo a creare un sito nuovo,
+# poi ogni sito ha il suo. Un lotto si decodifica e si controlla per intero
+# prima di prendere il lock del sito: se non è valido il sito resta com'era. Un lotto con seq già visto (reinvio dopo un errore
+# di rete) viene confermato e ignorato. La sequenza vale solo dentro lo
+# stesso avvio del controller: un lotto con un altro `avvio` (servizio
+# riavviato, seq di nuovo da 1) azzera il conteggio del sito.
+# Ogni sito nuovo costa la sua memoria fissa per sempre, quindi non basta un
+# POST qualsiasi per crearne uno: l'ingestione può chiedere un token comune
+# (--token), limitare i nomi ammessi (--siti) e in ogni caso c'è un numero
+# massimo di siti (--max-siti). Un lotto rifiutato così riceve 401/403 e il
+# controller lo scarta senza riprovare.
+
+# (secondi per bucket, bucket conservati): 1 giorno a 1 min, 7 giorni a 15 min, 31 giorni a 1 h
+LIVELLI_SITO = ((60, 1440), (900, 672), (3600, 744))
+CAMPIONI_SITO = 3600  # un'ora di letture grezze a 1 lettura/s
+ETA_OFFLINE_S = 120   # senza lotti da più di così il sito risulta offline
+MAX_SITI = 1000       # siti allocati al massimo
+
+
+class SitoRifiutato(Exception):
+    """Il lotto è valido ma il sito non è ammesso (fuori elenco o siti esauriti)"""
+
+
+def _numero(valore):
+    if isinstance(valore, bool) or not isinstance(valore, (int, float)):
+        raise TypeError(f"atteso un numero, non {valore!r}")
+    return valore
+
+
+def decodifica(dati):
+    """Lotto JSON -> (avvio, seq, letture, comandi, stato), tutto controllato prima
+    di toccare il sito: un lotto malformato non deve far avanzare la sequenza né
+    lasciare metà delle letture nello storico. ValueError/KeyError/TypeError se non è valido."""
+    seq = dati.get('seq', 0)
+    if isinstance(seq, bool) or not isinstance(seq, int):
+        raise TypeError("seq non intero")
+    avvio = dati.get('avvio')
+    if avvio is not None and not isinstance(avvio, str):
+        raise TypeError("avvio non è una stringa")
+    stato = dati.get('stato')
+    if stato is not None and not isinstance(stato, dict):
+        raise TypeError("stato non è un oggetto")
+    t0 = _numero(dati['t0'])
+    letture = []
+    for riga in dati['letture']:
+        if not isinstance(riga, list) or len(riga) != 8:
+            raise ValueError(f"lettura malformata: {riga!r}")
+        dt, *fasi, wb = (_numero(v) for v in riga)
+        letture.append((t0 + dt / 10, tuple(fasi), wb))
+    comandi = []
+    for riga in dati['comandi']:
+        if not isinstance(riga, list) or len(riga) != 3:
+            raise ValueError(f"comando malformato: {riga!r}")
+        dt, btn, watts = riga
+        comandi.append((t0 + _numero(dt) / 10, btn, _numero(watts)))
+    return avvio, seq, letture, comandi, stato
+
+
+class Sito:
+    def __init__(self, nome, campioni, livelli):
+        self.nome = nome
+        self.storico = TelemetryRing(campioni)
+        self.rollup = RollupPyramid(livelli)
+        self.comandi = deque(maxlen=50)  # (t, btn, watts) più recenti
+        self.stato = {}
+        self.avvio = None
+        self.ultimo_seq = 0
+        self.ultimo_contatto = None
+        self.ultima = None  # (t, fasi, wb) dell'ultima lettura
+        self.stats = {'lotti': 0, 'letture': 0, 'comandi': 0, 'duplicati': 0, 'riavvii': 0}
+        self.lock = threading.Lock()
+
+    def memoria(self):
+        return self.storico.memoria() + self.rollup.memoria()
+
+    def ingerisci(self, lotto, adesso):
+        """lotto già decodificato e validato da decodifica(); False se è un reinvio"""
+        avvio, seq, letture, comandi, stato = lotto
+        with self.lock:
+            if avvio != self.avvio:
+                if self.avvio is not None:
+                    self.stats['riavvii'] += 1
+                self.avvio = avvio
+                self.ultimo_seq = 0
+            if seq and seq <= self.ultimo_seq:
+                self.stats['duplicati'] += 1
+                return False
+            self.ultimo_seq = seq
+            self.ultimo_contatto = adesso
+            for t, fasi, wb in letture:
+                grid, solar = sum(fasi[0:3]), sum(fasi[3:6])
+                self.storico.append(t, fasi, grid, solar, wb)
+                self.rollup.aggiungi(t, fasi, grid, solar, wb)
+                self.ultima = (t, fasi, wb)
+            self.comandi.extend(comandi)
+            self.stato = stato or self.stato
+            self.stats['lotti'] += 1
+            self.stats['letture'] += len(letture)
+            self.stats['comandi'] += len(comandi)
+            return True
+
+    def riepilogo(self, adesso):
+        ultima, stato = self.ultima, self.stato
+        voce = {
+            'nome': self.nome,
+            'online': self.ultimo_contatto is not None and adesso - self.ultimo_contatto < ETA_OFFLINE_S,
+            'ultimo_contatto': self.ultimo_contatto,
+            'stato': stato,
+            'stats': dict(self.stats),
+        }
+        if ultima is not None:
+            t, fasi, wb = ultima
+            rete, solare = sum(fasi[0:3]), sum(fasi[3:6])
+            voce.update({
+                't': t, 'fasi': fasi, 'rete': rete, 'solare': solare, 'wb': wb,
+                # quanto resterebbe per la ricarica: solare + prelevabile - consumo della casa
+                'surplus': solare + stato.get('prelevabile', 0) - (rete - wb),
+            })
+        return voce
+
+
+class Aggregatore:
+    def __init__(self, campioni=CAMPIONI_SITO, livelli=LIVELLI_SITO, max_siti=MAX_SITI, siti_ammessi=None):
+        self.campioni = campioni
+        self.livelli = livelli
+        self.max_siti = max_siti
+        self.siti_ammessi = set(siti_ammessi) if siti_ammessi else None  # None = qualsiasi nome
+        self.siti = {}
+        self._lock = threading.Lock()
+        self.stats = {'lotti': 0, 'letture': 0, 'duplicati': 0, 'errori': 0, 'rifiutati': 0, 'bytes': 0}
+
+    def sito(self, nome):
+        """Il sito con questo nome, creato al primo lotto; SitoRifiutato se non è ammesso"""
+        sito = self.siti.get(nome)
+        if sito is None:
+            if self.siti_ammessi is not None and nome not in self.siti_ammessi:
+                self.stats['rifiutati'] += 1
+                raise SitoRifiutato(f"sito '{nome}' non ammesso")
+            with self._lock:
+                sito = self.siti.get(nome)
+                if sito is None:
+                    if len(self.siti) >= self.max_siti:
+                        self.stats['rifiutati'] += 1
+                        raise SitoRifiutato(f"raggiunto il massimo di {self.max_siti} siti")
+                    sito = Sito(nome, self.campioni, self.livelli)
+                    self.siti[nome] = sito
+        return sito
+
+    def ingerisci(self, corpo, compresso):
+        """Un lotto inviato da UplinkAggregatore; ValueError se non è valido,
+        SitoRifiutato se il sito non è ammesso"""
+        self.stats['bytes'] += len(corpo)
+        try:
+            dati = json.loads(gzip.decompress(corpo) if compresso else corpo)
+            nome = str(dati['sito'])
+            if not nome or dati.get('v') != 1:
+                raise ValueError("sito o versione mancante")
+            lotto = decodifica(dati)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.stats['errori'] += 1
+            raise ValueError(f"lotto non valido: {e}")
+        if self.sito(nome).ingerisci(lotto, time.time()):
+            self.stats['lotti'] += 1
+            self.stats['letture'] += len(lotto[2])
+        else:
+            self.stats['duplicati'] += 1
+
+    def riepilogo(self):
+        adesso = time.time()
+        siti = [s.riepilogo(adesso) for s in list(self.siti.values())]
+        online = [s for s in siti if s['online'] and 't' in s]
+        return {
+            'server_time': adesso,
+            'siti': sorted(siti, key=lambda s: s['nome']),
+            'totali': {
+                'siti': len(siti),
+                'online': len(online),
+                'solare': sum(s['solare'] for s in online),
+                'rete': sum(s['rete'] for s in online),
+                'wb': sum(s['wb'] for s in online),
+                'surplus': sum(s['surplus'] for s in online),
+            },
+            'stats': dict(self.stats),
+            'memoria_sito': next(iter(self.siti.values())).memoria() if self.siti else 0,
+        }
+
+
+def crea_app(aggregatore, cartella_static=None, token=None):
+    """token: se impostato /api/ingest vuole 'Authorization: Bearer <token>'"""
+    app = Flask(__name__, static_folder=None)
+    asset = AssetStatici(cartella_static or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+
+    @app.route('/')
+    def flotta():
+        return asset.risposta('flotta.html', request, app.response_class)
+
+    @app.route('/static/<path:nome>')
+    def file_statico(nome):
+        return asset.risposta(nome, request, app.response_class)
+
+    @app.route('/api/ingest', methods=['POST'])
+    def ingest():
+        if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                             ('Bearer ' + token).encode()):
+            aggregatore.stats['rifiutati'] += 1
+            return jsonify({'success': False, 'error': 'token mancante o errato'}), 401
+        try:
+            aggregatore.ingerisci(request.get_data(), request.headers.get('Content-Encoding') == 'gzip')
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        except SitoRifiutato as e:
+            return jsonify({'success': False, 'error': str(e)}), 403
+        return jsonify({'success': True})
+
+    @app.route('/api/siti')
+    def siti():
+        return jsonify(aggregatore.riepilogo())
+
+    @app.route('/api/siti/<nome>')
+    def sito(nome):
+        """Storico di un sito: ?finestra=<secondi>&punti=<n>"""
+        s = aggregatore.siti.get(nome)
+        if s is None:
+            return jsonify({'success': False, 'error': 'sito sconosciuto'}), 404
+        finestra = max(60, min(request.args.get('finestra', 3600, type=int), 31 * 86400))
+        punti = max(10, min(request.args.get('punti', 300, type=int), 1000))
+        adesso = time.time()
+        with s.lock:
+            risoluzione, serie = storico_finestra(s.storico, s.rollup, adesso - finestra, adesso, punti)
+        return jsonify({
+            **s.riepilogo(adesso),
+            'risoluzione': risoluzione,
+            'history': [{'t': t, 'grid': round(g, 1), 'solar': round(so, 1), 'wb': round(w, 1)}
+                        for t, g, so, w in zip(serie['t'], serie['grid'], serie['solar'], serie['wb'])],
+            'comandi': list(s.comandi),
+        })
+
+    comprimi_risposte(app)
+    app.asset_statici = asset
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregatore della telemetria di più controller")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--porta', type=int, default=5100)
+    parser.add_argument('--threads', type=int, default=8, help="richieste elaborate in parallelo")
+    parser.add_argument('--connessioni', type=int, default=1000, help="connessioni aperte massime (una per sito)")
+    parser.add_argument('--campioni', type=int, default=CAMPIONI_SITO, help="letture grezze tenute per sito")
+    parser.add_argument('--max-siti', type=int, default=MAX_SITI, help="siti creati al massimo")
+    parser.add_argument('--token', default=os.environ.get('AGGREGATORE_TOKEN'),
+                        help="token comune richiesto ai controller (o variabile AGGREGATORE_TOKEN)")
+    parser.add_argument('--siti', nargs='+', help="nomi dei siti ammessi (default: qualsiasi)")
+    args = parser.parse_args()
+
+    aggregatore = Aggregatore(args.campioni, max_siti=args.max_siti, siti_ammessi=args.siti)
+    app = crea_app(aggregatore, token=args.token)
+    app.asset_statici.carica()
+    server = ServerWeb(app, args.host, args.porta, 'waitress', args.threads, args.connessioni)
+    print(f"Aggregatore su http://{args.host}:{server.porta} ({server.modo})")
+    try:
+        server.servi()
+    except KeyboardInterrupt:
+        server.chiudi()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# -----------------------------------------------------------
+# RIPARTIZIONE DEL SURPLUS TRA PIÙ WALLBOX
+# -----------------------------------------------------------
+# Data la potenza disponibile per la ricarica, decide quanti watt dare a ogni
+# wallbox rispettando minimo e massimo di ognuna (una wallbox accesa non può
+# scendere sotto il minimo: o riceve almeno quello o resta a 0).
+#   'priorita'  : in ordine di priorità, ognuna prende fino al suo massimo
+#   'equa'      : si accendono quante più wallbox ci stanno (per priorità) e
+#                 la potenza si livella: tutte uguali, entro minimo e massimo
+#   'garantita' : come 'equa', ma chi ha `garantita` > 0 riceve sempre almeno
+#                 quella potenza, anche prelevando dalla rete
+# A parità di priorità passano prima le wallbox già accese, così il surplus
+# che oscilla non fa alternare accensioni e spegnimenti. Nessuno stato e
+# nessun I/O: il costo è O(n log n) sul numero di wallbox.
+
+POLITICHE = ('priorita', 'equa', 'garantita')
+
+
+class Richiesta:
+    __slots__ = ('nome', 'minima', 'massima', 'priorita', 'garantita', 'attiva')
+
+    def __init__(self, nome, minima, massima, priorita=0, garantita=0, attiva=False):
+        self.nome = nome
+        self.minima = minima
+        self.massima = massima
+        self.priorita = priorita    # 0 = la più importante
+        self.garantita = garantita  # W da dare comunque (solo politica 'garantita')
+        self.attiva = attiva        # già accesa adesso
+
+    def __repr__(self):
+        return f"Richiesta({self.nome!r}, {self.minima}-{self.massima}W, priorita={self.priorita})"
+
+
+def _ordine(richieste):
+    return sorted(range(len(richieste)), key=lambda i: (richieste[i].priorita, not richieste[i].attiva, i))
+
+
+def _livella(totale, limiti):
+    """Livello L tale che sum(clamp(L, basso, alto)) == totale, con sum(bassi) <= totale"""
+    punti = sorted({v for coppia in limiti for v in coppia})
+    somma = lambda livello: sum(min(alto, max(basso, livello)) for basso, alto in limiti)
+    if somma(punti[-1]) <= totale:
+        return punti[-1]
+    # tra due punti consecutivi la somma è lineare: si cerca il tratto e si interpola
+    basso_i, alto_i = 0, len(punti) - 1
+    while alto_i - basso_i > 1:
+        medio = (basso_i + alto_i) // 2
+        if somma(punti[medio]) <= totale:
+            basso_i = medio
+        else:
+            alto_i = medio
+    a, b = punti[basso_i], punti[alto_i]
+    sa, sb = somma(a), somma(b)
+    return a + (totale - sa) * (b - a) / (sb - sa) if sb > sa else a
+
+
+def ripartisci(disponibile, richieste, politica='priorita'):
+    """Watt interi per ogni richiesta, nello stesso ordine (0 = spenta)"""
+    if politica not in POLITICHE:
+        raise ValueError(f"politica di ripartizione sconosciuta: {politica} (valide: {', '.join(POLITICHE)})")
+    assegnate = [0] * len(richieste)
+    ordine = _ordine(richieste)
+
+    if politica == 'priorita':
+        resto = disponibile
+        for i in ordine:
+            r = richieste[i]
+            if resto >= r.minima:
+                assegnate[i] = int(min(r.massima, resto))
+                resto -= assegnate[i]
+        return assegnate
+
+    # equa / garantita: scelta delle wallbox accese, poi livellamento
+    minimi = {}
+    if politica == 'garantita':
+        for i in ordine:
+            r = richieste[i]
+            if r.garantita > 0:
+                minimi[i] = min(r.massima, max(r.minima, r.garantita))
+    usato = sum(minimi.values())
+    for i in ordine:
+        if i not in minimi and usato + richieste[i].minima <= disponibile:
+            minimi[i] = richieste[i].minima
+            usato += richieste[i].minima
+    if not minimi:
+        return assegnate
+    indici = sorted(minimi)
+    limiti = [(minimi[i], richieste[i].massima) for i in indici]
+    livello = _livella(max(disponibile, usato), limiti)
+    for i, (basso, alto) in zip(indici, limiti):
+        assegnate[i] = int(min(alto, max(basso, livello)))
+    return assegnate
@@ -0,0 +1,186 @@
+"""Generatore di carico per aggregatore.py: molti siti simulati che inviano
+lotti come uplink.py, per misurare ingestione e memoria per sito.
+
+L'aggregatore (waitress, come in produzione) gira in un processo figlio, così
+CPU e memoria misurate sono solo le sue. I siti sono distribuiti su --clienti
+thread di questo processo, ognuno con una connessione keep-alive. Per ogni
+numero di siti:
+- registrazione: ogni sito manda il primo lotto; la crescita della memoria
+  residente del server divisa per i siti è la memoria per sito
+- saturazione: per --durata secondi i siti mandano lotti di --letture letture
+  senza pause; lotti/s e letture/s dicono quanti siti a 1 lettura/s il server
+  può seguire, con latenza e CPU del server
+Corpo dei lotti: lo stesso formato di uplink.lotto(), compresso con gzip.
+
+Uso:
+    python benchmarks/bench_aggregatore.py [--siti 100 300 1000] [--durata 10] [--letture 10]
+"""
+import argparse
+import gzip
+import http.client
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RADICE)
+
+from uplink import lotto  # noqa: E402
+
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for riga in f:
+            if riga.startswith('VmRSS:'):
+                return int(riga.split()[1])
+    return 0
+
+
+def server(threads, campioni):
+    import aggregatore
+    from web_server import ServerWeb
+
+    ag = aggregatore.Aggregatore(campioni)
+    app = aggregatore.crea_app(ag)
+    web = ServerWeb(app, '127.0.0.1', 0, 'waitress', threads, connessioni=5000, log=lambda m: None)
+    threading.Thread(target=web.servi, daemon=True).start()
+    print(f"porta {web.porta}", flush=True)
+    for comando in sys.stdin:
+        if comando.strip() == 'fine':
+            break
+        print(json.dumps({
+            'rss_kb': rss_kb(),
+            'cpu_s': time.process_time(),
+            'siti': len(ag.siti),
+            'memoria_sito': next(iter(ag.siti.values())).memoria() if ag.siti else 0,
+            'stats': ag.stats,
+        }), flush=True)
+    os._exit(0)
+
+
+class SitoSimulato:
+    """Lotti con letture sempre uguali (relative a t0): cambiano solo seq e t0"""
+
+    def __init__(self, nome, letture, rnd):
+        self.nome = nome
+        self.seq = 0
+        self.letture = letture
+        self.t = time.time() - 86400
+        campioni = [(self.t + i, (rnd.uniform(200, 900), 0.0, 0.0, rnd.uniform(0, 5000), 0.0, 0.0), 1380.0)
+                    for i in range(letture)]
+        self.modello = lotto(nome, 0, campioni, [(self.t + letture - 1, 'P', 1380)],
+                             {'wb_on': True, 'setpoint': 1380, 'prelevabile': 0, 'coda': {'inviati': 1, 'falliti': 0}})
+        self.modello = self.modello.replace(b'"seq":0', b'"seq":%d').replace(
+            b'"t0":' + str(round(self.t, 1)).encode(), b'"t0":%.1f')
+
+    def corpo(self):
+        self.seq += 1
+        corpo = gzip.compress(self.modello % (self.seq, self.t), 6, mtime=0)
+        self.t += self.letture
+        return corpo
+
+
+def invia(siti, porta, fine, risultati):
+    """Un thread di invio: gira sui suoi siti finché non arriva `fine` (None = un giro solo)"""
+    connessione = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+    i = 0
+    while siti and (fine is None and i < len(siti) or fine is not None and time.monotonic() < fine):
+        sito = siti[i % len(siti)]
+        i += 1
+        corpo = sito.corpo()
+        inizio = time.perf_counter()
+        try:
+            connessione.request('POST', '/api/ingest', corpo, {'Content-Encoding': 'gzip', 'Content-Type': 'application/json'})
+            risposta = connessione.getresponse()
+            risposta.read()
+            stato = risposta.status
+        except (OSError, http.client.HTTPException):
+            connessione.close()
+            connessione = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+            stato = 0
+        risultati.append((stato, time.perf_counter() - inizio))
+    connessione.close()
+
+
+def fase(gruppi, porta, durata):
+    risultati = []
+    fine = None if durata is None else time.monotonic() + durata
+    threads = [threading.Thread(target=invia, args=(g, porta, fine, risultati)) for g in gruppi]
+    inizio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return risultati, time.perf_counter() - inizio
+
+
+def prova(n_siti, args):
+    processo = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--server', str(args.threads),
+                                 str(args.campioni)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    porta = int(processo.stdout.readline().split()[1])
+
+    def misura():
+        processo.stdin.write("misura\n")
+        processo.stdin.flush()
+        return json.loads(processo.stdout.readline())
+
+    rnd = random.Random(n_siti)
+    siti = [SitoSimulato(f"sito{i:04d}", args.letture, rnd) for i in range(n_siti)]
+    gruppi = [siti[k::args.clienti] for k in range(args.clienti)]
+
+    prima = misura()
+    fase(gruppi, porta, None)
+    registrati = misura()
+    risultati, durata = fase(gruppi, porta, args.durata)
+    dopo = misura()
+    processo.stdin.write("fine\n")
+    processo.stdin.flush()
+    processo.wait()
+
+    riusciti = sorted(dt for stato, dt in risultati if stato == 200)
+    lotti_s = len(riusciti) / durata
+    return {
+        'kb_sito': (registrati['rss_kb'] - prima['rss_kb']) / n_siti,
+        'kb_sito_teorici': registrati['memoria_sito'] / 1024,
+        'rss_mb': dopo['rss_kb'] / 1024,
+        'lotti_s': lotti_s,
+        'letture_s': lotti_s * args.letture,
+        'errori': len(risultati) - len(riusciti),
+        'latenza_ms': (statistics.median(riusciti) * 1000 if riusciti else 0.0,
+                       riusciti[int(len(riusciti) * 0.99)] * 1000 if riusciti else 0.0),
+        'cpu': (dopo['cpu_s'] - registrati['cpu_s']) / durata,
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--server':
+        server(int(sys.argv[2]), int(sys.argv[3]))
+        return
+
+    parser = argparse.ArgumentParser(description="Carico di ingestione sull'aggregatore di flotta")
+    parser.add_argument('--siti', type=int, nargs='+', default=[100, 300, 1000])
+    parser.add_argument('--durata', type=float, default=10.0, help="secondi di saturazione per prova")
+    parser.add_argument('--letture', type=int, default=10, help="letture per lotto (10 = uplink ogni 10 s)")
+    parser.add_argument('--clienti', type=int, default=16, help="thread di invio (connessioni keep-alive)")
+    parser.add_argument('--threads', type=int, default=8, help="thread di waitress nell'aggregatore")
+    parser.add_argument('--campioni', type=int, default=3600, help="letture grezze tenute per sito")
+    args = parser.parse_args()
+
+    print(f"{args.letture} letture per lotto, {args.clienti} connessioni, aggregatore con {args.threads} thread, "
+          f"{args.campioni} letture grezze per sito\n")
+    print(f"{'siti':>6} {'KB/sito':>8} {'teorici':>8} {'RSS MB':>7} | {'lotti/s':>8} {'letture/s':>10} "
+          f"{'lat p50':>8} {'lat p99':>8} {'CPU':>5} {'err':>4}")
+    for n in args.siti:
+        r = prova(n, args)
+        print(f"{n:>6} {r['kb_sito']:>8.0f} {r['kb_sito_teorici']:>8.0f} {r['rss_mb']:>7.0f} | {r['lotti_s']:>8.0f} "
+              f"{r['letture_s']:>10.0f} {r['latenza_ms'][0]:>8.1f} {r['latenza_ms'][1]:>8.1f} "
+              f"{r['cpu'] * 100:>4.0f}% {r['errori']:>4}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
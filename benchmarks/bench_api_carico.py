@@ -0,0 +1,135 @@
+"""Carico su /api/data con più dashboard aperte: CPU del server per richiesta
+con e senza la cache delle risposte serializzate.
+
+Il server Flask gira in questo processo (make_server threaded, come
+run_flask) con una lettura del contatore al secondo e gli storici pieni. Le
+dashboard sono thread in un processo separato, così il tempo CPU misurato con
+time.process_time() è solo quello del server. Ogni dashboard fa il polling
+come la pagina: cursori seq/log_seq, If-None-Match e Accept-Encoding gzip.
+
+Uso:
+    python benchmarks/bench_api_carico.py [secondi_per_prova] [intervallo_polling_s]
+    python benchmarks/bench_api_carico.py 10 0.5
+"""
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DASHBOARD = (1, 5, 20, 50)
+# (finestra in secondi, titolo): 0 = vista live con i cursori, 86400 = grafico delle 24 ore
+FINESTRE = ((0, "vista live (ultime letture, cursori)"), (86400, "grafico 24 ore (?finestra=86400&punti=300)"))
+
+
+def dashboard(url, fine, intervallo, finestra, risultati):
+    """Una dashboard: polling con cursori ed ETag fino a `fine`"""
+    import requests
+
+    sessione = requests.Session()
+    base = {'finestra': finestra, 'punti': 300} if finestra else {}
+    cursori = {}
+    etag = None
+    time.sleep(random.uniform(0, intervallo))
+    while time.monotonic() < fine:
+        inizio = time.perf_counter()
+        r = sessione.get(url, params={**base, **cursori}, headers={'If-None-Match': etag} if etag else {})
+        risultati.append((r.status_code, time.perf_counter() - inizio))
+        if r.status_code == 200:
+            dati = r.json()
+            cursori = {'log_seq': dati['log_seq']} if finestra else {'seq': dati['seq'], 'log_seq': dati['log_seq']}
+            etag = r.headers.get('ETag')
+        time.sleep(max(0.0, intervallo - (time.perf_counter() - inizio)))
+
+
+def clienti(url, n, durata, intervallo, finestra):
+    """Processo figlio: n dashboard per `durata` secondi, stampa i risultati in JSON"""
+    risultati = []
+    fine = time.monotonic() + durata
+    threads = [threading.Thread(target=dashboard, args=(url, fine, intervallo, finestra, risultati)) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print(json.dumps(risultati))
+
+
+def server():
+    import solar_webinterface as swi
+    from werkzeug.serving import make_server
+    from bench_controllo import elettricita
+    from rollup import RollupPyramid
+    from telemetry import TelemetryRing
+
+    swi.SYSTEM_STATE['LOGS'].output = lambda *a, **k: None
+    # un giorno di storico, come dopo la ricarica dall'archivio
+    storico = TelemetryRing(swi.CONFIG['STORICO_CAMPIONI'])
+    piramide = RollupPyramid()
+    t0 = time.time() - storico.capacita
+    for i in range(storico.capacita):
+        fasi = (400.0 + i % 50, 0.0, 0.0, 3000.0 + i % 700, 0.0, 0.0)
+        storico.append(t0 + i, fasi, fasi[0], fasi[3], 1380.0)
+        piramide.aggiungi(t0 + i, fasi, fasi[0], fasi[3], 1380.0)
+    swi.SYSTEM_STATE['STORICO'] = storico
+    swi.SYSTEM_STATE['ROLLUP'] = piramide
+
+    monitor = swi.EnergyMonitor()
+    rnd = random.Random(1)
+
+    def contatore():
+        while True:
+            monitor.parse_packet(elettricita([rnd.uniform(200, 900), 0, 0, rnd.uniform(2000, 4000), 0, 0]))
+            swi.log_msg(f"[INFO] Gen: {monitor.solar_now:.0f}W")
+            time.sleep(1.0)
+
+    threading.Thread(target=contatore, daemon=True).start()
+    srv = make_server('127.0.0.1', 0, swi.app, threaded=True)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return swi, f"http://127.0.0.1:{srv.server_port}/api/data"
+
+
+def prova(url, n, durata, intervallo, finestra):
+    cpu = time.process_time()
+    uscita = subprocess.run([sys.executable, os.path.abspath(__file__), '--clienti', url, str(n), str(durata),
+                             str(intervallo), str(finestra)], capture_output=True, text=True, check=True)
+    cpu = time.process_time() - cpu
+    risultati = json.loads(uscita.stdout)
+    completi = [dt for stato, dt in risultati if stato == 200]
+    return {
+        'richieste': len(risultati),
+        'corpi': len(completi),
+        'cpu_s': cpu,
+        'cpu_per_richiesta_us': cpu / max(len(risultati), 1) * 1e6,
+        'latenza_ms': statistics.median(dt for _, dt in risultati) * 1000 if risultati else 0.0,
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--clienti':
+        clienti(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]), float(sys.argv[5]), int(sys.argv[6]))
+        return
+
+    durata = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    intervallo = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    swi, url = server()
+    print(f"{durata:.0f} s per prova, polling ogni {intervallo} s, storico {len(swi.SYSTEM_STATE['STORICO'])} letture")
+    for finestra, titolo in FINESTRE:
+        print(f"\n{titolo}")
+        print(f"{'dashboard':>9} {'cache':>6} {'richieste':>10} {'corpi':>7} {'CPU server':>11} "
+              f"{'us/richiesta':>13} {'latenza ms':>11}")
+        for n in DASHBOARD:
+            for cache in (False, True):
+                swi.CONFIG['CACHE_API_DATA'] = cache
+                r = prova(url, n, durata, intervallo, finestra)
+                print(f"{n:>9} {'sì' if cache else 'no':>6} {r['richieste']:>10} {r['corpi']:>7} "
+                      f"{r['cpu_s'] / durata * 100:>10.1f}% {r['cpu_per_richiesta_us']:>13.0f} {r['latenza_ms']:>11.2f}")
+    print(f"\ncache: {swi.cache_api_data.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Micro-benchmark del percorso di controllo, con baseline salvate in JSON.
+
+Misura una chiamata alla volta (mediana e p95 in microsecondi, giro migliore):
+- EnergyMonitor.parse_packet per tipo di pacchetto
+- run_logic nei rami accensione, diminuzione, aumento e timer di spegnimento
+- WallboxController.set_power con e senza bypass
+- /api/data (dati + serializzazione JSON) con storici di dimensioni diverse
+
+La wallbox è quella simulata di replay.py (nessun HTTP, comandi confermati
+subito) e il tempo di solar_webinterface è virtuale, così ogni ramo viene
+preparato sempre nello stesso stato. Con --confronta le mediane vengono
+confrontate con una baseline: se un caso è più lento della soglia lo script
+esce con codice 1.
+
+Uso:
+    python benchmarks/bench_controllo.py                          # solo risultati
+    python benchmarks/bench_controllo.py --salva base.json        # salva la baseline
+    python benchmarks/bench_controllo.py --confronta base.json    # confronta (soglia 15%)
+    python benchmarks/bench_controllo.py --confronta base.json --soglia 0.25 --filtro run_logic
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RADICE)
+
+import solar_webinterface as swi  # noqa: E402
+from bench_decoder import ELECTRICITY_TMPL, CHAN_TMPL, SOLAR_TMPL  # noqa: E402
+from replay import OrologioVirtuale, DispatcherSincrono, WallboxSimulata  # noqa: E402
+from rollup import RollupPyramid  # noqa: E402
+from telemetry import TelemetryRing  # noqa: E402
+
+T0 = 1700000000.0
+
+
+def elettricita(fasi):
+    chans = ''.join(CHAN_TMPL.format(id=c, w=w, d=w * 3) for c, w in enumerate(fasi))
+    return ELECTRICITY_TMPL.format(ts=int(T0), chans=chans, tot=sum(fasi)).encode()
+
+
+def ambiente():
+    """Controller e monitor con wallbox simulata e orologio virtuale"""
+    orologio = OrologioVirtuale(T0)
+    swi.time = orologio
+    swi.SYSTEM_STATE['LOGS'].output = lambda *a, **k: None
+    swi.notifica = lambda messaggio: None
+    wallbox = swi.WallboxController()
+    wallbox.client = WallboxSimulata(orologio)
+    wallbox.dispatcher = DispatcherSincrono(wallbox.send_command, orologio)
+    swi.wallbox_instance = wallbox
+    wallbox.initialize()
+    return orologio, wallbox, swi.EnergyMonitor()
+
+
+def riempi_storico(n, orologio):
+    if len(swi.SYSTEM_STATE['STORICO']) == n:
+        return
+    storico = TelemetryRing(swi.CONFIG['STORICO_CAMPIONI'])
+    piramide = RollupPyramid()
+    for i in range(n):
+        t = orologio.t - n + i
+        fasi = (400.0 + i % 50, 0.0, 0.0, 3000.0 + i % 700, 0.0, 0.0)
+        storico.append(t, fasi, fasi[0], fasi[3], 1380.0)
+        piramide.aggiungi(t, fasi, fasi[0], fasi[3], 1380.0)
+    swi.SYSTEM_STATE['STORICO'] = storico
+    swi.SYSTEM_STATE['ROLLUP'] = piramide
+
+
+def casi(orologio, wallbox, monitor):
+    """Lista di (nome, prepara, chiamata): solo chiamata() viene cronometrata"""
+
+    def niente():
+        pass
+
+    def stato(acceso, carica, solare, consumo, casa, timer=0.0):
+        orologio.sleep(100)
+        wallbox.is_on = acceso
+        wallbox.current_set_power = carica
+        wallbox.display_power = carica
+        wallbox.last_update_time = 0
+        wallbox.last_power_cmd_time = orologio.t - 10
+        wallbox.pending_off_until = orologio.t + timer if timer else 0
+        wallbox.time_turned_off = 0
+        wallbox.manual_off = False
+        wallbox._ultimo_onoff = (None, None)
+        monitor.solar_now = solare
+        monitor.total_grid_load = consumo
+        monitor.house_load = casa
+
+    lista = []
+    pacchetti = {
+        'electricity': elettricita([350.0, 120.0, 90.0, 2100.0, 1900.0, 2050.0]),
+        'solar': SOLAR_TMPL.format(ts=int(T0), gen=6050.0, exp=2500.0).encode(),
+        'sconosciuto': b"<weather id='443719000000' code='800'><temperature>21.00</temperature></weather>",
+    }
+    for tipo, data in pacchetti.items():
+        lista.append((f'parse_packet/{tipo}', niente, lambda data=data: monitor.parse_packet(data)))
+
+    rami = {
+        'accensione': dict(acceso=False, carica=1380, solare=5000.0, consumo=500.0, casa=500.0),
+        'diminuzione': dict(acceso=True, carica=3000, solare=2500.0, consumo=4000.0, casa=1000.0),
+        'aumento': dict(acceso=True, carica=2000, solare=6000.0, consumo=2500.0, casa=500.0),
+        'timer_spegnimento': dict(acceso=True, carica=1380, solare=1000.0, consumo=1800.0, casa=420.0, timer=30),
+    }
+    for ramo, valori in rami.items():
+        lista.append((f'run_logic/{ramo}', lambda valori=valori: stato(**valori),
+                      lambda: swi.run_logic(monitor, wallbox)))
+
+    base = dict(acceso=True, carica=2000, solare=6000.0, consumo=2500.0, casa=500.0)
+    lista.append(('set_power/bypass', lambda: stato(**base), lambda: wallbox.set_power(3000, bypass=True)))
+    lista.append(('set_power/filtrato', lambda: stato(**base), lambda: wallbox.set_power(3000, bypass=False)))
+
+    client = swi.app.test_client()
+    for n in (1000, 86400):
+        for url, etichetta in (('/api/data', ''), ('/api/data?finestra=86400', ',finestra=24h')):
+            lista.append((f'api_data/storico={n}{etichetta}', lambda n=n: riempi_storico(n, orologio),
+                          lambda url=url: client.get(url).get_data()))
+    return lista
+
+
+def misura(prepara, chiamata, tempo_s, minimo=20):
+    """Tempi in microsecondi di ogni chiamata, finché non sono passati tempo_s secondi"""
+    prepara()
+    chiamata()  # riscaldamento
+    campioni = []
+    fine = time.perf_counter() + tempo_s
+    while len(campioni) < minimo or time.perf_counter() < fine:
+        prepara()
+        inizio = time.perf_counter_ns()
+        chiamata()
+        campioni.append((time.perf_counter_ns() - inizio) / 1000)
+    campioni.sort()
+    return {
+        'mediana_us': round(statistics.median(campioni), 2),
+        'p95_us': round(campioni[int(len(campioni) * 0.95)], 2),
+        'n': len(campioni),
+    }
+
+
+def commit_corrente():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RADICE,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def confronta(risultati, baseline, soglia):
+    """Stampa il confronto e ritorna i nomi dei casi più lenti della soglia"""
+    lenti = []
+    print(f"\n{'caso':<40} {'base us':>10} {'ora us':>10} {'variazione':>11}")
+    for nome, r in risultati.items():
+        b = baseline['risultati'].get(nome)
+        if b is None:
+            print(f"{nome:<40} {'-':>10} {r['mediana_us']:>10.2f}       nuovo")
+            continue
+        rapporto = r['mediana_us'] / b['mediana_us'] if b['mediana_us'] else 1.0
+        esito = ''
+        if rapporto > 1 + soglia:
+            esito = '  PIÙ LENTO'
+            lenti.append(nome)
+        elif rapporto < 1 / (1 + soglia):
+            esito = '  più veloce'
+        print(f"{nome:<40} {b['mediana_us']:>10.2f} {r['mediana_us']:>10.2f} {(rapporto - 1) * 100:>+10.1f}%{esito}")
+    meta = baseline.get('meta', {})
+    print(f"\nbaseline: commit {meta.get('commit')} del {meta.get('data')}, Python {meta.get('python')}")
+    return lenti
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark del percorso di controllo")
+    parser.add_argument('--salva', help="scrive i risultati come baseline JSON")
+    parser.add_argument('--confronta', help="baseline JSON con cui confrontare")
+    parser.add_argument('--soglia', type=float, default=0.15, help="rallentamento tollerato (0.15 = 15%%)")
+    parser.add_argument('--tempo', type=float, default=0.3, help="secondi di misura per caso e per giro")
+    parser.add_argument('--giri', type=int, default=3, help="giri su tutti i casi; vale il giro migliore")
+    parser.add_argument('--filtro', help="solo i casi che contengono questo testo")
+    args = parser.parse_args()
+
+    orologio, wallbox, monitor = ambiente()
+    lista = [c for c in casi(orologio, wallbox, monitor) if not args.filtro or args.filtro in c[0]]
+    # I casi si alternano tra i giri e per ognuno vale la mediana del giro più
+    # veloce: un disturbo (frequenza CPU, altri processi) non sposta la baseline
+    risultati = {}
+    for _ in range(args.giri):
+        for nome, prepara, chiamata in lista:
+            r = misura(prepara, chiamata, args.tempo)
+            if nome not in risultati or r['mediana_us'] < risultati[nome]['mediana_us']:
+                risultati[nome] = r
+    print(f"{'caso':<40} {'mediana us':>11} {'p95 us':>10} {'chiamate':>9}")
+    for nome, r in risultati.items():
+        print(f"{nome:<40} {r['mediana_us']:>11.2f} {r['p95_us']:>10.2f} {r['n']:>9}")
+
+    if args.salva:
+        with open(args.salva, 'w') as f:
+            json.dump({
+                'meta': {
+                    'commit': commit_corrente(),
+                    'data': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'python': platform.python_version(),
+                    'piattaforma': platform.platform(),
+                },
+                'risultati': risultati,
+            }, f, indent=1)
+        print(f"\nbaseline salvata in {args.salva}")
+
+    if args.confronta:
+        with open(args.confronta) as f:
+            baseline = json.load(f)
+        lenti = confronta(risultati, baseline, args.soglia)
+        if lenti:
+            print(f"{len(lenti)} casi oltre la soglia del {args.soglia * 100:.0f}%: {', '.join(lenti)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Benchmark del parsing pacchetti: ElementTree (vecchio parse_packet) contro PacketDecoder.
+
+Uso:
+    python benchmarks/bench_decoder.py                 # pacchetti di esempio generati
+    python benchmarks/bench_decoder.py pacchetti.txt   # payload registrati, uno per riga
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packet_decoder import PacketDecoder, decode_et  # noqa: E402
+
+ELECTRICITY_TMPL = (
+    "<electricity id='443719000000' ver='2.0'><timestamp>{ts}</timestamp>"
+    "<signal rssi='-63' lqi='0'/><battery level='100%'/><channels>{chans}</channels>"
+    "<property><current><watts>{tot:.2f}</watts><cost>0.00</cost></current>"
+    "<day><wh>0.00</wh><cost>0.00</cost></day><tariff><curr_price>0.20</curr_price>"
+    "<block_limit>4294967295</block_limit><block_usage>0</block_usage></tariff></property></electricity>"
+)
+CHAN_TMPL = "<chan id='{id}'><curr units='w'>{w:.2f}</curr><day units='wh'>{d:.2f}</day></chan>"
+SOLAR_TMPL = (
+    "<solar id='443719000000'><timestamp>{ts}</timestamp><current>"
+    "<generating units='w'>{gen:.2f}</generating><exporting units='w'>{exp:.2f}</exporting>"
+    "</current><day><generated units='wh'>0.00</generated><exported units='wh'>0.00</exported></day></solar>"
+)
+
+
+def pacchetti_esempio(n=2000, seed=1):
+    rnd = random.Random(seed)
+    ts = 1700000000
+    out = []
+    for i in range(n):
+        ts += 6
+        fasi = [rnd.uniform(0, 3000) for _ in range(6)]
+        chans = ''.join(CHAN_TMPL.format(id=c, w=w, d=w * 3) for c, w in enumerate(fasi))
+        out.append(ELECTRICITY_TMPL.format(ts=ts, chans=chans, tot=sum(fasi)).encode())
+        if i % 2:
+            gen = sum(fasi[3:])
+            out.append(SOLAR_TMPL.format(ts=ts, gen=gen, exp=gen / 2).encode())
+    return out
+
+
+def pacchetti_malformati(pacchetti):
+    """Datagrammi corrotti costruiti dai primi pacchetti: il decoder deve dare lo stesso
+    risultato di ElementTree (quasi sempre None), non i valori letti dal fast path"""
+    e = next(p for p in pacchetti if p.startswith(b'<electricity'))
+    s = next(p for p in pacchetti if p.startswith(b'<solar'))
+    return [
+        e.replace(b'<channels>', b'<channels><x>'),              # tag mai chiuso
+        e.replace(b'</chan>', b'', 1),                           # chan mai chiuso
+        e.replace(b'</curr>', b'</cur>', 1),                     # chiusura sbagliata
+        e.replace(b"<chan id='0'>", b"<chan id='0>"),            # apice aperto
+        e.replace(b'</channels>', b'</channels></channels>'),    # chiusura in più
+        e.replace(b'<timestamp>', b'<timestamp>&rotto;'),        # entità sconosciuta
+        e.replace(b'<timestamp>', b'<timestamp>\x01'),           # carattere non ammesso
+        e[:len(e) // 2] + b'</electricity>',                     # troncato
+        s.replace(b'<current>', b'<current><y>'),
+        s[:len(s) // 2] + b'</solar>',
+    ]
+
+
+def carica_pacchetti(path):
+    with open(path, 'rb') as f:
+        return [riga.rstrip(b'\r\n') for riga in f if riga.strip()]
+
+
+def misura(nome, fn, pacchetti, ripetizioni=5):
+    migliore = None
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        for p in pacchetti:
+            fn(p)
+        dt = time.perf_counter() - t0
+        migliore = dt if migliore is None else min(migliore, dt)
+    rate = len(pacchetti) / migliore
+    print(f"{nome:<34} {rate:>12,.0f} pacchetti/s  ({migliore * 1e6 / len(pacchetti):.2f} us/pacchetto)")
+    return rate
+
+
+def main():
+    if len(sys.argv) > 1:
+        pacchetti = carica_pacchetti(sys.argv[1])
+        print(f"Payload registrati: {len(pacchetti)} da {sys.argv[1]}")
+    else:
+        pacchetti = pacchetti_esempio()
+        print(f"Payload di esempio: {len(pacchetti)}")
+
+    decoder = PacketDecoder()
+    diversi = sum(1 for p in pacchetti if decoder.decode(p) != decode_et(p))
+    if diversi:
+        print(f"ATTENZIONE: {diversi} pacchetti decodificati diversamente da ElementTree")
+    malformati = pacchetti_malformati(pacchetti_esempio(4))
+    diversi = [p for p in malformati if PacketDecoder().decode(p) != decode_et(p)]
+    print(f"Malformati: {len(malformati) - len(diversi)}/{len(malformati)} come ElementTree")
+    for p in diversi:
+        print(f"ATTENZIONE: malformato decodificato diversamente da ElementTree: {p[:80]!r}...")
+
+    base = misura("ElementTree (originale)", decode_et, pacchetti)
+    veloce = misura("PacketDecoder", PacketDecoder().decode, pacchetti)
+    ripetuti = [p for p in pacchetti for _ in range(2)]
+    misura("PacketDecoder (payload ripetuti)", PacketDecoder().decode, ripetuti)
+    print(f"Speedup: {veloce / base:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Tempo di import a freddo di solar_webinterface e dei sottosistemi caricati solo quando servono.
+
+Ogni misura gira in un processo Python nuovo (nessun modulo già in cache),
+come a ogni riavvio del servizio. Per solar_webinterface mostra anche i moduli
+più costosi secondo `python -X importtime`.
+
+Uso:
+    python benchmarks/bench_import.py [ripetizioni]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (etichetta, codice di import)
+CASI = (
+    ('solar_webinterface', 'import solar_webinterface'),
+    ('  telegram.ext (lazy)', 'import telegram.ext'),
+    ('  matplotlib Agg (lazy)', 'import matplotlib.figure, matplotlib.backends.backend_agg, matplotlib.dates'),
+    ('  matplotlib.pyplot (prima)', 'import matplotlib; matplotlib.use("Agg"); import matplotlib.pyplot'),
+)
+
+MISURA = "import time; t = time.perf_counter(); {codice}; print(time.perf_counter() - t)"
+
+
+def tempo_import(codice):
+    uscita = subprocess.run([sys.executable, '-c', MISURA.format(codice=codice)], cwd=RADICE,
+                            capture_output=True, text=True, check=True)
+    return float(uscita.stdout.strip().splitlines()[-1])
+
+
+def piu_costosi(n=10):
+    """Moduli con il tempo cumulativo più alto importando solar_webinterface"""
+    uscita = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import solar_webinterface'],
+                            cwd=RADICE, capture_output=True, text=True, check=True)
+    righe = []
+    for riga in uscita.stderr.splitlines():
+        if not riga.startswith('import time:') or 'cumulative' in riga:
+            continue
+        _, cumulativo, nome = riga[len('import time:'):].split('|')
+        righe.append((int(cumulativo), nome.rstrip()))
+    righe.sort(reverse=True)
+    return righe[:n]
+
+
+def main():
+    ripetizioni = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"import a freddo, mediana su {ripetizioni} processi")
+    for etichetta, codice in CASI:
+        try:
+            tempi = [tempo_import(codice) for _ in range(ripetizioni)]
+        except subprocess.CalledProcessError:
+            print(f"{etichetta:<30} non disponibile")
+            continue
+        print(f"{etichetta:<30} {statistics.median(tempi) * 1000:8.1f} ms  (min {min(tempi) * 1000:.1f})")
+
+    print("\nmoduli più costosi in solar_webinterface (cumulativo):")
+    for cumulativo, nome in piu_costosi():
+        print(f"{cumulativo / 1000:8.1f} ms  {nome}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Latenza pacchetto -> decisione con una wallbox lenta simulata.
+
+Confronta il vecchio ciclo per-pacchetto (recvfrom + run_logic per ogni pacchetto)
+con il ciclo su thread a tick fissi (ciclo_ricezione) e con la modalità asyncio
+(ControlloAsync). I pacchetti vengono inviati in UDP su localhost; ogni comando
+alla wallbox dorme RITARDO secondi (sul thread della coda comandi).
+
+Uso:
+    python benchmarks/bench_ingestione.py [durata_s] [pacchetti_al_s] [ritardo_wallbox_s]
+"""
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solar_webinterface as swi  # noqa: E402
+from bench_decoder import ELECTRICITY_TMPL, CHAN_TMPL  # noqa: E402
+
+PARSE_PACKET = swi.EnergyMonitor.parse_packet
+RUN_LOGIC = swi.run_logic
+
+
+class Misura:
+    """Registra l'invio di ogni pacchetto e la latenza di ogni decisione."""
+    def __init__(self):
+        self.inviati = {}
+        self.in_attesa = None
+        self.latenze = []
+        self.elaborati = 0
+
+    def pacchetto(self, data):
+        self.elaborati += 1
+        if self.in_attesa is None:
+            self.in_attesa = self.inviati.get(data)
+
+    def decisione(self):
+        if self.in_attesa is not None:
+            self.latenze.append(time.monotonic() - self.in_attesa)
+            self.in_attesa = None
+
+
+def prepara(misura, ritardo):
+    swi.log_msg = lambda msg: None
+    swi.CONFIG['UPDATE_INTERVAL_S'] = 0
+    swi.CONFIG['COOLDOWN_ACCENSIONE'] = 0
+    swi.CONFIG['POTENZA_PROTEZIONE'] = 0
+
+    def send_command(self, params):
+        time.sleep(ritardo)
+        return True
+    swi.WallboxController.send_command = send_command
+
+    def parse_packet(self, data):
+        misura.pacchetto(data)
+        return PARSE_PACKET(self, data)
+    swi.EnergyMonitor.parse_packet = parse_packet
+
+    def run_logic(monitor, wallbox):
+        misura.decisione()
+        RUN_LOGIC(monitor, wallbox)
+    swi.run_logic = run_logic
+
+
+def invia(misura, porta, durata, rate):
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    n = int(durata * rate)
+    for i in range(n):
+        # il solare oscilla per costringere run_logic a mandare comandi
+        solare = 6000 if (i // int(rate)) % 2 else 2500
+        fasi = [800, 300, 200, solare / 3, solare / 3, solare / 3]
+        chans = ''.join(CHAN_TMPL.format(id=c, w=w, d=0) for c, w in enumerate(fasi))
+        data = ELECTRICITY_TMPL.format(ts=i, chans=chans, tot=sum(fasi)).encode()
+        misura.inviati[data] = time.monotonic()
+        tx.sendto(data, ('127.0.0.1', porta))
+        time.sleep(1 / rate)
+    tx.close()
+
+
+def socket_locale():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    return sock, sock.getsockname()[1]
+
+
+def controller():
+    # nessuna sequenza di initialize(): la wallbox simulata è subito pronta
+    monitor, wallbox = swi.EnergyMonitor(), swi.WallboxController()
+    wallbox.pronto.set()
+    return monitor, wallbox
+
+
+def ciclo_per_pacchetto(sock, fine):
+    monitor, wallbox = controller()
+    sock.settimeout(0.2)
+    while time.monotonic() < fine:
+        try:
+            data, _ = sock.recvfrom(65535)
+        except socket.timeout:
+            continue
+        if monitor.parse_packet(data) == "TRIGGER":
+            swi.run_logic(monitor, wallbox)
+
+
+def ciclo_tick(sock, fine):
+    monitor, wallbox = controller()
+    threading.Thread(target=swi.ciclo_ricezione, args=(sock, monitor, wallbox), daemon=True).start()
+    time.sleep(max(0, fine - time.monotonic()))
+
+
+async def ciclo_async(sock, durata):
+    monitor, wallbox = controller()
+    try:
+        await asyncio.wait_for(swi.ingestione_async(monitor, wallbox, sock), durata)
+    except asyncio.TimeoutError:
+        pass
+
+
+def esegui(nome, durata, rate, ritardo):
+    misura = Misura()
+    prepara(misura, ritardo)
+    sock, porta = socket_locale()
+    sender = threading.Thread(target=invia, args=(misura, porta, durata, rate))
+    sender.start()
+    t0 = time.monotonic()
+    if nome == 'pacchetto':
+        ciclo_per_pacchetto(sock, t0 + durata + 1)
+    elif nome == 'tick':
+        ciclo_tick(sock, t0 + durata + 1)
+    else:
+        asyncio.run(ciclo_async(sock, durata + 1))
+    sender.join()
+
+    lat = sorted(misura.latenze) or [0.0]
+    p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+    print(f"{nome:<10} inviati={len(misura.inviati):4d} elaborati={misura.elaborati:4d} decisioni={len(misura.latenze):4d} "
+          f"latenza p50={statistics.median(lat) * 1000:7.1f}ms p95={p95 * 1000:7.1f}ms max={lat[-1] * 1000:7.1f}ms")
+
+
+def main():
+    durata = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    ritardo = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    print(f"Durata {durata}s, {rate} pacchetti/s, wallbox lenta {ritardo}s per comando, "
+          f"tick {swi.CONFIG['TICK_CONTROLLO_S']}s")
+    for nome in ('pacchetto', 'tick', 'asyncio'):
+        esegui(nome, durata, rate, ritardo)
+
+
+if __name__ == "__main__":
+    main()
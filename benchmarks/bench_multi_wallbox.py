@@ -0,0 +1,124 @@
+"""Decisione e invio comandi con 1..10 wallbox: run_logic_gruppo con le code
+per wallbox contro l'invio sequenziale dei comandi.
+
+Ogni wallbox è quella simulata di replay.py con una pausa di --rtt secondi a
+comando, come il round trip HTTP. A ogni decisione il surplus cambia di
+qualche kW, così tutte le wallbox ricevono una quota nuova. Si misura:
+- decisione: durata di run_logic_gruppo (ripartizione + accodamento comandi)
+- fan-out: dall'inizio della decisione a quando tutte le wallbox hanno
+  confermato il loro comando
+- sequenziale: gli stessi comandi inviati uno dopo l'altro dal thread che
+  decide, come farebbe un ciclo sulle wallbox senza code
+e a parte il costo di allocazione.ripartisci() per ogni politica.
+
+Uso:
+    python benchmarks/bench_multi_wallbox.py [--rtt 0.02] [--decisioni 50]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import solar_webinterface as swi  # noqa: E402
+from allocazione import POLITICHE, Richiesta, ripartisci  # noqa: E402
+from replay import WallboxSimulata  # noqa: E402
+
+NUMERI = (1, 2, 5, 10)
+
+
+class WallboxLenta(WallboxSimulata):
+    def __init__(self, rtt):
+        super().__init__(time)
+        self.rtt = rtt
+
+    def comando(self, params):
+        time.sleep(self.rtt)
+        return super().comando(params)
+
+
+def gruppo(n, rtt):
+    wallbox = [swi.WallboxController(f"wb{i}", principale=(i == 0)) for i in range(n)]
+    for w in wallbox:
+        w.client = WallboxLenta(rtt)
+        w.is_on = True
+        w.current_set_power = w.display_power = 3000
+        w.smoothing_alpha = 1.0
+        w.max_delta_per_sec = 1e9
+        w.pronto.set()
+    return swi.GruppoWallbox(wallbox, priorita=list(range(n)))
+
+
+def monitor(surplus_per_wallbox, n):
+    m = swi.EnergyMonitor()
+    m.solar_now = surplus_per_wallbox * n + 1000
+    m.total_grid_load = 1000.0
+    m.house_load = 1000.0
+    return m
+
+
+def mediana_p95(valori):
+    valori = sorted(valori)
+    return statistics.median(valori), valori[int(len(valori) * 0.95)]
+
+
+def prova(n, rtt, decisioni):
+    g = gruppo(n, rtt)
+    tempi, fanout = [], []
+    for k in range(decisioni):
+        m = monitor(3000 if k % 2 else 5000, n)
+        inizio = time.perf_counter()
+        swi.run_logic_gruppo(m, g)
+        tempi.append(time.perf_counter() - inizio)
+        for w in g.wallbox:
+            w.dispatcher.attendi(10)
+        fanout.append(time.perf_counter() - inizio)
+
+    sequenziale = []
+    for k in range(max(5, decisioni // 10)):
+        inizio = time.perf_counter()
+        quote = ripartisci(3000 * n if k % 2 else 5000 * n, g.richieste(), 'equa')
+        for w, quota in zip(g.wallbox, quote):
+            w.client.comando({'btn': f'P{quota}'})
+        sequenziale.append(time.perf_counter() - inizio)
+    inviati = sum(w.dispatcher.stats['inviati'] for w in g.wallbox)
+    return mediana_p95(tempi), mediana_p95(fanout), statistics.median(sequenziale), inviati
+
+
+def costo_ripartizione(n, politica, giri=2000):
+    richieste = [Richiesta(f"wb{i}", 1380 if i % 2 else 4140, 7360 if i % 2 else 22000, i % 3, 2000 if i == 0 else 0, i % 2 == 0)
+                 for i in range(n)]
+    inizio = time.perf_counter()
+    for k in range(giri):
+        ripartisci(2500.0 * n + k, richieste, politica)
+    return (time.perf_counter() - inizio) / giri
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decisione e fan-out dei comandi con più wallbox")
+    parser.add_argument('--rtt', type=float, default=0.02, help="secondi di round trip simulato per comando")
+    parser.add_argument('--decisioni', type=int, default=50, help="decisioni per numero di wallbox")
+    args = parser.parse_args()
+
+    swi.SYSTEM_STATE['LOGS'].output = lambda *a, **k: None
+    swi.notifica = lambda messaggio: None
+    swi.CONFIG['UPDATE_INTERVAL_S'] = 0
+    swi.CONFIG['RIPARTIZIONE'] = 'equa'
+
+    print(f"round trip simulato {args.rtt * 1000:.0f} ms, {args.decisioni} decisioni, ripartizione equa\n")
+    print(f"{'wallbox':>7} {'decisione us p50/p95':>22} {'fan-out ms p50/p95':>20} {'sequenziale ms':>15} {'comandi':>8}")
+    for n in NUMERI:
+        (d50, d95), (f50, f95), seq, inviati = prova(n, args.rtt, args.decisioni)
+        print(f"{n:>7} {d50 * 1e6:>11.0f}/{d95 * 1e6:<10.0f} {f50 * 1000:>9.1f}/{f95 * 1000:<10.1f} "
+              f"{seq * 1000:>15.1f} {inviati:>8}")
+
+    print(f"\nallocazione.ripartisci, us per chiamata")
+    print(f"{'wallbox':>7} " + ''.join(f"{p:>11}" for p in POLITICHE))
+    for n in NUMERI:
+        print(f"{n:>7} " + ''.join(f"{costo_ripartizione(n, p) * 1e6:>11.1f}" for p in POLITICHE))
+
+
+if __name__ == '__main__':
+    main()
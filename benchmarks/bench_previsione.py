@@ -0,0 +1,98 @@
+"""Effetto della previsione sui comandi wallbox: le stesse giornate decise
+sull'ultima lettura (run_logic com'è) e sul surplus previsto da previsione.py.
+
+La previsione non entra nel run_logic del servizio, quindi le due varianti
+girano nella simulazione di taratura.py (stessi tick, stessa macchina a
+stati, verificata con replay.py), dove PREVISIONE=True sostituisce le
+letture con i valori previsti. Per ogni registrazione riporta comandi
+all'ora, cambi potenza, accensioni, timer di spegnimento avviati,
+autoconsumo, quota della wallbox coperta dal solare e prelievo dalla rete,
+poi i totali su tutte le giornate. Senza registrazioni genera le giornate
+sintetiche di giornate.py (sereno, nuvole, variabile) in una cartella
+temporanea.
+
+Uso:
+    python benchmarks/bench_previsione.py [registrazioni.rec.gz ...] [--semi 1 2 3]
+    python benchmarks/bench_previsione.py giorno.rec.gz --imposta PREVISIONE_ORIZZONTE_S=120
+"""
+import argparse
+import ast
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RADICE)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from taratura import CHIAVI_STATO, config_attuale, estrai_traccia, indicatori, simula  # noqa: E402
+
+VARIANTI = (('ultima lettura', {'PREVISIONE': False}), ('previsione', {'PREVISIONE': True}))
+SOMME = ('potenza', 'accensioni', 'spegnimenti', 'timer', 'durata_s',
+         'solare_kwh', 'autoconsumo_kwh', 'wallbox_kwh', 'wallbox_solare_kwh', 'rete_kwh')
+
+
+def simula_giornata(path, config, trifase):
+    traccia = estrai_traccia(path, config)
+    pmin = config['TRIFASE_MIN_POWER'] if trifase else config['MONOFASE_MIN_POWER']
+    pmax = config['TRIFASE_MAX_POWER'] if trifase else config['MONOFASE_MAX_POWER']
+    esito = simula(traccia, {k: [config[k]] for k in CHIAVI_STATO}, pmin, pmax)
+    return {k: v[0].item() for k, v in esito.items()}
+
+
+def totale(esiti):
+    """Somma delle giornate, con percentuali e comandi all'ora ricalcolati"""
+    return {k: v[0] for k, v in indicatori({k: np.array([sum(e[k] for e in esiti)]) for k in SOMME}).items()}
+
+
+def riga(nome, e):
+    return (f"{nome:<28} {e['comandi_ora']:>7.1f} {e['potenza']:>8.0f} {e['accensioni']:>6.0f} {e['timer']:>6.0f} "
+            f"{e['autoconsumo_pct']:>11.1f}% {e['wallbox_da_solare_pct']:>9.1f}% {e['wallbox_kwh']:>8.2f} "
+            f"{e['rete_kwh']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comandi e autoconsumo con e senza previsione")
+    parser.add_argument('registrazioni', nargs='*')
+    parser.add_argument('--semi', type=int, nargs='+', default=[1, 2], help="giornate sintetiche per tipo")
+    parser.add_argument('--imposta', action='append', default=[], metavar='CHIAVE=VALORE',
+                        help="valore di CONFIG per entrambe le varianti, ripetibile")
+    parser.add_argument('--trifase', action='store_true', help="impianto trifase (potenze minima e massima)")
+    parser.add_argument('--processi', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    base = config_attuale()
+    for voce in args.imposta:
+        chiave, _, valore = voce.partition('=')
+        base[chiave] = ast.literal_eval(valore)
+
+    registrazioni = args.registrazioni
+    if not registrazioni:
+        import giornate
+        cartella = tempfile.mkdtemp(prefix='giornate-')
+        registrazioni = [giornate.genera(os.path.join(cartella, f"{tipo}-{seme}.rec.gz"), tipo, seme)
+                         for tipo in giornate.TIPI for seme in args.semi]
+
+    lavori = [(path, {**base, **config}, args.trifase) for path in registrazioni for _, config in VARIANTI]
+    with multiprocessing.Pool(args.processi) as pool:
+        esiti = pool.starmap(simula_giornata, lavori)
+
+    print(f"{'giornata / variante':<28} {'cmd/h':>7} {'potenza':>8} {'accens':>6} {'timer':>6} "
+          f"{'autoconsumo':>12} {'wb solare':>10} {'wb kWh':>8} {'rete kWh':>8}")
+    per_variante = {nome: [] for nome, _ in VARIANTI}
+    for i, path in enumerate(registrazioni):
+        giornata = os.path.basename(path).split('.')[0]
+        for j, (nome, _) in enumerate(VARIANTI):
+            esito = esiti[i * len(VARIANTI) + j]
+            per_variante[nome].append(esito)
+            print(riga(f"{giornata} / {nome}", totale([esito])))
+    print()
+    for nome, lista in per_variante.items():
+        print(riga(f"TOTALE / {nome}", totale(lista)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Aggregati multi-risoluzione: costo per lettura e latenza di una query di
+grafico per finestre da pochi campioni a 7 giorni.
+
+Uso:
+    python benchmarks/bench_rollup.py [secondi_di_storico]
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rollup import RollupPyramid, storico_finestra  # noqa: E402
+from telemetry import TelemetryRing  # noqa: E402
+
+RIPETIZIONI = 200
+
+
+def main():
+    secondi = int(sys.argv[1]) if len(sys.argv) > 1 else 7 * 86400
+    ring = TelemetryRing(86400)
+    piramide = RollupPyramid()
+    rnd = random.Random(1)
+    t0 = time.time() - secondi
+
+    inizio = time.perf_counter()
+    for i in range(secondi):
+        fasi = (rnd.uniform(0, 3000), rnd.uniform(0, 3000), rnd.uniform(0, 3000),
+                rnd.uniform(0, 2000), rnd.uniform(0, 2000), rnd.uniform(0, 2000))
+        piramide.aggiungi(t0 + i, fasi, sum(fasi[:3]), sum(fasi[3:]), 0)
+    durata = time.perf_counter() - inizio
+    print(f"aggiungi: {durata / secondi * 1e6:.1f} µs/lettura, memoria aggregati {piramide.memoria() / 1e6:.2f} MB")
+
+    for i in range(max(0, secondi - ring.capacita), secondi):
+        ring.append(t0 + i, (0,) * 6, rnd.uniform(0, 3000), rnd.uniform(0, 3000), 0)
+
+    fine = t0 + secondi
+    print("finestra     risoluzione  punti  mediana ms")
+    # riferimento: gli ultimi 30 campioni grezzi come nella dashboard originale
+    tempi = []
+    for _ in range(RIPETIZIONI):
+        s = time.perf_counter()
+        [ring.valori(nome, ultimi=30) for nome in ('t', 'grid', 'solar', 'wb')]
+        tempi.append(time.perf_counter() - s)
+    print(f"{'30 campioni':<12} {'-':>11} {30:>6} {statistics.median(tempi) * 1000:>11.3f}")
+    for finestra, nome in ((3600, '1 ora'), (21600, '6 ore'), (86400, '24 ore'), (604800, '7 giorni')):
+        tempi = []
+        for _ in range(RIPETIZIONI):
+            s = time.perf_counter()
+            risoluzione, serie = storico_finestra(ring, piramide, fine - finestra, fine + 1, 300)
+            tempi.append(time.perf_counter() - s)
+        print(f"{nome:<12} {risoluzione:>10}s {len(serie['t']):>6} {statistics.median(tempi) * 1000:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
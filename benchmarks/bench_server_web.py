@@ -0,0 +1,197 @@
+"""Server web sotto carico: richieste al secondo e jitter del ciclo di controllo
+con il server di sviluppo di werkzeug e con waitress a pool limitato.
+
+Il server gira in un processo figlio insieme a un ciclo di controllo vero
+(ControlloAsync: coalescer, executor, run_logic con la wallbox simulata di
+replay.py) che scatta ogni --tick secondi e misura:
+- ritardo del risveglio: quanto il loop asyncio si sveglia dopo l'orario del tick
+- tick -> decisione: dall'orario del tick alla fine di run_logic
+Le dashboard sono thread in questo processo, ognuna con la sua connessione
+keep-alive, e chiedono senza pause un giro di /api/data (live e 24 ore),
+/api/logs, /metrics e la pagina, accettando gzip e senza ETag (caso peggiore).
+
+Uso:
+    python benchmarks/bench_server_web.py [secondi_per_prova] [--tick 0.05]
+    python benchmarks/bench_server_web.py 10 --clienti 0 10 50 --threads 2 4 8
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RADICE)
+
+RICHIESTE = ('/api/data?finestra=86400&punti=300', '/api/data', '/api/logs?limite=200', '/metrics', '/')
+
+
+def percentile(valori, p):
+    valori = sorted(valori)
+    return valori[min(len(valori) - 1, int(len(valori) * p))] if valori else 0.0
+
+
+# -----------------------------------------------------------
+# PROCESSO SERVER
+# -----------------------------------------------------------
+
+async def sonda(controllo, tick, misure):
+    """Tick come ControlloAsync.run, con un pacchetto nuovo a ogni giro"""
+    from bench_controllo import elettricita
+
+    loop = asyncio.get_running_loop()
+    rnd = random.Random(1)
+    prossimo = loop.time()
+    while True:
+        prossimo += tick
+        await asyncio.sleep(prossimo - loop.time())
+        ritardo = loop.time() - prossimo
+        controllo.on_packet(elettricita([rnd.uniform(-3000, 1500), 0, 0, rnd.uniform(1500, 6000), 0, 0]))
+        pacchetti, t_pacchetto = controllo.coalescer.preleva()
+        await loop.run_in_executor(controllo.executor, controllo._decidi, pacchetti, t_pacchetto)
+        misure.append((ritardo, loop.time() - prossimo))
+
+
+def server(modo, threads, tick):
+    import solar_webinterface as swi
+    from replay import WallboxSimulata
+    from rollup import RollupPyramid
+    from telemetry import TelemetryRing
+    from web_server import ServerWeb
+
+    swi.SYSTEM_STATE['LOGS'].output = lambda *a, **k: None
+    swi.notifica = lambda messaggio: None
+    storico = TelemetryRing(swi.CONFIG['STORICO_CAMPIONI'])
+    piramide = RollupPyramid()
+    t0 = time.time() - storico.capacita
+    for i in range(storico.capacita):
+        fasi = (400.0 + i % 50, 0.0, 0.0, 3000.0 + i % 700, 0.0, 0.0)
+        storico.append(t0 + i, fasi, fasi[0], fasi[3], 1380.0)
+        piramide.aggiungi(t0 + i, fasi, fasi[0], fasi[3], 1380.0)
+    swi.SYSTEM_STATE['STORICO'] = storico
+    swi.SYSTEM_STATE['ROLLUP'] = piramide
+
+    wallbox = swi.WallboxController()
+    wallbox.client = WallboxSimulata(time)
+    swi.wallbox_instance = wallbox
+    wallbox.dispatcher.esegui(wallbox.initialize).result()
+    controllo = swi.ControlloAsync(swi.EnergyMonitor(), wallbox)
+    misure = []
+    threading.Thread(target=lambda: asyncio.run(sonda(controllo, tick, misure)), daemon=True).start()
+
+    swi.asset_statici.carica()
+    web = ServerWeb(swi.app, '127.0.0.1', 0, modo, threads, connessioni=1000, log=lambda m: None)
+    threading.Thread(target=web.servi, daemon=True).start()
+    print(f"porta {web.porta}", flush=True)
+
+    sys.stdin.readline()  # "via": da qui si misura
+    del misure[:]
+    cpu = time.process_time()
+    sys.stdin.readline()  # "fine"
+    cpu = time.process_time() - cpu
+    ritardi = [r for r, _ in misure]
+    decisioni = [d for _, d in misure]
+    print(json.dumps({
+        'cpu_s': cpu,
+        'tick': len(misure),
+        'ritardo_ms': [percentile(ritardi, p) * 1000 for p in (0.5, 0.99, 1.0)],
+        'decisione_ms': [percentile(decisioni, p) * 1000 for p in (0.5, 0.99, 1.0)],
+    }), flush=True)
+    os._exit(0)
+
+
+# -----------------------------------------------------------
+# DASHBOARD
+# -----------------------------------------------------------
+
+def dashboard(porta, fine, risultati):
+    connessione = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+    i = random.randrange(len(RICHIESTE))
+    while time.monotonic() < fine:
+        url = RICHIESTE[i % len(RICHIESTE)]
+        i += 1
+        inizio = time.perf_counter()
+        try:
+            connessione.request('GET', url, headers={'Accept-Encoding': 'gzip'})
+            risposta = connessione.getresponse()
+            risposta.read()
+            stato = risposta.status
+        except (OSError, http.client.HTTPException):
+            connessione.close()
+            connessione = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+            stato = 0
+        risultati.append((stato, time.perf_counter() - inizio))
+    connessione.close()
+
+
+def prova(modo, threads, clienti, durata, tick):
+    processo = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--server', modo, str(threads), str(tick)],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    porta = int(processo.stdout.readline().split()[1])
+    time.sleep(1.0)  # primi tick e import a regime
+    risultati = []
+    fine = time.monotonic() + durata
+    dashboard_threads = [threading.Thread(target=dashboard, args=(porta, fine, risultati)) for _ in range(clienti)]
+    processo.stdin.write("via\n")
+    processo.stdin.flush()
+    for t in dashboard_threads:
+        t.start()
+    if clienti:
+        for t in dashboard_threads:
+            t.join()
+    else:
+        time.sleep(durata)
+    processo.stdin.write("fine\n")
+    processo.stdin.flush()
+    esito = json.loads(processo.stdout.readline())
+    processo.wait()
+    riuscite = [dt for stato, dt in risultati if stato == 200]
+    esito.update({
+        'richieste_s': len(riuscite) / durata,
+        'errori': len(risultati) - len(riuscite),
+        'latenza_ms': [percentile(riuscite, p) * 1000 for p in (0.5, 0.99)],
+        'cpu_per_richiesta_us': esito['cpu_s'] / max(len(riuscite), 1) * 1e6 if riuscite else 0.0,
+    })
+    return esito
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--server':
+        server(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))
+        return
+
+    parser = argparse.ArgumentParser(description="Server web sotto carico e jitter del controllo")
+    parser.add_argument('durata', type=float, nargs='?', default=10.0, help="secondi per prova")
+    parser.add_argument('--tick', type=float, default=0.05, help="periodo del ciclo di controllo simulato")
+    parser.add_argument('--clienti', type=int, nargs='+', default=[0, 10, 50], help="dashboard contemporanee")
+    parser.add_argument('--threads', type=int, nargs='+', default=[2, 4, 8], help="thread di waitress da provare")
+    args = parser.parse_args()
+
+    from web_server import waitress
+    configurazioni = [('sviluppo', 0)]
+    if waitress is not None:
+        configurazioni += [('waitress', n) for n in args.threads]
+    else:
+        print("waitress non installato: provo solo il server di sviluppo")
+
+    print(f"{args.durata:.0f} s per prova, tick di controllo ogni {args.tick * 1000:.0f} ms")
+    print(f"{'server':<12} {'dashboard':>9} {'rich/s':>8} {'err':>5} {'lat p50':>8} {'lat p99':>8} {'CPU':>6} "
+          f"{'us/rich':>8} | {'risveglio p50/p99/max ms':>25} {'tick->decisione p50/p99/max ms':>31}")
+    for clienti in args.clienti:
+        for modo, threads in configurazioni:
+            r = prova(modo, threads, clienti, args.durata, args.tick)
+            nome = f"{modo}/{threads}" if threads else modo
+            ritardo = '/'.join(f"{v:.1f}" for v in r['ritardo_ms'])
+            decisione = '/'.join(f"{v:.1f}" for v in r['decisione_ms'])
+            print(f"{nome:<12} {clienti:>9} {r['richieste_s']:>8.0f} {r['errori']:>5} {r['latenza_ms'][0]:>8.1f} "
+                  f"{r['latenza_ms'][1]:>8.1f} {r['cpu_s'] / args.durata * 100:>5.0f}% {r['cpu_per_richiesta_us']:>8.0f} | "
+                  f"{ritardo:>25} {decisione:>31}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Archivio SQLite: velocità di inserimento sostenuta e latenza delle query per intervallo.
+
+Uso:
+    python benchmarks/bench_store.py [righe] [percorso_db]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telemetry_store import TelemetryStore  # noqa: E402
+
+
+def main():
+    righe = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    cartella = None
+    if len(sys.argv) > 2:
+        path = sys.argv[2]
+    else:
+        cartella = tempfile.TemporaryDirectory()
+        path = os.path.join(cartella.name, 'bench.db')
+
+    store = TelemetryStore(path, batch_s=1.0, max_coda=righe + 1)
+    rnd = random.Random(1)
+    t0 = 1700000000.0
+
+    # inserimento: il chiamante accoda, il thread archivio scrive a blocchi
+    inizio = time.perf_counter()
+    for i in range(righe):
+        fasi = (rnd.uniform(0, 3000), rnd.uniform(0, 3000), rnd.uniform(0, 3000),
+                rnd.uniform(0, 2000), rnd.uniform(0, 2000), rnd.uniform(0, 2000))
+        store.lettura(t0 + i, fasi, sum(fasi[:3]), sum(fasi[3:]), 0)
+    accodamento = time.perf_counter() - inizio
+    store.flush()
+    totale = time.perf_counter() - inizio
+    print(f"{righe} righe: accodamento {righe / accodamento:,.0f} righe/s "
+          f"({accodamento * 1e6 / righe:.2f} us/riga sul chiamante), "
+          f"scrittura su disco {righe / totale:,.0f} righe/s, batch={store.stats['batch']}")
+    print(f"Dimensione file: {os.path.getsize(path) / 1e6:.1f} MB ({os.path.getsize(path) / righe:.0f} byte/riga)")
+
+    # query per intervallo su finestre di varia ampiezza
+    for finestra in (60, 3600, 6 * 3600, 24 * 3600):
+        tempi = []
+        for _ in range(20):
+            da = t0 + rnd.uniform(0, max(1, righe - finestra))
+            q = time.perf_counter()
+            n = len(store.letture(da, da + finestra))
+            tempi.append((time.perf_counter() - q) * 1000)
+        print(f"Query {finestra:>6}s ({n:>6} righe): p50={statistics.median(tempi):7.2f}ms max={max(tempi):7.2f}ms")
+
+    q = time.perf_counter()
+    store.ultime_letture(86400)
+    print(f"Ricarica ultime 86400 letture all'avvio: {(time.perf_counter() - q) * 1000:.0f}ms")
+    store.chiudi()
+    if cartella is not None:
+        cartella.cleanup()
+
+
+if __name__ == "__main__":
+    main()
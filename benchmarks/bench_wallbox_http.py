@@ -0,0 +1,87 @@
+"""Round trip dei comandi wallbox: requests.get (connessione nuova ogni volta)
+contro WallboxClient / AsyncWallboxClient (keep-alive).
+
+Senza argomenti usa un finto index.json locale; con un URL misura la centralina vera
+(attenzione: manda comandi 'P' alla potenza minima).
+
+Uso:
+    python benchmarks/bench_wallbox_http.py [url] [comandi]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wallbox_client import WallboxClient, AsyncWallboxClient  # noqa: E402
+
+PARAMS = {'btn': 'P1380'}
+
+
+class FintaWallbox(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"tfase": "0"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def stampa(nome, tempi):
+    tempi = sorted(tempi)
+    print(f"{nome:<26} media={statistics.mean(tempi):6.2f}ms p50={statistics.median(tempi):6.2f}ms "
+          f"p95={tempi[int(len(tempi) * 0.95)]:6.2f}ms")
+
+
+def misura_sync(fn, n):
+    tempi = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        tempi.append((time.perf_counter() - t0) * 1000)
+    return tempi
+
+
+async def misura_async(url, n):
+    client = AsyncWallboxClient(url)
+    tempi = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        await client.comando(PARAMS)
+        tempi.append((time.perf_counter() - t0) * 1000)
+    await client.close()
+    return tempi
+
+
+def main():
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    if len(sys.argv) > 1:
+        url = sys.argv[1]
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FintaWallbox)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/index.json"
+    print(f"{n} comandi verso {url}")
+
+    stampa("requests.get (no pool)", misura_sync(lambda: requests.get(url, params=PARAMS, timeout=3), n))
+    client = WallboxClient(url)
+    stampa("WallboxClient", misura_sync(lambda: client.comando(PARAMS), n))
+    stampa("AsyncWallboxClient", asyncio.run(misura_async(url, n)))
+    print(f"Statistiche client: {client.tempi}")
+
+
+if __name__ == "__main__":
+    main()
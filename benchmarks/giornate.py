@@ -0,0 +1,125 @@
+"""Giornate sintetiche registrate nel formato di packet_recorder.py, per
+valutare la logica di controllo con replay.py quando non ci sono abbastanza
+registrazioni vere.
+
+Solare: curva di cielo sereno (picco --picco W) per tre tipi di giornata.
+- sereno: solo piccole oscillazioni
+- nuvole: nuvole sparse che passano in 20 s - 5 min, con bordi di qualche secondo
+- variabile: cielo coperto a tratti, nuvole frequenti e lunghe
+Casa: base con rumore, frigorifero a cicli, e a caso bollitore, forno,
+lavatrice e lavastoviglie. Un pacchetto electricity e uno solar ogni --passo
+secondi, come il contatore OWL. Stesso seme = stessa giornata.
+
+Uso:
+    python benchmarks/giornate.py cartella [--tipi sereno nuvole variabile] [--semi 1 2] [--passo 6]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RADICE)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_decoder import ELECTRICITY_TMPL, CHAN_TMPL, SOLAR_TMPL  # noqa: E402
+from packet_recorder import PacketRecorder  # noqa: E402
+
+T0 = 1718150400.0  # mezzanotte, giornata di giugno
+TIPI = {
+    # (nuvole all'ora, durata media s, attenuazione min-max)
+    'sereno': (0.0, 0, (1.0, 1.0)),
+    'nuvole': (8.0, 90, (0.3, 0.7)),
+    'variabile': (20.0, 240, (0.15, 0.6)),
+}
+# (nome, watt, durata s, volte al giorno, ore possibili)
+ELETTRODOMESTICI = (
+    ('bollitore', 2000, 180, 3, (7, 22)),
+    ('forno', 2200, 2400, 1, (11, 20)),
+    ('lavatrice', 1900, 900, 1, (9, 16)),
+    ('lavastoviglie', 1800, 1200, 1, (13, 22)),
+    ('phon', 1500, 300, 1, (7, 9)),
+)
+
+
+def cielo_sereno(ora, picco):
+    if not 5.5 < ora < 20.5:
+        return 0.0
+    return picco * math.sin((ora - 5.5) / 15 * math.pi) ** 1.5
+
+
+def nuvole(tipo, rnd):
+    """Lista di (inizio, fine, attenuazione) in secondi dalla mezzanotte"""
+    all_ora, durata, (a_min, a_max) = TIPI[tipo]
+    lista = []
+    t = 5 * 3600.0
+    while all_ora and t < 21 * 3600:
+        t += rnd.expovariate(all_ora / 3600)
+        d = max(20.0, rnd.expovariate(1 / durata))
+        lista.append((t, t + d, rnd.uniform(a_min, a_max)))
+        t += d
+    return lista
+
+
+def attenuazione(s, lista, i):
+    """Fattore delle nuvole al secondo s (bordi di 8 s); i = indice della prossima nuvola"""
+    while i < len(lista) and lista[i][1] + 8 < s:
+        i += 1
+    fattore = 1.0
+    if i < len(lista):
+        inizio, fine, a = lista[i]
+        if inizio - 8 <= s <= fine + 8:
+            bordo = min(1.0, (s - inizio + 8) / 8, (fine + 8 - s) / 8)
+            fattore = 1.0 - (1.0 - a) * bordo
+    return fattore, i
+
+
+def eventi_casa(rnd):
+    eventi = []
+    for _, watt, durata, volte, (da, a) in ELETTRODOMESTICI:
+        for _ in range(volte):
+            inizio = rnd.uniform(da, a) * 3600
+            eventi.append((inizio, inizio + durata * rnd.uniform(0.7, 1.3), watt))
+    return eventi
+
+
+def genera(path, tipo='nuvole', seme=1, passo=6.0, picco=6000.0):
+    rnd = random.Random(f"{tipo}-{seme}")
+    lista = nuvole(tipo, rnd)
+    eventi = eventi_casa(rnd)
+    rec = PacketRecorder(path)
+    i = 0
+    s = 0.0
+    while s < 86400:
+        fattore, i = attenuazione(s, lista, i)
+        solare = cielo_sereno(s / 3600, picco) * fattore * rnd.uniform(0.98, 1.02)
+        frigo = 120.0 if (s // 1200) % 2 else 0.0
+        casa = 220.0 + frigo + rnd.gauss(0, 30) + sum(w for a, b, w in eventi if a <= s < b)
+        fasi = [max(0.0, casa), 0.0, 0.0, solare, 0.0, 0.0]
+        chans = ''.join(CHAN_TMPL.format(id=c, w=w, d=0) for c, w in enumerate(fasi))
+        t = T0 + s
+        rec.registra(ELECTRICITY_TMPL.format(ts=int(t), chans=chans, tot=sum(fasi)).encode(), t)
+        rec.registra(SOLAR_TMPL.format(ts=int(t), gen=solare, exp=0).encode(), t + 0.3)
+        s += passo
+    rec.chiudi()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Giornate sintetiche per replay.py")
+    parser.add_argument('cartella')
+    parser.add_argument('--tipi', nargs='+', default=list(TIPI), choices=list(TIPI))
+    parser.add_argument('--semi', type=int, nargs='+', default=[1])
+    parser.add_argument('--passo', type=float, default=6.0, help="secondi tra due letture")
+    parser.add_argument('--picco', type=float, default=6000.0, help="W del solare a mezzogiorno, cielo sereno")
+    args = parser.parse_args()
+    os.makedirs(args.cartella, exist_ok=True)
+    for tipo in args.tipi:
+        for seme in args.semi:
+            path = genera(os.path.join(args.cartella, f"{tipo}-{seme}.rec.gz"), tipo, seme, args.passo, args.picco)
+            print(path)
+
+
+if __name__ == '__main__':
+    main()
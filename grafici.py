@@ -0,0 +1,117 @@
+import datetime
+import io
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# -----------------------------------------------------------
+# GRAFICI PNG PER TELEGRAM
+# -----------------------------------------------------------
+# Il disegno gira su un thread dedicato con l'API a oggetti di matplotlib
+# (Figure + FigureCanvasAgg): niente stato globale di pyplot e nessun blocco
+# del thread del bot. Ogni PNG resta in cache con la versione dello storico
+# (numero di letture ricevute): se non sono arrivati dati nuovi un secondo
+# /grafici sulla stessa finestra riceve subito l'immagine già pronta, e due
+# richieste contemporanee condividono lo stesso disegno.
+
+_DURATA = re.compile(r'^(\d+(?:[.,]\d+)?)\s*([smhdg]?)$', re.IGNORECASE)
+UNITA = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'g': 86400, '': 3600}
+DURATA_MAX = 366 * 86400
+
+
+def durata_da_testo(testo):
+    """'6h' -> 21600, '30m', '7d' (o '7g'), '90s'; senza unità sono ore. None se non valida"""
+    m = _DURATA.match(testo.strip())
+    if not m:
+        return None
+    secondi = int(float(m.group(1).replace(',', '.')) * UNITA[m.group(2).lower()])
+    return secondi if 0 < secondi <= DURATA_MAX else None
+
+
+def testo_durata(secondi):
+    for unita, s in (('d', 86400), ('h', 3600), ('m', 60)):
+        if secondi >= s and secondi % s == 0:
+            return f"{secondi // s}{unita}"
+    return f"{secondi}s"
+
+
+def disegna_png(t, grid, solar, wb, titolo):
+    """PNG del grafico potenze; t in epoch secondi"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import matplotlib.dates as mdates
+
+    times = [datetime.datetime.fromtimestamp(v) for v in t]
+    fig = Figure(figsize=(10, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(times, grid, label='Consumo Rete (W)', color='#ff6384', linewidth=2)
+    ax.fill_between(times, solar, color='#4bc0c0', alpha=0.2)
+    ax.plot(times, solar, label='Produzione Solare (W)', color='#4bc0c0', linewidth=2)
+    ax.fill_between(times, wb, color='#36a2eb', alpha=0.1)
+    ax.plot(times, wb, label='Potenza Wallbox (W)', color='#36a2eb', linewidth=2)
+
+    ax.set_title(titolo)
+    ax.set_xlabel("Orario")
+    ax.set_ylabel("Watt (W)")
+    ax.legend(loc="upper left")
+    ax.grid(True, linestyle='--', alpha=0.6)
+
+    # Pochi tick sull'asse X per evitare sovrapposizioni, formato adatto alla finestra
+    locator = mdates.AutoDateLocator(maxticks=8)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    for etichetta in ax.get_xticklabels():
+        etichetta.set_rotation(45)
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+class ChartRenderer:
+    """png(finestra, versione) -> concurrent.futures.Future con i byte PNG.
+
+    estrai(finestra) viene chiamato sul thread dei grafici e ritorna
+    (titolo, {'t': [...], 'grid': [...], 'solar': [...], 'wb': [...]}).
+    """
+
+    def __init__(self, estrai, max_cache=8):
+        self._estrai = estrai
+        self.max_cache = max_cache
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='grafici')
+        self._cache = OrderedDict()  # (finestra, versione) -> Future
+        self._lock = threading.Lock()
+        self.stats = {'generati': 0, 'dalla_cache': 0, 'errori': 0, 'ultimo_ms': 0.0}
+
+    def png(self, finestra, versione):
+        chiave = (finestra, versione)
+        with self._lock:
+            future = self._cache.get(chiave)
+            if future is not None and not (future.done() and future.exception() is not None):
+                self._cache.move_to_end(chiave)
+                self.stats['dalla_cache'] += 1
+                return future
+            # le versioni precedenti della stessa finestra non servono più
+            for vecchia in [k for k in self._cache if k[0] == finestra]:
+                del self._cache[vecchia]
+            future = self._executor.submit(self._genera, finestra)
+            self._cache[chiave] = future
+            while len(self._cache) > self.max_cache:
+                self._cache.popitem(last=False)
+        return future
+
+    def _genera(self, finestra):
+        inizio = time.perf_counter()
+        try:
+            titolo, serie = self._estrai(finestra)
+            png = disegna_png(serie['t'], serie['grid'], serie['solar'], serie['wb'], titolo)
+        except Exception:
+            self.stats['errori'] += 1
+            raise
+        self.stats['generati'] += 1
+        self.stats['ultimo_ms'] = (time.perf_counter() - inizio) * 1000
+        return png
@@ -0,0 +1,144 @@
+import re
+import threading
+import time
+from collections import deque
+from heapq import merge
+
+# -----------------------------------------------------------
+# LOG STRUTTURATO PER CONSOLE WEB E TERMINALE
+# -----------------------------------------------------------
+# Ogni messaggio ha un numero di sequenza crescente e un livello. Le righe
+# INFO (una o più per pacchetto) stanno in un anello separato e più piccolo,
+# così non spingono fuori decisioni, azioni ed errori. Una riga INFO identica
+# a una delle ultime non crea una riga nuova: aggiorna quella esistente
+# (contatore ×N) e la sposta in fondo con una nuova sequenza. Sul terminale
+# i ripetuti escono al massimo una volta ogni RIPETUTI_S secondi. Decisioni,
+# azioni ed errori non vengono mai uniti né trattenuti: ogni riga è un fatto
+# (un setpoint, un comando) e deve arrivare anche su journalctl.
+
+LIVELLI = ('INFO', 'DECISIONE', 'AZIONE', 'ERRORE')
+# prefissi usati nei messaggi che non sono un livello
+SINONIMI = {'TELEGRAM': 'AZIONE', 'WEB': 'AZIONE'}
+
+_TAG = re.compile(r'\s*\[([A-Z]+)')
+
+
+def livello_da_testo(testo):
+    """Livello dal prefisso del messaggio: "[DECISIONE] ..." -> DECISIONE"""
+    m = _TAG.match(testo)
+    if m:
+        tag = m.group(1)
+        return tag if tag in LIVELLI else SINONIMI.get(tag, 'INFO')
+    if testo.lstrip().lower().startswith('errore'):
+        return 'ERRORE'
+    return 'INFO'
+
+
+class _Voce:
+    __slots__ = ('id', 'seq', 't', 'livello', 'testo', 'n', 'chiave', 't_stampa')
+
+    def __init__(self, seq, t, livello, testo, chiave):
+        self.id = seq  # resta quello della prima occorrenza
+        self.seq = seq
+        self.t = t
+        self.livello = livello
+        self.testo = testo
+        self.n = 1
+        self.chiave = chiave
+        self.t_stampa = t
+
+    def riga(self):
+        riga = f"[{time.strftime('%H:%M:%S', time.localtime(self.t))}] {self.testo.strip()}"
+        return riga if self.n == 1 else f"{riga} ×{self.n}"
+
+    def come_dict(self):
+        return {'id': self.id, 'seq': self.seq, 'livello': self.livello, 'n': self.n, 'riga': self.riga()}
+
+
+class LogRing:
+    def __init__(self, capacita=400, capacita_info=100, finestra_ripetuti=8, ripetuti_s=60.0, output=print):
+        self.capacita = capacita            # righe DECISIONE / AZIONE / ERRORE
+        self.capacita_info = capacita_info  # righe INFO
+        self.finestra_ripetuti = finestra_ripetuti  # righe INFO recenti confrontate per i ripetuti
+        self.ripetuti_s = ripetuti_s
+        self.output = output
+        self._info = deque()
+        self._altri = deque()
+        self._lock = threading.Lock()
+        self.seq = 0            # sequenza dell'ultimo messaggio scritto
+        self._scartati_fino = 0  # sequenza più alta uscita dal buffer
+        self.stats = {'scritti': 0, 'ripetuti': 0, 'stampati': 0}
+
+    def __len__(self):
+        return len(self._info) + len(self._altri)
+
+    def scrivi(self, testo, livello=None):
+        t = time.time()
+        livello = livello or livello_da_testo(testo)
+        chiave = testo.strip()
+        info = livello == 'INFO'
+        anello = self._info if info else self._altri
+
+        with self._lock:
+            self.seq += 1
+            self.stats['scritti'] += 1
+            voce = None
+            for i in range(len(anello) - 1, max(-1, len(anello) - 1 - self.finestra_ripetuti), -1) if info else ():
+                if anello[i].chiave == chiave:
+                    voce = anello[i]
+                    del anello[i]
+                    break
+            if voce is not None:
+                voce.seq, voce.t = self.seq, t
+                voce.n += 1
+                self.stats['ripetuti'] += 1
+                stampa = t - voce.t_stampa >= self.ripetuti_s
+            else:
+                voce = _Voce(self.seq, t, livello, testo, chiave)
+                if len(anello) >= (self.capacita_info if info else self.capacita):
+                    self._scartati_fino = max(self._scartati_fino, anello.popleft().seq)
+                stampa = True
+            anello.append(voce)
+            if stampa:
+                voce.t_stampa = t
+                self.stats['stampati'] += 1
+                riga = voce.riga()
+
+        if stampa:
+            self.output(riga, flush=True)
+        return voce
+
+    def dopo(self, seq):
+        """(voci con sequenza > seq, sequenza attuale, reset). reset = True se il
+        cursore non è valido (None, di un altro avvio o troppo vecchio): allora
+        le voci sono tutto il buffer"""
+        with self._lock:
+            reset = seq is None or seq > self.seq or seq < self._scartati_fino
+            if reset:
+                seq = 0
+            nuove = []
+            for anello in (self._info, self._altri):
+                i = len(anello) - 1
+                while i >= 0 and anello[i].seq > seq:
+                    nuove.append(anello[i])
+                    i -= 1
+            nuove.sort(key=lambda v: v.seq)
+            return [v.come_dict() for v in nuove], self.seq, reset
+
+    def pagina(self, prima_di=None, limite=100, livelli=None):
+        """Le `limite` voci più recenti con sequenza < prima_di, in ordine
+        cronologico. Ritorna (voci, altre) con altre = True se ce ne sono di più vecchie"""
+        with self._lock:
+            voci = []
+            altre = False
+            for v in merge(reversed(self._info), reversed(self._altri), key=lambda v: -v.seq):
+                if prima_di is not None and v.seq >= prima_di:
+                    continue
+                if livelli and v.livello not in livelli:
+                    continue
+                if len(voci) == limite:
+                    altre = True
+                    break
+                voci.append(v.come_dict())
+        voci.reverse()
+        return voci, altre
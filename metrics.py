@@ -0,0 +1,147 @@
+from bisect import bisect_left
+
+# -----------------------------------------------------------
+# METRICHE PROMETHEUS
+# -----------------------------------------------------------
+# Gli istogrammi hanno i bucket allocati alla creazione: osserva() è una
+# ricerca binaria e due somme, senza lock. Ogni istogramma ha un solo thread
+# che scrive (ricezione, controllo, coda wallbox, notifiche); chi legge
+# /metrics può vedere un'osservazione in meno, mai un valore inventato.
+# Quando più thread misurano la stessa cosa (una coda comandi per wallbox)
+# ognuno prende le sue serie con per(wallbox=...): stesso nome di metrica,
+# un'etichetta in più, e ancora un solo thread che scrive ogni serie.
+# I contatori che il servizio tiene già nei suoi dizionari stats non vengono
+# duplicati: il registro li legge con una funzione al momento della richiesta.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Limiti dei bucket in secondi
+BUCKET_PARSE = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+BUCKET_DECISIONE = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BUCKET_HTTP = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BUCKET_TELEGRAM = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _etichette(nomi, valori, extra=''):
+    coppie = [f'{n}="{v}"' for n, v in zip(nomi, valori)]
+    if extra:
+        coppie.append(extra)
+    return '{' + ','.join(coppie) + '}' if coppie else ''
+
+
+def _numero(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Serie:
+    """Le serie di un istogramma con le stesse etichette fisse: un solo thread ci scrive"""
+
+    def __init__(self, limiti, fisse, valori):
+        self.limiti = limiti
+        self.fisse = fisse  # ((nome, valore), ...) aggiunte a ogni riga
+        self._serie = {v: self._nuova() for v in valori}
+
+    def _nuova(self):
+        return [[0] * (len(self.limiti) + 1), 0.0]  # conteggi per bucket (l'ultimo è +Inf), somma
+
+    def osserva(self, valore, etichetta=None):
+        serie = self._serie.get(etichetta)
+        if serie is None:
+            # etichetta non prevista: raro, crea la serie una volta sola
+            serie = self._serie.setdefault(etichetta, self._nuova())
+        serie[0][bisect_left(self.limiti, valore)] += 1
+        serie[1] += valore
+
+
+class Istogramma:
+    """Istogramma con etichetta opzionale (es. btn); valori = etichette note in anticipo"""
+
+    def __init__(self, nome, aiuto, limiti, etichetta=None, valori=()):
+        self.nome = nome
+        self.aiuto = aiuto
+        self.limiti = tuple(limiti)
+        self.etichetta = etichetta
+        self._valori = tuple(valori) if etichetta else (None,)
+        self._gruppi = [_Serie(self.limiti, (), self._valori)]
+
+    def osserva(self, valore, etichetta=None):
+        self._gruppi[0].osserva(valore, etichetta)
+
+    def per(self, **fisse):
+        """Serie separate con etichette fisse in più, per un altro thread che scrive:
+        ritorna un oggetto con lo stesso osserva(), lo stesso per le stesse etichette"""
+        fisse = tuple(fisse.items())
+        for gruppo in self._gruppi:
+            if gruppo.fisse == fisse:
+                return gruppo
+        gruppo = _Serie(self.limiti, fisse, self._valori)
+        self._gruppi.append(gruppo)
+        return gruppo
+
+    def righe(self):
+        yield f'# HELP {self.nome} {self.aiuto}'
+        yield f'# TYPE {self.nome} histogram'
+        gruppi = list(self._gruppi)
+        if len(gruppi) > 1 and not any(any(conteggi) for conteggi, _ in gruppi[0]._serie.values()):
+            gruppi = gruppi[1:]  # si osserva solo con per(...): niente serie vuote senza etichette fisse
+        for gruppo in gruppi:
+            nomi = tuple(n for n, _ in gruppo.fisse) + ((self.etichetta,) if self.etichetta else ())
+            for etichetta, (conteggi, somma) in list(gruppo._serie.items()):
+                valori = tuple(v for _, v in gruppo.fisse) + ((etichetta,) if self.etichetta else ())
+                cumulato = 0
+                for limite, n in zip(self.limiti + (float('inf'),), list(conteggi)):
+                    cumulato += n
+                    le = 'le="%s"' % _numero(limite)
+                    yield f'{self.nome}_bucket{_etichette(nomi, valori, le)} {cumulato}'
+                yield f'{self.nome}_sum{_etichette(nomi, valori)} {_numero(somma)}'
+                yield f'{self.nome}_count{_etichette(nomi, valori)} {cumulato}'
+
+
+class _Letta:
+    """Metrica calcolata alla lettura: fn() ritorna un numero oppure
+    coppie (valori etichette, numero); None = metrica non disponibile"""
+
+    def __init__(self, nome, tipo, aiuto, fn, etichette=()):
+        self.nome = nome
+        self.tipo = tipo
+        self.aiuto = aiuto
+        self.fn = fn
+        self.etichette = tuple(etichette)
+
+    def righe(self):
+        valori = self.fn()
+        yield f'# HELP {self.nome} {self.aiuto}'
+        yield f'# TYPE {self.nome} {self.tipo}'
+        if valori is None:
+            return
+        if not self.etichette:
+            yield f'{self.nome} {_numero(valori)}'
+            return
+        for chiave, valore in valori:
+            yield f'{self.nome}{_etichette(self.etichette, chiave)} {_numero(valore)}'
+
+
+class Registro:
+    def __init__(self, prefisso=''):
+        self.prefisso = prefisso
+        self._metriche = []
+
+    def istogramma(self, nome, aiuto, limiti, etichetta=None, valori=()):
+        metrica = Istogramma(self.prefisso + nome, aiuto, limiti, etichetta, valori)
+        self._metriche.append(metrica)
+        return metrica
+
+    def contatore(self, nome, aiuto, fn, etichette=()):
+        self._metriche.append(_Letta(self.prefisso + nome, 'counter', aiuto, fn, etichette))
+
+    def valore(self, nome, aiuto, fn, etichette=()):
+        self._metriche.append(_Letta(self.prefisso + nome, 'gauge', aiuto, fn, etichette))
+
+    def testo(self):
+        """Formato testuale di Prometheus (0.0.4)"""
+        righe = []
+        for metrica in self._metriche:
+            righe.extend(metrica.righe())
+        return '\n'.join(righe) + '\n'
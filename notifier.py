@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+# -----------------------------------------------------------
+# NOTIFICHE TELEGRAM IN BACKGROUND
+# -----------------------------------------------------------
+# Un solo Bot (e una sola sessione HTTPS) per tutta la vita del processo, su
+# un thread con il suo event loop. invia() mette il messaggio in coda e torna
+# subito: la logica di controllo non aspetta mai Telegram. I messaggi che
+# arrivano a pochi secondi di distanza partono uniti in un unico messaggio,
+# i doppioni recenti vengono scartati e tra due invii passa un intervallo minimo.
+
+MAX_LUNGHEZZA = 4096  # limite Telegram per un singolo messaggio
+
+
+class TelegramNotifier:
+    def __init__(self, token, chat_id, log=print, finestra=2.0, intervallo_min=3.0, dedup_s=60.0, max_coda=20,
+                 istogramma=None):
+        self.token = token
+        self.chat_id = chat_id
+        self.log = log
+        self.istogramma = istogramma          # metrics.Istogramma della durata degli invii (opzionale)
+        self.finestra = finestra              # attesa per raccogliere messaggi vicini
+        self.intervallo_min = intervallo_min  # secondi minimi tra due invii
+        self.dedup_s = dedup_s                # un testo identico non riparte prima di così
+        self.max_coda = max_coda
+        self._coda = deque()
+        self._recenti = {}  # testo -> time.monotonic() dell'ultimo accodamento
+        self._cond = threading.Condition()
+        self._occupato = False
+        self._thread = None
+        self.stats = {'accodati': 0, 'inviati': 0, 'uniti': 0, 'duplicati': 0, 'scartati': 0, 'errori': 0,
+                      'ultimo_invio_ms': 0.0}
+
+    def avvia(self):
+        if not self.token or not self.chat_id or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='notifiche', daemon=True)
+        self._thread.start()
+
+    def invia(self, messaggio):
+        """Accoda un messaggio e ritorna subito (False se scartato)"""
+        if not self.token or not self.chat_id:
+            return False
+        now = time.monotonic()
+        with self._cond:
+            ultimo = self._recenti.get(messaggio)
+            if ultimo is not None and now - ultimo < self.dedup_s:
+                self.stats['duplicati'] += 1
+                return False
+            self._recenti[messaggio] = now
+            if len(self._recenti) > 4 * self.max_coda:
+                self._recenti = {m: t for m, t in self._recenti.items() if now - t < self.dedup_s}
+
+            if len(self._coda) >= self.max_coda:
+                # coda piena: si perde il messaggio più vecchio
+                self._coda.popleft()
+                self.stats['scartati'] += 1
+            self._coda.append(messaggio)
+            self.stats['accodati'] += 1
+            self._cond.notify_all()
+        return True
+
+    def attendi(self, timeout=None):
+        """Aspetta che la coda sia stata inviata (usato in chiusura)"""
+        fine = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._thread is not None and (self._coda or self._occupato):
+                restante = None if fine is None else fine - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return False
+                self._cond.wait(restante)
+        return True
+
+    def _run(self):
+        from telegram import Bot
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        bot = Bot(token=self.token)
+        ultimo_invio = float('-inf')
+
+        while True:
+            with self._cond:
+                while not self._coda:
+                    self._cond.wait()
+                self._occupato = True
+
+            # raccoglie i messaggi che arrivano subito dopo e rispetta l'intervallo minimo
+            attesa = max(self.finestra, ultimo_invio + self.intervallo_min - time.monotonic())
+            time.sleep(attesa)
+
+            with self._cond:
+                messaggi = list(self._coda)
+                self._coda.clear()
+            self.stats['uniti'] += len(messaggi) - 1
+            testo = "\n\n".join(messaggi)[:MAX_LUNGHEZZA]
+
+            inizio = time.perf_counter()
+            try:
+                loop.run_until_complete(bot.send_message(chat_id=self.chat_id, text=testo))
+                self.stats['inviati'] += 1
+            except Exception as e:
+                self.stats['errori'] += 1
+                self.log(f"[ERRORE TELEGRAM] {e}")
+            durata = time.perf_counter() - inizio
+            self.stats['ultimo_invio_ms'] = durata * 1000
+            if self.istogramma is not None:
+                self.istogramma.osserva(durata)
+            ultimo_invio = time.monotonic()
+
+            with self._cond:
+                self._occupato = False
+                self._cond.notify_all()
@@ -0,0 +1,235 @@
+import time
+import xml.etree.ElementTree as ET
+from xml.parsers.expat import ExpatError, ParserCreate
+
+# -----------------------------------------------------------
+# DECODER PACCHETTI CONTATORE
+# -----------------------------------------------------------
+# Il contatore manda sempre gli stessi due schemi:
+#   <electricity>...<channels><chan id='0'><curr>287.00</curr>...</chan>...</channels>...</electricity>
+#   <solar>...<current><generating>1234.00</generating>...</current>...</solar>
+# Per questi due casi leggiamo i valori direttamente dai bytes, senza decode()
+# e senza costruire l'albero XML. Tutto quello che non riconosciamo passa
+# da ElementTree, che resta il riferimento per la semantica. Prima di fidarsi
+# dei valori il fast path fa passare il pacchetto da expat (lo stesso parser
+# di ElementTree) senza handler e senza albero: un datagramma corrotto, con
+# un tag non chiuso o chiuso male, non deve arrivare a run_logic solo perché
+# i pezzi che leggiamo sembrano a posto. Costa circa un terzo di ElementTree;
+# quello che expat rifiuta sui bytes va comunque a decode_et().
+
+ELECTRICITY = 'electricity'
+SOLAR = 'solar'
+
+_CHANNEL_INDEX = {b'0': 0, b'1': 1, b'2': 2, b'3': 3, b'4': 4, b'5': 5}
+# tag radice di _root_tag -> nome nei contatori per tipo
+NOMI_TAG = {b'electricity': ELECTRICITY, b'solar': SOLAR, None: 'altro'}
+_WHITESPACE = b' \t\r\n'
+
+
+def _root_tag(data):
+    """Ritorna (tag, inizio) del nodo radice, oppure (None, -1) se non riconosciuto."""
+    start = 0
+    n = len(data)
+    while start < n and data[start] in _WHITESPACE:
+        start += 1
+    if data.startswith(b'<?', start):
+        start = data.find(b'?>', start)
+        if start < 0:
+            return None, -1
+        start += 2
+        while start < n and data[start] in _WHITESPACE:
+            start += 1
+    for tag in (b'electricity', b'solar'):
+        if data.startswith(tag, start + 1) and data[start:start + 1] == b'<':
+            after = data[start + 1 + len(tag):start + 2 + len(tag)]
+            if after in (b' ', b'>', b'\t', b'\r', b'\n'):
+                return tag, start
+    return None, -1
+
+
+def _ben_formato(data):
+    """True se expat accetta il pacchetto: tag annidati e chiusi, una sola radice"""
+    try:
+        ParserCreate().Parse(data, True)
+    except ExpatError:
+        return False
+    return True
+
+
+def _element_text(data, tag, start, end):
+    """Testo del primo <tag ...>testo</tag> in data[start:end], oppure None."""
+    i = data.find(tag, start, end)
+    if i < 0:
+        return None
+    gt = data.find(b'>', i + len(tag), end)
+    if gt < 0 or data[gt - 1:gt] == b'/':
+        return None
+    lt = data.find(b'<', gt + 1, end)
+    if lt < 0:
+        return None
+    return data[gt + 1:lt]
+
+
+def _fast_electricity(data, start):
+    if not data.rstrip().endswith(b'</electricity>') or not _ben_formato(data):
+        return None
+    i = data.find(b'<channels>', start)
+    end = data.find(b'</channels>', i)
+    if i < 0 or end < 0:
+        return None
+
+    fasi = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    trovati = 0
+    pos = i
+    while True:
+        c = data.find(b'<chan ', pos, end)
+        if c < 0:
+            break
+        chan_end = data.find(b'</chan>', c, end)
+        q = data.find(b'id=', c, chan_end)
+        if chan_end < 0 or q < 0:
+            return None
+        quote = data[q + 3:q + 4]
+        q_end = data.find(quote, q + 4, chan_end)
+        if quote not in (b"'", b'"') or q_end < 0:
+            return None
+
+        idx = _CHANNEL_INDEX.get(data[q + 4:q_end])
+        if idx is not None:
+            text = _element_text(data, b'<curr', q_end, chan_end)
+            try:
+                fasi[idx] = float(text)
+            except (TypeError, ValueError):
+                fasi[idx] = 0.0
+        trovati += 1
+        pos = chan_end + 7
+
+    if not trovati:
+        return None
+    return (ELECTRICITY, tuple(fasi))
+
+
+def _fast_solar(data, start):
+    if not data.rstrip().endswith(b'</solar>') or not _ben_formato(data):
+        return None
+    i = data.find(b'<current>', start)
+    end = data.find(b'</current>', i)
+    if i < 0 or end < 0:
+        return None
+    text = _element_text(data, b'<generating', i + 9, end)
+    if text is None:
+        return None
+    try:
+        return (SOLAR, float(text))
+    except ValueError:
+        return None
+
+
+def decode_et(data):
+    """Decodifica completa con ElementTree (stessa logica della versione originale)."""
+    try:
+        root = ET.fromstring(data.decode('utf-8', errors='ignore'))
+
+        if root.tag == ELECTRICITY:
+            channels = root.find('channels')
+            if channels:
+                p = {}
+                for c in channels.findall('chan'):
+                    try:
+                        val = float(c.find('curr').text)
+                    except (AttributeError, TypeError, ValueError):
+                        val = 0.0
+                    p[c.get('id')] = val
+                return (ELECTRICITY, (p.get('0', 0), p.get('1', 0), p.get('2', 0),
+                                      p.get('3', 0), p.get('4', 0), p.get('5', 0)))
+
+        elif root.tag == SOLAR:
+            curr = root.find('current')
+            if curr is not None:
+                return (SOLAR, float(curr.find('generating').text))
+
+    except Exception:
+        pass
+    return None
+
+
+class PacketDecoder:
+    """Decoder con fast-path sui bytes e cache dell'ultimo pacchetto per tipo.
+
+    decode() ritorna ('electricity', (l1..l6)), ('solar', watt) oppure None.
+    """
+
+    def __init__(self):
+        self._ultimi = {}  # tag radice -> (payload, risultato)
+        self.fast = 0
+        self.fallback = 0
+        self.duplicati = 0
+
+    def decode(self, data):
+        data = bytes(data)
+        for payload, risultato in self._ultimi.values():
+            if payload == data:
+                self.duplicati += 1
+                return risultato
+
+        tag, start = _root_tag(data)
+        risultato = None
+        if tag == b'electricity':
+            risultato = _fast_electricity(data, start)
+        elif tag == b'solar':
+            risultato = _fast_solar(data, start)
+
+        if risultato is None:
+            self.fallback += 1
+            risultato = decode_et(data)
+        else:
+            self.fast += 1
+
+        if risultato is not None:
+            self._ultimi[risultato[0]] = (data, risultato)
+        return risultato
+
+
+class PacketCoalescer:
+    """Tiene solo l'ultimo pacchetto grezzo per tipo fino alla prossima decisione.
+
+    Durante un burst (o dopo uno stallo) i pacchetti vecchi dello stesso tipo
+    vengono sostituiti da quelli nuovi senza essere decodificati.
+    """
+
+    def __init__(self):
+        self._pendenti = {}  # tag radice (None = sconosciuto) -> payload
+        self.t_primo = None  # arrivo del primo pacchetto pendente (time.monotonic)
+        self.stats = {'ricevuti': 0, 'coalescati': 0, 'scartati': 0, 'elaborati': 0}
+        # gli stessi contatori per tipo di pacchetto (electricity, solar, altro)
+        self.per_tag = {nome: dict.fromkeys(self.stats, 0) for nome in NOMI_TAG.values()}
+
+    def offri(self, data, t=None):
+        self.stats['ricevuti'] += 1
+        tag, _ = _root_tag(data)
+        conta = self.per_tag[NOMI_TAG[tag]]
+        conta['ricevuti'] += 1
+        if self._pendenti.pop(tag, None) is not None:
+            self.stats['coalescati'] += 1
+            conta['coalescati'] += 1
+        # reinserito in coda: l'ordine di prelievo segue l'arrivo più recente
+        self._pendenti[tag] = data
+        if self.t_primo is None:
+            self.t_primo = time.monotonic() if t is None else t
+
+    def preleva(self):
+        """Ritorna (payload pendenti in ordine di arrivo, t_primo) e svuota il buffer."""
+        pacchetti = list(self._pendenti.values())
+        for tag in self._pendenti:
+            self.per_tag[NOMI_TAG[tag]]['elaborati'] += 1
+        t_primo = self.t_primo
+        self._pendenti.clear()
+        self.t_primo = None
+        self.stats['elaborati'] += len(pacchetti)
+        return pacchetti, t_primo
+
+    def scartato(self, data=None):
+        """Un pacchetto prelevato che non è stato decodificato"""
+        self.stats['scartati'] += 1
+        if data is not None:
+            self.per_tag[NOMI_TAG[_root_tag(data)[0]]]['scartati'] += 1
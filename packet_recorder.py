@@ -0,0 +1,115 @@
+import gzip
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+
+# -----------------------------------------------------------
+# REGISTRAZIONE PACCHETTI MULTICAST
+# -----------------------------------------------------------
+# Salva i datagrammi grezzi del contatore con il loro timestamp, per poter
+# rigiocare una giornata reale con replay.py. Il file è un flusso gzip di
+# record binari: tipo (1 byte), timestamp epoch (float64), lunghezza (uint16)
+# e payload. Oltre ai pacchetti il servizio registra anche i comandi inviati
+# alla wallbox, così il replay sa quanta potenza di carica c'era nei consumi
+# registrati. Ogni FLUSH_S secondi il flusso viene chiuso a blocco: dopo un
+# crash si perdono al massimo quegli ultimi secondi.
+
+MAGIC = b"PKTREC1\n"
+PACCHETTO = 0
+COMANDO = 1
+
+_RECORD = struct.Struct('<BdH')
+
+
+class PacketRecorder:
+    def __init__(self, path, flush_s=10.0):
+        self.path = path
+        self.flush_s = flush_s
+        self._file = gzip.open(path, 'wb', compresslevel=6)
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._ultimo_flush = time.monotonic()
+        self.stats = {'pacchetti': 0, 'comandi': 0}
+
+    def registra(self, data, t=None):
+        """Un datagramma ricevuto (bytes)"""
+        self._scrivi(PACCHETTO, data, t)
+        self.stats['pacchetti'] += 1
+
+    def comando(self, btn, t=None):
+        """Un comando confermato dalla wallbox ('P3000', 'i', 'o')"""
+        self._scrivi(COMANDO, btn.encode(), t)
+        self.stats['comandi'] += 1
+
+    def _scrivi(self, tipo, payload, t):
+        record = _RECORD.pack(tipo, time.time() if t is None else t, len(payload)) + payload
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(record)
+            if time.monotonic() - self._ultimo_flush >= self.flush_s:
+                self._file.flush(zlib.Z_SYNC_FLUSH)
+                self._ultimo_flush = time.monotonic()
+
+    def chiudi(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def leggi_registrazione(path):
+    """Genera (tipo, t, payload) in ordine di registrazione. Un file troncato
+    (servizio interrotto) viene letto fino all'ultimo record completo."""
+    with gzip.open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: non è una registrazione di pacchetti")
+        while True:
+            try:
+                testa = f.read(_RECORD.size)
+                if len(testa) < _RECORD.size:
+                    return
+                tipo, t, n = _RECORD.unpack(testa)
+                payload = f.read(n)
+            except (EOFError, zlib.error):
+                return
+            if len(payload) < n:
+                return
+            yield tipo, t, payload
+
+
+def main():
+    """Registra dal multicast senza avviare il servizio:
+    python packet_recorder.py pacchetti.rec.gz [secondi]"""
+    from solar_webinterface import apri_socket_multicast
+
+    if len(sys.argv) < 2:
+        print(main.__doc__)
+        return
+    durata = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    sock = apri_socket_multicast()
+    if sock is None:
+        return
+    recorder = PacketRecorder(sys.argv[1])
+    fine = None if durata is None else time.monotonic() + durata
+    try:
+        while fine is None or time.monotonic() < fine:
+            sock.settimeout(None if fine is None else max(0.1, fine - time.monotonic()))
+            try:
+                data = sock.recv(65535)
+            except socket.timeout:
+                continue
+            recorder.registra(data)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.chiudi()
+        sock.close()
+    print(f"{recorder.stats['pacchetti']} pacchetti salvati in {sys.argv[1]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import math
+from collections import deque
+
+# -----------------------------------------------------------
+# PREVISIONE A BREVE TERMINE DI SOLARE E CONSUMI
+# -----------------------------------------------------------
+# Surplus previsto sui prossimi ORIZZONTE_S secondi, pensato per scegliere la
+# potenza di carica senza che una nuvola che passa o un picco della casa
+# diventino una catena di comandi. È un esperimento e non entra in run_logic:
+# sulle giornate di prova decidere sul previsto toglie qualche comando ma non
+# i cicli del timer di spegnimento, e costa un po' di autoconsumo. Per ora la
+# si valuta solo offline (taratura.py e benchmarks/bench_previsione.py
+# simulano run_logic sui valori previsti); nel servizio, con
+# CONFIG['PREVISIONE'], viene solo calcolata e mostrata in /api/data.
+#
+# Solare: un calo si segue subito (per non prelevare dalla rete), un aumento
+# solo quando dura da PERSISTENZA_S secondi: il minimo mobile sulla finestra
+# sale a gradino, con un comando solo, invece di inseguire ogni lettura con
+# una rampa di piccoli comandi. Fa eccezione il ritorno al cielo sereno:
+# l'inviluppo è il massimo recente del solare, che cala di INVILUPPO_CALO_W_S
+# al secondo (più piano di qualsiasi nuvola, abbastanza per il tramonto), e
+# una lettura che torna vicina all'inviluppo (SERENO) viene creduta subito,
+# perché il sole non può andare oltre. L'inviluppo segue la curva del giorno
+# con Holt (livello + tendenza), che lo estrapola sull'orizzonte: la sera la
+# potenza scende in anticipo invece di inseguire il tramonto.
+# Consumi della casa: massimo mobile su PERSISTENZA_CASA_S secondi, sale
+# subito e scende a gradino: le oscillazioni brevi non muovono la carica.
+# La finestra è corta perché ogni secondo in più dopo la fine di un carico
+# (bollitore, forno...) è solare esportato invece che caricato.
+# Ogni aggiornamento è O(1) (ammortizzato per i minimi e massimi mobili).
+
+ORIZZONTE_S = 60
+PERSISTENZA_S = 30
+PERSISTENZA_CASA_S = 5
+SERENO = 0.9
+INVILUPPO_CALO_W_S = 2.0
+
+
+def _peso(dt, tau):
+    return 1.0 - math.exp(-dt / tau) if tau > 0 else 1.0
+
+
+class Holt:
+    """Livello e tendenza (W/s) con smoothing esponenziale a costante di tempo"""
+    __slots__ = ('tau', 'tau_tendenza', 'livello', 'tendenza', 't')
+
+    def __init__(self, tau, tau_tendenza):
+        self.tau = tau
+        self.tau_tendenza = tau_tendenza
+        self.livello = None
+        self.tendenza = 0.0
+        self.t = None
+
+    def aggiorna(self, t, valore):
+        if self.t is None:
+            self.livello, self.t = float(valore), t
+            return
+        dt = t - self.t
+        if dt <= 0:
+            return
+        previsto = self.livello + self.tendenza * dt
+        livello = previsto + _peso(dt, self.tau) * (valore - previsto)
+        self.tendenza += _peso(dt, self.tau_tendenza) * ((livello - self.livello) / dt - self.tendenza)
+        self.livello, self.t = livello, t
+
+    def prevedi(self, orizzonte):
+        return self.livello + self.tendenza * orizzonte
+
+
+class EstremoMobile:
+    """Minimo (o massimo) delle letture degli ultimi `finestra` secondi.
+
+    Coda monotona: ogni lettura entra ed esce una volta sola e la coda non
+    supera le letture della finestra."""
+    __slots__ = ('finestra', 'segno', 'coda')
+
+    def __init__(self, finestra, massimo=False):
+        self.finestra = finestra
+        self.segno = -1.0 if massimo else 1.0
+        self.coda = deque()
+
+    def aggiorna(self, t, valore):
+        v = self.segno * valore
+        coda = self.coda
+        while coda and coda[-1][1] >= v:
+            coda.pop()
+        coda.append((t, v))
+        while coda[0][0] < t - self.finestra:
+            coda.popleft()
+
+    @property
+    def valore(self):
+        return self.segno * self.coda[0][1] if self.coda else None
+
+
+class InviluppoSereno:
+    """Massimo recente del solare, che cala di `calo` W al secondo"""
+    __slots__ = ('calo', 'valore', 't')
+
+    def __init__(self, calo=INVILUPPO_CALO_W_S):
+        self.calo = calo
+        self.valore = 0.0
+        self.t = None
+
+    def aggiorna(self, t, solare):
+        if self.t is not None and t > self.t:
+            self.valore = max(0.0, self.valore - self.calo * (t - self.t))
+        self.valore = max(self.valore, solare)
+        self.t = t
+
+
+class PrevisioneSurplus:
+    def __init__(self, orizzonte=ORIZZONTE_S, persistenza=PERSISTENZA_S, persistenza_casa=PERSISTENZA_CASA_S,
+                 sereno=SERENO, calo_inviluppo=INVILUPPO_CALO_W_S, tau_inviluppo=60.0, tau_tendenza=900.0):
+        self.orizzonte = orizzonte
+        self.sereno = sereno
+        self.ultimo = None
+        self.solare = EstremoMobile(persistenza)
+        self.casa = EstremoMobile(persistenza_casa, massimo=True)
+        self.inviluppo = InviluppoSereno(calo_inviluppo)
+        self.curva = Holt(tau_inviluppo, tau_tendenza)
+
+    def aggiorna(self, t, solare, casa):
+        self.ultimo = solare
+        self.solare.aggiorna(t, solare)
+        self.casa.aggiorna(t, casa)
+        self.inviluppo.aggiorna(t, solare)
+        self.curva.aggiorna(t, self.inviluppo.valore)
+
+    @property
+    def pronta(self):
+        return self.ultimo is not None
+
+    def solare_previsto(self, orizzonte=None):
+        """Solare su cui contare per l'orizzonte, mai sopra l'inviluppo previsto"""
+        inviluppo = self.inviluppo.valore
+        solare = self.solare.valore
+        if self.ultimo >= self.sereno * inviluppo:
+            solare = max(solare, self.ultimo)
+        calo = min(0.0, self.curva.tendenza) * (self.orizzonte if orizzonte is None else orizzonte)
+        sereno = inviluppo + calo
+        return max(0.0, min(solare, sereno))
+
+    def casa_prevista(self):
+        return self.casa.valore
+
+    def surplus(self, orizzonte=None):
+        return self.solare_previsto(orizzonte) - self.casa_prevista()
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import threading
+from urllib.parse import urlsplit
+
+# -----------------------------------------------------------
+# PUSH LIVE PER LA DASHBOARD (SERVER-SENT EVENTS)
+# -----------------------------------------------------------
+# Un piccolo server HTTP su un event loop dedicato: tutti i browser collegati
+# a /stream sono coroutine dello stesso thread, non un thread ciascuno.
+# segnala() viene chiamato da chi aggiorna lo stato (letture, comandi wallbox,
+# log) e costa quasi nulla: al massimo sveglia il loop. Il loop costruisce un
+# solo aggiornamento incrementale, lo serializza una volta e lo mette nella
+# coda di ogni client. Un client con la coda piena è troppo lento e viene
+# disconnesso: EventSource si ricollega da solo e riparte da uno snapshot.
+# Lo stream sta su un'altra porta rispetto alla dashboard, quindi il browser
+# chiede il permesso CORS: viene dato solo alla pagina servita dalla porta
+# della dashboard sullo stesso host, non a qualsiasi sito.
+
+RISPOSTA_STREAM = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Connection: keep-alive\r\n"
+)
+RISPOSTA_404 = b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+KEEPALIVE = b": keepalive\n\n"
+
+
+def origine_ammessa(richiesta, porta_dashboard):
+    """Origin della richiesta se è la dashboard (stesso host, porta_dashboard), altrimenti None"""
+    intestazioni = {}
+    for riga in richiesta.split(b"\r\n")[1:]:
+        nome, _, valore = riga.partition(b":")
+        intestazioni[nome.strip().lower()] = valore.strip()
+    origine = intestazioni.get(b"origin")
+    if not origine or not porta_dashboard:
+        return None
+    try:
+        o = urlsplit(origine.decode('latin-1'))
+        host = urlsplit('//' + intestazioni.get(b"host", b"").decode('latin-1'))
+        porta = o.port or {'http': 80, 'https': 443}.get(o.scheme)
+    except ValueError:
+        return None
+    if o.hostname and o.hostname == host.hostname and porta == porta_dashboard:
+        return origine
+    return None
+
+
+def evento_sse(dati):
+    return b"data: " + json.dumps(dati, separators=(',', ':')).encode() + b"\n\n"
+
+
+class PushHub:
+    def __init__(self, log=print, max_coda=32, intervallo_min=0.25, keepalive_s=15.0, timeout_invio=5.0):
+        self.log = log
+        self.max_coda = max_coda              # eventi in attesa per client prima di scollegarlo
+        self.intervallo_min = intervallo_min  # secondi minimi tra due aggiornamenti (raggruppa le raffiche)
+        self.keepalive_s = keepalive_s
+        self.timeout_invio = timeout_invio
+        self._costruisci = None
+        self._porta_dashboard = None
+        self._loop = None
+        self._evento = None
+        self._segnalato = False
+        self._clienti = {}  # coda -> task del client
+        self._seq = None    # cursori dell'ultimo aggiornamento inviato
+        self._log_seq = None
+        self.stats = {'client': 0, 'connessioni': 0, 'eventi': 0, 'scollegati_lenti': 0}
+
+    def avvia(self, host, port, costruisci, porta_dashboard=None):
+        """costruisci(seq, log_seq) -> dict con almeno 'seq' e 'log_seq', come /api/data.
+        porta_dashboard: porta della pagina che può leggere lo stream (CORS)"""
+        self._costruisci = costruisci
+        self._porta_dashboard = porta_dashboard
+        pronto = threading.Event()
+        threading.Thread(target=self._run, args=(host, port, pronto), name='push', daemon=True).start()
+        pronto.wait(5)
+
+    def segnala(self):
+        """Lo stato è cambiato: thread-safe, non blocca"""
+        loop = self._loop
+        if loop is None or self._segnalato:
+            return
+        self._segnalato = True
+        loop.call_soon_threadsafe(self._evento.set)
+
+    def _run(self, host, port, pronto):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._main(host, port, pronto))
+        except Exception as e:
+            self.log(f"[ERRORE] Push dashboard: {e}")
+            self._loop = None
+            pronto.set()
+
+    async def _main(self, host, port, pronto):
+        self._evento = asyncio.Event()
+        server = await asyncio.start_server(self._client, host, port)
+        self._loop = asyncio.get_running_loop()
+        pronto.set()
+        async with server:
+            while True:
+                try:
+                    await asyncio.wait_for(self._evento.wait(), self.keepalive_s)
+                except asyncio.TimeoutError:
+                    self._diffondi(KEEPALIVE)
+                    continue
+                # prima si abbassa il flag, poi si legge lo stato: una segnalazione
+                # arrivata nel mezzo sveglia il giro successivo
+                self._evento.clear()
+                self._segnalato = False
+                if self._clienti:
+                    self._pubblica()
+                await asyncio.sleep(self.intervallo_min)
+
+    def _pubblica(self):
+        try:
+            dati = self._costruisci(self._seq, self._log_seq)
+        except Exception as e:
+            self.log(f"[ERRORE] Push dashboard: {e}")
+            return
+        self._seq, self._log_seq = dati['seq'], dati['log_seq']
+        self.stats['eventi'] += 1
+        self._diffondi(evento_sse(dati))
+
+    def _diffondi(self, blob):
+        for coda, task in list(self._clienti.items()):
+            try:
+                coda.put_nowait(blob)
+            except asyncio.QueueFull:
+                self.stats['scollegati_lenti'] += 1
+                del self._clienti[coda]
+                task.cancel()
+
+    async def _client(self, reader, writer):
+        try:
+            richiesta = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        riga = richiesta.split(b"\r\n", 1)[0].split()
+        if len(riga) < 2 or riga[0] != b"GET" or riga[1].split(b"?")[0] != b"/stream":
+            writer.write(RISPOSTA_404)
+            writer.close()
+            return
+
+        try:
+            # snapshot completo; i cursori nei dati permettono al browser di scartare
+            # le letture che riceverà di nuovo nel primo aggiornamento incrementale
+            snapshot = self._costruisci(None, None)
+        except Exception as e:
+            self.log(f"[ERRORE] Push dashboard: {e}")
+            writer.close()
+            return
+        if not self._clienti:
+            # nessuno riceveva aggiornamenti: i cursori ripartono da qui
+            self._seq, self._log_seq = snapshot['seq'], snapshot['log_seq']
+        origine = origine_ammessa(richiesta, self._porta_dashboard)
+        cors = b"Access-Control-Allow-Origin: " + origine + b"\r\nVary: Origin\r\n" if origine else b""
+        writer.write(RISPOSTA_STREAM + cors + b"\r\n" + evento_sse(snapshot))
+
+        coda = asyncio.Queue(self.max_coda)
+        self._clienti[coda] = asyncio.current_task()
+        self.stats['connessioni'] += 1
+        self.stats['client'] = len(self._clienti)
+        try:
+            while True:
+                writer.write(await coda.get())
+                await asyncio.wait_for(writer.drain(), self.timeout_invio)
+        except (asyncio.CancelledError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self._clienti.pop(coda, None)
+            self.stats['client'] = len(self._clienti)
+            writer.close()
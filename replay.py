@@ -0,0 +1,325 @@
+"""Rigioca una registrazione di packet_recorder.py attraverso la logica di controllo.
+
+I pacchetti passano da EnergyMonitor.parse_packet e run_logic come nel
+servizio, con un tick ogni TICK_CONTROLLO_S, ma contro una wallbox simulata e
+con un orologio virtuale: timer, cooldown e UPDATE_INTERVAL_S scorrono col
+tempo della registrazione. Alla fine stampa i comandi che la logica avrebbe
+inviato, autoconsumo ed energia, e quante decisioni al secondo regge.
+
+Anello chiuso (predefinito): il consumo registrato contiene la potenza che la
+wallbox assorbiva davvero, ricostruita dai comandi salvati nella registrazione.
+Il replay la toglie e aggiunge quella della wallbox simulata, così le decisioni
+vedono l'effetto dei propri comandi. Con --anello-aperto il consumo resta
+quello registrato (e l'energia della wallbox è quella registrata).
+
+Uso:
+    python replay.py pacchetti.rec.gz                  # più veloce possibile
+    python replay.py pacchetti.rec.gz --velocita 1     # tempo reale (60 = un'ora al minuto)
+    python replay.py pacchetti.rec.gz --trifase --comandi --json esito.json
+    python replay.py pacchetti.rec.gz --imposta TIMER_SPEGNIMENTO=120 --imposta POTENZA_PROTEZIONE=500
+"""
+import argparse
+import ast
+import json
+import math
+import time
+from concurrent.futures import Future
+
+from log_ring import livello_da_testo
+from packet_recorder import PACCHETTO, COMANDO, leggi_registrazione
+
+# Oltre questo intervallo tra due letture l'energia non viene integrata (buco nella registrazione)
+BUCO_MAX_S = 120
+
+
+class OrologioVirtuale:
+    """Sostituisce il modulo time dentro solar_webinterface: time() scorre col
+    tempo della registrazione e sleep() lo fa avanzare senza attendere"""
+
+    def __init__(self, t0):
+        self.t = t0
+
+    def time(self):
+        return self.t
+
+    def monotonic(self):
+        return self.t
+
+    def sleep(self, secondi):
+        self.t += max(0.0, secondi)
+
+    def avanza_a(self, t):
+        self.t = max(self.t, t)
+
+    def __getattr__(self, nome):
+        # strftime, localtime, perf_counter, ... restano quelli veri
+        return getattr(time, nome)
+
+
+class DispatcherSincrono:
+    """Stessa interfaccia di WallboxDispatcher, ma esegue subito sul thread del replay"""
+
+    def __init__(self, send_command, orologio):
+        self._send_command = send_command
+        self._orologio = orologio
+        self.stats = {'inviati': 0, 'falliti': 0, 'coalescati': 0}
+
+    def invia(self, params, on_success=None, pausa=0.0):
+        ok = bool(self._send_command(params))
+        self.stats['inviati' if ok else 'falliti'] += 1
+        if ok and on_success is not None:
+            on_success()
+        if ok and pausa:
+            self._orologio.sleep(pausa)
+        return self._fatto(ok)
+
+    def esegui(self, fn, *args):
+        return self._fatto(fn(*args))
+
+    def attendi(self, timeout=None):
+        return True
+
+    @staticmethod
+    def _fatto(risultato):
+        future = Future()
+        future.set_result(risultato)
+        return future
+
+
+class _Risposta:
+    status_code = 200
+
+    def __init__(self, dati):
+        self._dati = dati
+
+    def json(self):
+        return self._dati
+
+
+class WallboxSimulata:
+    """Client wallbox finto: conferma ogni comando e ne registra la sequenza"""
+
+    def __init__(self, orologio, trifase=False):
+        self._orologio = orologio
+        self.trifase = trifase
+        self.acceso = False
+        self.potenza = 0
+        self.comandi = []  # (t, btn)
+        self.tempi = {}
+
+    def get(self, params=None, timeout=None):
+        return _Risposta({'tfase': '1' if self.trifase else '0'})
+
+    def comando(self, params):
+        btn = str(params.get('btn', ''))
+        self.comandi.append((self._orologio.time(), btn))
+        if btn == 'i':
+            self.acceso = True
+        elif btn == 'o':
+            self.acceso = False
+        elif btn.startswith('P'):
+            self.potenza = int(btn[1:])
+        return True
+
+    def assorbita(self):
+        return self.potenza if self.acceso else 0
+
+    def close(self):
+        pass
+
+
+class WallboxRegistrata:
+    """Potenza che la wallbox assorbiva durante la registrazione, dai comandi salvati"""
+
+    def __init__(self):
+        self.acceso = False
+        self.potenza = 0
+
+    def applica(self, btn):
+        if btn == 'i':
+            self.acceso = True
+        elif btn == 'o':
+            self.acceso = False
+        elif btn.startswith('P'):
+            self.potenza = int(btn[1:])
+
+    def assorbita(self):
+        return self.potenza if self.acceso else 0
+
+
+def rigioca(path, velocita=0.0, trifase=False, anello_aperto=False, config=None, verboso=False):
+    """Esegue il replay di `path` e ritorna il dizionario dei risultati.
+
+    velocita: 0 = più veloce possibile, 1 = tempo reale, N = N volte più veloce.
+    config: valori di CONFIG da sovrascrivere (es. {'POTENZA_PROTEZIONE': 300}).
+    """
+    import solar_webinterface as swi
+    from packet_decoder import PacketCoalescer
+
+    record = list(leggi_registrazione(path))
+    if not record:
+        raise ValueError(f"{path}: registrazione vuota")
+
+    orologio = OrologioVirtuale(record[0][1])
+    swi.time = orologio
+    swi.CONFIG.update(config or {})
+    if not verboso:
+        swi.SYSTEM_STATE['LOGS'].output = lambda *a, **k: None
+
+    livelli = {}
+    notifiche = []
+    log_msg = swi.log_msg
+
+    def conta_log(msg, livello=None):
+        livello = livello or livello_da_testo(msg)
+        livelli[livello] = livelli.get(livello, 0) + 1
+        log_msg(msg, livello)
+
+    swi.log_msg = conta_log
+    swi.notifica = lambda messaggio: notifiche.append((orologio.time(), messaggio))
+
+    simulata = WallboxSimulata(orologio, trifase)
+    registrata = WallboxRegistrata()
+    wallbox = swi.WallboxController()
+    wallbox.client = simulata
+    wallbox.dispatcher = DispatcherSincrono(wallbox.send_command, orologio)
+    swi.wallbox_instance = wallbox
+    wallbox.initialize()
+
+    energia = {'solare': 0.0, 'casa': 0.0, 'wallbox': 0.0, 'autoconsumo': 0.0, 'wallbox_solare': 0.0, 'rete': 0.0}
+    precedente = None  # (t, solare, casa, wallbox) dell'ultima lettura
+
+    class MonitorReplay(swi.EnergyMonitor):
+        def parse_packet(self, data):
+            nonlocal precedente
+            letture = self.ctrletturefasi
+            esito = super().parse_packet(data)
+            if self.ctrletturefasi == letture:
+                return esito
+            casa = max(0.0, self.total_grid_load - registrata.assorbita())
+            wb = registrata.assorbita() if anello_aperto else simulata.assorbita()
+            if not anello_aperto:
+                self.total_grid_load = casa + wb
+                self.house_load = casa
+            t = orologio.time()
+            if precedente is not None and 0 < t - precedente[0] <= BUCO_MAX_S:
+                # energia del tratto precedente, a potenza costante fino a questa lettura
+                ore = (t - precedente[0]) / 3600
+                t_p, solare_p, casa_p, wb_p = precedente
+                energia['solare'] += solare_p * ore
+                energia['casa'] += casa_p * ore
+                energia['wallbox'] += wb_p * ore
+                energia['autoconsumo'] += min(solare_p, casa_p + wb_p) * ore
+                energia['wallbox_solare'] += min(wb_p, max(0.0, solare_p - casa_p)) * ore
+                energia['rete'] += max(0.0, casa_p + wb_p - solare_p) * ore
+            precedente = (t, self.solar_now, casa, wb)
+            return esito
+
+    monitor = MonitorReplay()
+    coalescer = PacketCoalescer()
+    tick = swi.CONFIG['TICK_CONTROLLO_S']
+    prossimo_tick = (math.floor(record[0][1] / tick) + 1) * tick
+    pacchetti = decisioni = 0
+
+    inizio = time.perf_counter()
+    for tipo, t, payload in record:
+        if velocita:
+            ritardo = (t - record[0][1]) / velocita - (time.perf_counter() - inizio)
+            if ritardo > 0:
+                time.sleep(ritardo)
+        if t >= prossimo_tick:
+            # il tick cade prima di questo record: decide su quello che si è accumulato
+            if coalescer.t_primo is not None:
+                orologio.avanza_a(prossimo_tick)
+                if swi.elabora_pacchetti(monitor, wallbox, coalescer, coalescer.preleva()[0]):
+                    decisioni += 1
+            prossimo_tick = (math.floor(t / tick) + 1) * tick
+        orologio.avanza_a(t)
+        if tipo == PACCHETTO:
+            pacchetti += 1
+            coalescer.offri(payload, t)
+        elif tipo == COMANDO:
+            registrata.applica(payload.decode())
+    if coalescer.t_primo is not None:
+        orologio.avanza_a(prossimo_tick)
+        if swi.elabora_pacchetti(monitor, wallbox, coalescer, coalescer.preleva()[0]):
+            decisioni += 1
+    durata_reale = time.perf_counter() - inizio
+
+    comandi = simulata.comandi
+    durata = record[-1][1] - record[0][1]
+    return {
+        'durata_registrata_s': round(durata, 1),
+        'durata_replay_s': round(durata_reale, 3),
+        'pacchetti': pacchetti,
+        'letture': monitor.ctrletturefasi,
+        'decisioni': decisioni,
+        'pacchetti_al_s': round(pacchetti / durata_reale, 1),
+        'decisioni_al_s': round(decisioni / durata_reale, 1),
+        'comandi': len(comandi),
+        'comandi_ora': round(len(comandi) / (durata / 3600), 1) if durata else None,
+        'timer_spegnimento': wallbox.timer_spegnimento,
+        'comandi_per_tipo': {
+            'potenza': sum(1 for _, b in comandi if b.startswith('P')),
+            'accensioni': sum(1 for _, b in comandi if b == 'i'),
+            'spegnimenti': sum(1 for _, b in comandi if b == 'o'),
+        },
+        'log': livelli,
+        'notifiche': len(notifiche),
+        'energia_kwh': {k: round(v / 1000, 3) for k, v in energia.items()},
+        'autoconsumo_pct': round(100 * energia['autoconsumo'] / energia['solare'], 1) if energia['solare'] else None,
+        'wallbox_da_solare_pct': round(100 * energia['wallbox_solare'] / energia['wallbox'], 1) if energia['wallbox'] else None,
+        'sequenza_comandi': [(round(t, 1), b) for t, b in comandi],
+    }
+
+
+def stampa(esito, mostra_comandi=False):
+    e = esito['energia_kwh']
+    tipi = esito['comandi_per_tipo']
+    durata = esito['durata_registrata_s']
+    print(f"registrazione {durata / 3600:.2f} h, {esito['pacchetti']} pacchetti, {esito['letture']} letture fasi")
+    print(f"replay {esito['durata_replay_s']:.2f} s ({durata / max(esito['durata_replay_s'], 1e-9):,.0f}x): "
+          f"{esito['pacchetti_al_s']:,.0f} pacchetti/s, {esito['decisioni']} decisioni ({esito['decisioni_al_s']:,.0f}/s)")
+    print(f"comandi wallbox: {esito['comandi']} (potenza {tipi['potenza']}, accensioni {tipi['accensioni']}, "
+          f"spegnimenti {tipi['spegnimenti']}; {esito['comandi_ora']}/h), timer di spegnimento "
+          f"{esito['timer_spegnimento']}, notifiche {esito['notifiche']}")
+    print(f"energia: solare {e['solare']:.2f} kWh | casa {e['casa']:.2f} kWh | wallbox {e['wallbox']:.2f} kWh | "
+          f"prelievo rete {e['rete']:.2f} kWh")
+    if esito['autoconsumo_pct'] is not None:
+        wb = esito['wallbox_da_solare_pct']
+        print(f"autoconsumo {esito['autoconsumo_pct']:.1f}%" + (f" | wallbox da solare {wb:.1f}%" if wb is not None else ""))
+    print("log: " + ", ".join(f"{k} {v}" for k, v in sorted(esito['log'].items())))
+    if mostra_comandi:
+        for t, btn in esito['sequenza_comandi']:
+            print(f"  {time.strftime('%H:%M:%S', time.localtime(t))}  {btn}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay di una registrazione di pacchetti contro una wallbox simulata")
+    parser.add_argument('registrazione')
+    parser.add_argument('--velocita', type=float, default=0.0, help="0 = più veloce possibile, 1 = tempo reale")
+    parser.add_argument('--trifase', action='store_true', help="la wallbox simulata risponde tfase=1")
+    parser.add_argument('--anello-aperto', action='store_true', help="non corregge il consumo con la wallbox simulata")
+    parser.add_argument('--comandi', action='store_true', help="stampa la sequenza dei comandi")
+    parser.add_argument('--verboso', action='store_true', help="stampa anche il log del controllo")
+    parser.add_argument('--json', help="salva i risultati in questo file")
+    parser.add_argument('--imposta', action='append', default=[], metavar='CHIAVE=VALORE',
+                        help="sovrascrive un valore di CONFIG (es. POTENZA_PROTEZIONE=500), ripetibile")
+    args = parser.parse_args()
+
+    config = {}
+    for voce in args.imposta:
+        chiave, _, valore = voce.partition('=')
+        try:
+            config[chiave] = ast.literal_eval(valore)
+        except (ValueError, SyntaxError):
+            config[chiave] = valore
+    esito = rigioca(args.registrazione, args.velocita, args.trifase, args.anello_aperto, config, args.verboso)
+    stampa(esito, args.comandi)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(esito, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import gzip
+import threading
+import time
+from collections import OrderedDict
+
+# -----------------------------------------------------------
+# CACHE DELLE RISPOSTE SERIALIZZATE
+# -----------------------------------------------------------
+# Più dashboard aperte chiedono quasi sempre la stessa cosa: stessi cursori,
+# stessa versione dello stato. Il corpo JSON viene prodotto una volta per
+# chiave (versione dello stato + parametri della richiesta) e servito come
+# bytes a tutti; la variante gzip viene calcolata alla prima richiesta che la
+# accetta. Una voce vale al massimo MAX_ETA_S secondi, così i campi che
+# cambiano senza nuova versione (ora del server, contatori) restano freschi.
+
+class _Voce:
+    __slots__ = ('corpo', 't', '_gzip')
+
+    def __init__(self, corpo, t):
+        self.corpo = corpo
+        self.t = t
+        self._gzip = None
+
+
+class CacheRisposte:
+    def __init__(self, max_voci=16, max_eta_s=1.0, livello_gzip=6, gzip_min=512):
+        self.max_voci = max_voci
+        self.max_eta_s = max_eta_s
+        self.livello_gzip = livello_gzip
+        self.gzip_min = gzip_min  # sotto questa dimensione non conviene comprimere
+        self._voci = OrderedDict()  # chiave -> _Voce
+        self._lock = threading.Lock()
+        self.stats = {'generati': 0, 'dalla_cache': 0, 'compressi': 0}
+
+    def voce(self, chiave, produci):
+        """La voce per `chiave`; produci() -> bytes viene chiamato solo se manca o è scaduta.
+        Le richieste contemporanee per la stessa chiave aspettano un'unica produzione."""
+        voce = self._voci.get(chiave)
+        if voce is None or time.monotonic() - voce.t > self.max_eta_s:
+            with self._lock:
+                voce = self._voci.get(chiave)
+                if voce is None or time.monotonic() - voce.t > self.max_eta_s:
+                    voce = _Voce(produci(), time.monotonic())
+                    self._voci[chiave] = voce
+                    self._voci.move_to_end(chiave)
+                    while len(self._voci) > self.max_voci:
+                        self._voci.popitem(last=False)
+                    self.stats['generati'] += 1
+                    return voce
+        self.stats['dalla_cache'] += 1
+        return voce
+
+    def corpo(self, voce, accetta_gzip):
+        """(bytes, compresso) da inviare per `voce`"""
+        if not accetta_gzip or len(voce.corpo) < self.gzip_min:
+            return voce.corpo, False
+        if voce._gzip is None:
+            with self._lock:
+                if voce._gzip is None:
+                    voce._gzip = gzip.compress(voce.corpo, self.livello_gzip, mtime=0)
+                    self.stats['compressi'] += 1
+        return voce._gzip, True
@@ -0,0 +1,209 @@
+import threading
+from array import array
+
+from telemetry import COLONNE
+
+# -----------------------------------------------------------
+# AGGREGATI MULTI-RISOLUZIONE
+# -----------------------------------------------------------
+# Ogni lettura aggiorna in O(1) un bucket aperto per ciascun livello (10 s,
+# 1 min, 15 min, 1 h). Quando il tempo passa al bucket successivo quello
+# chiuso finisce in un ring a capacità fissa con min, max, media e ultimo
+# valore per ogni grandezza. Un grafico su 24 ore legge così qualche
+# centinaio di bucket invece di decine di migliaia di letture.
+
+STATISTICHE = ('min', 'max', 'mean', 'last')
+
+# (secondi per bucket, bucket conservati)
+LIVELLI = (
+    (10, 8640),     # 1 giorno
+    (60, 10080),    # 7 giorni
+    (900, 2976),    # 31 giorni
+    (3600, 8784),   # 1 anno
+)
+
+# un livello viene usato se ha al massimo punti * FATTORE_LTTB bucket nella
+# finestra; l'eccesso viene poi ridotto con LTTB
+FATTORE_LTTB = 5
+
+
+class _Livello:
+    def __init__(self, risoluzione, capacita):
+        self.risoluzione = risoluzione
+        self.capacita = capacita
+        self.colonne = {f'{nome}_{stat}': array('f', bytes(4 * capacita)) for nome in COLONNE for stat in STATISTICHE}
+        self.colonne['t'] = array('d', bytes(8 * capacita))  # inizio del bucket
+        self.colonne['n'] = array('I', bytes(4 * capacita))  # letture nel bucket
+        self.seq = 0
+        # bucket aperto: chiave, numero letture, e per ogni grandezza [min, max, somma, ultimo]
+        self.k = None
+        self.n = 0
+        self.acc = [[0.0, 0.0, 0.0, 0.0] for _ in COLONNE]
+
+    def __len__(self):
+        return min(self.seq, self.capacita)
+
+    def aggiungi(self, t, valori):
+        k = int(t // self.risoluzione)
+        if k != self.k:
+            if self.k is not None and self.n:
+                self._chiudi()
+            self.k = k
+            self.n = 0
+        if self.n == 0:
+            for a, v in zip(self.acc, valori):
+                a[0] = a[1] = a[2] = a[3] = v
+        else:
+            for a, v in zip(self.acc, valori):
+                if v < a[0]:
+                    a[0] = v
+                if v > a[1]:
+                    a[1] = v
+                a[2] += v
+                a[3] = v
+        self.n += 1
+
+    def apri(self, k, n, acc):
+        """Ripristina il bucket aperto (ricostruzione dall'archivio)"""
+        self.k, self.n = k, n
+        self.acc = [list(a) for a in acc]
+
+    def scrivi(self, k, n, acc):
+        """Scrive un bucket chiuso: acc = [min, max, somma, ultimo] per grandezza"""
+        i = self.seq % self.capacita
+        c = self.colonne
+        c['t'][i] = k * self.risoluzione
+        c['n'][i] = n
+        for nome, (mn, mx, somma, ultimo) in zip(COLONNE, acc):
+            c[f'{nome}_min'][i] = mn
+            c[f'{nome}_max'][i] = mx
+            c[f'{nome}_mean'][i] = somma / n
+            c[f'{nome}_last'][i] = ultimo
+        self.seq += 1
+
+    def _chiudi(self):
+        self.scrivi(self.k, self.n, self.acc)
+
+    def seq_da_tempo(self, t):
+        col = self.colonne['t']
+        lo, hi = max(0, self.seq - self.capacita), self.seq
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if col[mid % self.capacita] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def conta(self, t_da, t_a):
+        """Bucket nella finestra, incluso quello aperto"""
+        aperto = 1 if self.n and t_da <= self.k * self.risoluzione < t_a else 0
+        return self.seq_da_tempo(t_a) - self.seq_da_tempo(t_da) + aperto
+
+    def serie(self, nomi, t_da, t_a, stat='mean'):
+        """{'t': [...], nome: [...]} per i bucket nella finestra, bucket aperto compreso"""
+        da, a = self.seq_da_tempo(t_da), self.seq_da_tempo(t_a)
+        da = max(da, self.seq - self.capacita)
+        out = {'t': [self.colonne['t'][s % self.capacita] for s in range(da, a)]}
+        for nome in nomi:
+            col = self.colonne[f'{nome}_{stat}']
+            out[nome] = [col[s % self.capacita] for s in range(da, a)]
+        if self.n and t_da <= self.k * self.risoluzione < t_a:
+            out['t'].append(self.k * self.risoluzione)
+            for nome in nomi:
+                mn, mx, somma, ultimo = self.acc[COLONNE.index(nome)]
+                out[nome].append({'min': mn, 'max': mx, 'mean': somma / self.n, 'last': ultimo}[stat])
+        return out
+
+
+class RollupPyramid:
+    def __init__(self, livelli=LIVELLI):
+        self.livelli = [_Livello(r, c) for r, c in livelli]
+        self._lock = threading.Lock()
+
+    def memoria(self):
+        return sum(c.itemsize * len(c) for l in self.livelli for c in l.colonne.values())
+
+    def aggiungi(self, t, fasi, grid, solar, wb):
+        valori = (*fasi, grid, solar, wb)
+        with self._lock:
+            for livello in self.livelli:
+                livello.aggiungi(t, valori)
+
+    def carica(self, risoluzione, bucket):
+        """Ricostruisce un livello da bucket già aggregati [(k, n, acc), ...] in ordine;
+        l'ultimo resta aperto e continua ad accumulare le letture live"""
+        with self._lock:
+            for livello in self.livelli:
+                if livello.risoluzione != risoluzione or not bucket:
+                    continue
+                for k, n, acc in bucket[-livello.capacita - 1:-1]:
+                    livello.scrivi(k, n, acc)
+                livello.apri(*bucket[-1])
+
+
+def lttb(x, ys, soglia):
+    """Largest-Triangle-Three-Buckets su più serie con la stessa x.
+
+    L'area del triangolo è la somma delle aree delle singole serie, così i punti
+    scelti sono gli stessi per tutte. Ritorna gli indici da tenere.
+    """
+    n = len(x)
+    if soglia >= n or soglia < 3:
+        return list(range(n))
+    indici = [0]
+    passo = (n - 2) / (soglia - 2)
+    a = 0
+    for i in range(soglia - 2):
+        # media del bucket successivo
+        s = int((i + 1) * passo) + 1
+        e = min(int((i + 2) * passo) + 1, n)
+        m = e - s
+        media_x = sum(x[s:e]) / m
+        medie_y = [sum(y[s:e]) / m for y in ys]
+
+        migliore, area_max = -1, -1.0
+        xa = x[a]
+        for j in range(int(i * passo) + 1, int((i + 1) * passo) + 1):
+            dx_a = xa - media_x
+            dx_j = xa - x[j]
+            area = 0.0
+            for y, my in zip(ys, medie_y):
+                area += abs(dx_a * (y[j] - y[a]) - dx_j * (my - y[a]))
+            if area > area_max:
+                migliore, area_max = j, area
+        indici.append(migliore)
+        a = migliore
+    indici.append(n - 1)
+    return indici
+
+
+def storico_finestra(ring, piramide, t_da, t_a, punti, nomi=('grid', 'solar', 'wb')):
+    """Serie per un grafico su [t_da, t_a) con al massimo `punti` punti.
+
+    Sceglie la risoluzione più fine (letture grezze, poi 10 s, 1 min, ...)
+    che non supera punti * FATTORE_LTTB nella finestra e riduce il resto con
+    LTTB. Ritorna (risoluzione in secondi, 0 = letture grezze; serie).
+    """
+    limite = punti * FATTORE_LTTB
+    da, a = ring.seq_da_tempo(t_da), ring.seq_da_tempo(t_a)
+    coperta = len(ring) and ring.colonne['t'][ring.intervallo()[0] % ring.capacita] <= t_da
+
+    if a - da <= limite and (coperta or piramide is None):
+        risoluzione = 0
+        serie = {'t': ring.valori('t', da_seq=da, a_seq=a)}
+        for nome in nomi:
+            serie[nome] = ring.valori(nome, da_seq=da, a_seq=a)
+    else:
+        livelli = piramide.livelli if piramide is not None else []
+        scelto = next((l for l in livelli if l.conta(t_da, t_a) <= limite), livelli[-1] if livelli else None)
+        if scelto is None:
+            return 0, {'t': [], **{nome: [] for nome in nomi}}
+        with piramide._lock:
+            serie = scelto.serie(nomi, t_da, t_a)
+        risoluzione = scelto.risoluzione
+
+    if len(serie['t']) > punti:
+        indici = lttb(serie['t'], [serie[nome] for nome in nomi], punti)
+        serie = {k: [v[i] for i in indici] for k, v in serie.items()}
+    return risoluzione, serie
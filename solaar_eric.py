@@ -1,14 +1,14 @@
 import socket
 import struct
-import xml.etree.ElementTree as ET
 import time
 import requests
 import logging
 import json
 import os
 from dotenv import load_dotenv
-import asyncio
-from telegram import Bot
+from packet_decoder import PacketDecoder, ELECTRICITY, SOLAR
+from wallbox_client import WallboxClient
+from notifier import TelegramNotifier
 
 # -----------------------------------------------------------
 # CONFIGURAZIONE
@@ -56,13 +56,10 @@ class WallboxController:
         self.fase = 0
         self.time_turned_off = 0  
         self.pending_off_until = 0
+        self.client = WallboxClient(WALLBOX_URL)
 
     def send_command(self, params):
-        try:
-            response = requests.get(WALLBOX_URL, params=params, timeout=3)
-            return response.status_code == 200
-        except Exception:
-            return False
+        return self.client.comando(params)
 
     def set_power(self, watts):
         if self.fase == 0:
@@ -128,7 +125,7 @@ class WallboxController:
 
         try:
             print(f"Richiesta dati a {WALLBOX_URL}...")
-            response = requests.get(WALLBOX_URL, timeout=5)
+            response = self.client.get(timeout=5)
 
             if response.status_code == 200:
                 dati = response.json()
@@ -177,62 +174,49 @@ class EnergyMonitor:
         self.fases = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
         self.ctrletturefasi = 0
         self.time = None
+        self.decoder = PacketDecoder()
 
     def parse_packet(self, data):
-        try:
-            xml_str = data.decode('utf-8', errors='ignore')
-            root = ET.fromstring(xml_str)
+        pacchetto = self.decoder.decode(data)
+        if pacchetto is None:
+            return None
+        tipo, valori = pacchetto
+
+        if tipo == ELECTRICITY:#fasi
+            l1, l2, l3, l4, l5, l6 = valori
             
-            if root.tag == 'electricity':#fasi
-                channels = root.find('channels')
-                if channels:
-                    p = {}
-                    for c in channels.findall('chan'):
-                        try:
-                            val = float(c.find('curr').text)
-                        except:
-                            val = 0.0
-                        p[c.get('id')] = val
-                    
-                    l1, l2, l3 = p.get('0',0), p.get('1',0), p.get('2',0)
-                    l4, l5, l6 = p.get('3',0), p.get('4',0), p.get('5',0)
-                    
-                    self.total_grid_load = l1 + l2 + l3
-                    self.solar_now = l4 + l5 + l6 
-                    self.exporting = self.solar_now - self.total_grid_load
-                    self.fases = [l1, l2, l3, l4, l5, l6]
-                    
-                    print("\n" + "="*60)
-                    print(f" ⚡ DATO FASI")
-                    print("-" * 60)
-                    print(f" | RETE (Casa+WB) | L1: {l1:5.0f} | L2: {l2:5.0f} | L3: {l3:5.0f} | TOT: {self.total_grid_load:.0f}W")
-                    print(f" | SOLARE (Inv)   | L4: {l4:5.0f} | L5: {l5:5.0f} | L6: {l6:5.0f} | TOT: {self.solar_now:.0f}W")
-                    print("="*60)
-                    print(f"")
-                    self.ctrletturefasi += 1
-                    ULTIMA_LETTURA_FASI = time.time() 
-                    self.time = ULTIMA_LETTURA_FASI
-                    ULTIME_5_LETTURE_FASI.append((self.total_grid_load, self.solar_now, self.fases, self.time))
-                    if len(ULTIME_5_LETTURE_FASI) > 5:
-                        ULTIME_5_LETTURE_FASI.pop(0)    
+            self.total_grid_load = l1 + l2 + l3
+            self.solar_now = l4 + l5 + l6 
+            self.exporting = self.solar_now - self.total_grid_load
+            self.fases = [l1, l2, l3, l4, l5, l6]
             
-                    return "TRIGGER"
-
-
-            elif root.tag == 'solar':#generata
-                curr = root.find('current')
-                if curr is not None:
-                    gen = float(curr.find('generating').text)
-                    self.solar_now = gen
-                    ULTIMA_LETTURA_SOLARE = time.time()
-                    self.time = ULTIMA_LETTURA_SOLARE
-                    ULTIME_5_LETTURE_SOLARE.append((gen, self.time))
-                    if len(ULTIME_5_LETTURE_SOLARE) > 5:
-                        ULTIME_5_LETTURE_SOLARE.pop(0)
-                    return "TRIGGER"
-                
-        except Exception:
-            pass
+            print("\n" + "="*60)
+            print(f" ⚡ DATO FASI")
+            print("-" * 60)
+            print(f" | RETE (Casa+WB) | L1: {l1:5.0f} | L2: {l2:5.0f} | L3: {l3:5.0f} | TOT: {self.total_grid_load:.0f}W")
+            print(f" | SOLARE (Inv)   | L4: {l4:5.0f} | L5: {l5:5.0f} | L6: {l6:5.0f} | TOT: {self.solar_now:.0f}W")
+            print("="*60)
+            print(f"")
+            self.ctrletturefasi += 1
+            ULTIMA_LETTURA_FASI = time.time() 
+            self.time = ULTIMA_LETTURA_FASI
+            ULTIME_5_LETTURE_FASI.append((self.total_grid_load, self.solar_now, self.fases, self.time))
+            if len(ULTIME_5_LETTURE_FASI) > 5:
+                ULTIME_5_LETTURE_FASI.pop(0)    
+    
+            return "TRIGGER"
+
+
+        elif tipo == SOLAR:#generata
+            gen = valori
+            self.solar_now = gen
+            ULTIMA_LETTURA_SOLARE = time.time()
+            self.time = ULTIMA_LETTURA_SOLARE
+            ULTIME_5_LETTURE_SOLARE.append((gen, self.time))
+            if len(ULTIME_5_LETTURE_SOLARE) > 5:
+                ULTIME_5_LETTURE_SOLARE.pop(0)
+            return "TRIGGER"
+
         return None
 
 # -----------------------------------------------------------
@@ -286,14 +270,11 @@ def run_logic(monitor, wallbox):
                 wallbox.pending_off_until = 0
                 if potenza_generata < potenza_minima:
                     print(f"[DECISIONE] Dopo attesa, sole ancora insufficiente ({potenza_generata:.0f}W). Spengo.")
-                    try: 
-                        asyncio.run(invia_notifica(f"⚠️ Attenzione! La potenza generata è insufficiente ({potenza_generata:.0f}W). Spengo il wallbox."))
-                        if wallbox.fase == 1:
-                            asyncio.run(invia_notifica(f"⚠️ Consiglio: mettere l'impianto in modalità monofase per sfruttare meglio la potenza disponibile."))
-                        else:
-                            asyncio.run(invia_notifica(f"⚠️ Consiglio: staccare la macchina"))
-                    except Exception as e:
-                        print(f"[ERRORE] Invio notifica fallito: {e}")
+                    notifier.invia(f"⚠️ Attenzione! La potenza generata è insufficiente ({potenza_generata:.0f}W). Spengo il wallbox.")
+                    if wallbox.fase == 1:
+                        notifier.invia(f"⚠️ Consiglio: mettere l'impianto in modalità monofase per sfruttare meglio la potenza disponibile.")
+                    else:
+                        notifier.invia(f"⚠️ Consiglio: staccare la macchina")
                     wallbox.turn_off(force=True)
                     return
                 else:
@@ -323,19 +304,15 @@ def run_logic(monitor, wallbox):
             print(f"[DECISIONE] Aumento potenza a {nuova_potenza:.0f}W")
             wallbox.set_power(nuova_potenza)
 
-async def invia_notifica(messaggio):
-    bot = Bot(token=API_KEY)
-    await bot.send_message(chat_id=CHAT_ID, text=messaggio)
-    print(f"[INFO] Messaggio telegram ('{messaggio}') inviato correttamente!")
+# Bot persistente in background: le notifiche partono senza fermare il controllo
+notifier = TelegramNotifier(API_KEY, CHAT_ID)
 
 # -----------------------------------------------------------
 # MAIN
 # -----------------------------------------------------------
 def main():
-    try: 
-        asyncio.run(invia_notifica(f"SISTEMA AVVIATO. Inizializzazione in corso..."))
-    except Exception as e:
-        print(f"[ERRORE] Invio notifica avvio fallito: {e}")
+    notifier.avvia()
+    notifier.invia(f"SISTEMA AVVIATO. Inizializzazione in corso...")
     
     monitor = EnergyMonitor()
     wallbox = WallboxController()
@@ -365,6 +342,7 @@ def main():
 
         except KeyboardInterrupt:
             wallbox.turn_off(force=True)
+            notifier.attendi(5)
             break
         except Exception as e:
             time.sleep(0.5)
@@ -1,29 +1,56 @@
+from __future__ import annotations
+
+import time
+T_AVVIO = time.perf_counter()  # inizio del profilo di avvio, prima degli import pesanti
 import socket
 import struct
-import xml.etree.ElementTree as ET
-import time
 import requests
 import logging
 import json
 import os
 import asyncio
 import threading
-import io
-import matplotlib
-
-from solaar_eric import invia_notifica
-matplotlib.use('Agg') # Backend non interattivo per thread-safety
-import matplotlib.pyplot as plt
+import zlib
+import select
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from packet_decoder import PacketDecoder, PacketCoalescer, ELECTRICITY, SOLAR
+from wallbox_client import WallboxClient
+from wallbox_dispatcher import WallboxDispatcher
+from notifier import TelegramNotifier
+from telemetry import TelemetryRing
+from telemetry_store import TelemetryStore
+from push_stream import PushHub
+from log_ring import LogRing, LIVELLI as LIVELLI_LOG
+from grafici import ChartRenderer, durata_da_testo, testo_durata
+from rollup import RollupPyramid, LIVELLI, storico_finestra
+from startup_profile import StartupProfile
+from packet_recorder import PacketRecorder
+from uplink import UplinkAggregatore
+from state_snapshot import StatoLive
+from response_cache import CacheRisposte
+from allocazione import Richiesta, ripartisci
+from previsione import PrevisioneSurplus
+from static_assets import AssetStatici
+from web_server import ServerWeb, comprimi_risposte
+from metrics import Registro, CONTENT_TYPE, BUCKET_PARSE, BUCKET_DECISIONE, BUCKET_HTTP, BUCKET_TELEGRAM
 
 from dotenv import load_dotenv
-from telegram import Bot, Update
-from telegram.ext import Application, CommandHandler, ContextTypes
-from flask import Flask, jsonify, request, render_template_string
+from flask import Flask, jsonify, request
+
+# python-telegram-bot viene importato solo dal thread del bot (run_telegram_polling)
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
+
+profilo = StartupProfile(T_AVVIO)
+profilo.segna('import')
 
 # -----------------------------------------------------------
 # CONFIGURAZIONE WEB & GLOBALE
 # -----------------------------------------------------------
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)
 
 # Usiamo un dizionario per i parametri modificabili così sono condivisi tra Thread
 CONFIG = {
@@ -36,33 +63,125 @@ CONFIG = {
     'COOLDOWN_ACCENSIONE': 60,
     'UPDATE_INTERVAL_S': 5,
     'TIMER_SPEGNIMENTO': 60,
+    'MARGINE_AUMENTO_W': 100,       # Export lasciato libero quando run_logic aumenta la carica
+    'MARGINE_RIDUZIONE_W': 200,     # Margine sotto il surplus quando riduce (evito on/off)
+    'IMPORT_SPEGNIMENTO_W': 200,    # Prelievo oltre il quale, finito il timer, la wallbox si spegne
     'MCAST_GRP': '224.192.32.19',
     'MCAST_PORT': 22600,
     'IFACE': '192.168.1.23',
     'WALLBOX_IP': '192.168.1.22',
+    'WALLBOX_AGGIUNTIVE': [],       # Altre wallbox: [{'nome': 'garage', 'ip': '192.168.1.24', 'priorita': 1, 'garantita': 0, 'min': None, 'max': None}]
+    'RIPARTIZIONE': 'priorita',     # Divisione del surplus tra più wallbox: 'priorita', 'equa', 'garantita'
     'PORT' :5000,
+    'SERVER_WEB': 'waitress',       # 'waitress' (pool limitato, keep-alive) o 'sviluppo' (werkzeug, un thread per connessione)
+    'WEB_THREADS': 4,               # Richieste web eseguite insieme: le altre aspettano senza rubare CPU al controllo
+    'WEB_CONNESSIONI': 100,         # Connessioni aperte massime, keep-alive comprese (solo waitress)
+    'PUSH_PORT': 5001,              # Stream Server-Sent Events per la dashboard (None = solo polling)
     'SMOOTHING_ALPHA': 0.9, 
-    'MAX_DELTA_PER_SEC': 1500
+    'MAX_DELTA_PER_SEC': 1500,
+    'INGESTIONE_ASYNC': True,       # Ricezione pacchetti su loop asyncio (False = ciclo su thread con recv_into)
+    'TICK_CONTROLLO_S': 1.0,        # Ogni quanto run_logic valuta l'ultima lettura disponibile
+    'PREVISIONE': False,            # True = calcola solare e consumi previsti e li mostra in /api/data; non entrano nelle decisioni (sperimentale, vedi benchmarks/bench_previsione.py)
+    'PREVISIONE_ORIZZONTE_S': 60,   # Secondi su cui prevedere il surplus
+    'PREVISIONE_PERSISTENZA_S': 30, # Secondi che un aumento del solare deve durare prima di alzare la carica
+    'PREVISIONE_PERSISTENZA_CASA_S': 5,  # Secondi che un calo dei consumi deve durare prima di alzare la carica
+    'STORICO_CAMPIONI': 86400,      # Capacità storico letture (~3.8 MB, un giorno a 1 lettura/s)
+    'GRAFICO_PUNTI': 30,            # Punti inviati a dashboard e /grafici
+    'GRAFICO_MAX_PUNTI': 300,       # Punti massimi per i grafici su finestre lunghe (?finestra=)
+    'ARCHIVIO_DB': 'storico.db',    # Archivio SQLite di letture e comandi (None = disattivato)
+    'ARCHIVIO_BATCH_S': 5,          # Ogni quanto l'archivio scrive su disco
+    'LOG_RIGHE': 400,               # Righe di log conservate per decisioni, azioni ed errori
+    'LOG_RIGHE_INFO': 100,          # Righe di log INFO (i ripetuti diventano una riga ×N)
+    'REGISTRA_PACCHETTI': None,     # File .rec.gz dove salvare pacchetti e comandi per replay.py (None = no)
+    'CACHE_API_DATA': True,         # Corpo di /api/data serializzato una volta e condiviso tra le dashboard
+    'AGGREGATORE_URL': None,        # Aggregatore di flotta (aggregatore.py), es. 'http://server:5100' (None = no)
+    'SITO_NOME': socket.gethostname(),  # Nome di questo controller nell'aggregatore
+    'AGGREGATORE_TOKEN': None,      # Token comune richiesto dall'aggregatore (aggregatore.py --token)
+    'AGGREGATORE_BATCH_S': 10       # Ogni quanto inviare un lotto all'aggregatore
 }
 
 WALLBOX_URL = f"http://{CONFIG['WALLBOX_IP']}/index.json"
 
-# Stato condiviso per la Web UI e Telegram
+# Letture e stato wallbox: istantanea immutabile, pubblicata da controllo e coda
+# comandi. Chi legge prende STATO.attuale una volta sola e non tocca altro.
+STATO = StatoLive()
+
+# Stato condiviso per la Web UI e Telegram (buffer con i loro lock e contatori)
 SYSTEM_STATE = {
-    'ULTIMA_LETTURA_FASI': None,
-    'ULTIMA_LETTURA_SOLARE': None,
-    'ULTIME_LETTURE_FASI': [],   # Buffer per il grafico
-    'ULTIME_LETTURE_SOLARE': [], # Buffer per il grafico
-    'MONITOR_FASI': [0,0,0,0,0,0],
-    'WALLBOX_POWER': 0,
-    'WALLBOX_STATUS': False,
-    'IMPIANTO_FASE': 0, # 0=Mono, 1=Tri
-    'LOGS': [] # Buffer per la console Web
+    'STORICO': TelemetryRing(CONFIG['STORICO_CAMPIONI']),  # Fasi, rete, solare e wallbox per il grafico
+    'ROLLUP': RollupPyramid(), # Aggregati 10s / 1min / 15min / 1h per i grafici su finestre lunghe
+    'INGRESSO': {}, # Contatori pacchetti (ricevuti, coalescati, scartati, elaborati)
+    'INGRESSO_TAG': {}, # Gli stessi contatori per tipo di pacchetto, per /metrics
+    'WALLBOX_RTT': {}, # Round trip HTTP verso la wallbox per tipo di comando
+    'WALLBOX_CODA': {}, # Contatori della coda comandi (inviati, falliti, coalescati)
+    'NOTIFICHE': {}, # Contatori delle notifiche Telegram
+    'ARCHIVIO': {}, # Contatori dell'archivio su disco
+    'GRAFICI': {}, # Grafici Telegram generati e serviti dalla cache
+    'AVVIO': profilo.tempi, # Secondi dall'avvio in cui ogni fase è pronta
+    'PUSH': {}, # Client collegati allo stream live e eventi inviati
+    'CACHE_API': {}, # Corpi di /api/data generati e serviti dalla cache
+    'WALLBOX_GRUPPO': {}, # Stato e quota di ogni wallbox quando sono più di una
+    'UPLINK': {}, # Lotti inviati all'aggregatore di flotta
+    'LOGS': LogRing(CONFIG['LOG_RIGHE'], CONFIG['LOG_RIGHE_INFO']) # Buffer per la console Web
 }
 
 # Variabile globale per accedere al controller dalla UI Web e da Telegram
 wallbox_instance = None 
 
+# -----------------------------------------------------------
+# METRICHE PER PROMETHEUS (/metrics)
+# -----------------------------------------------------------
+# Gli istogrammi vengono aggiornati sul thread che misura; i contatori sono
+# quelli già presenti in SYSTEM_STATE, letti solo quando arriva la richiesta.
+metriche = Registro('solar_')
+METRICA_PARSE = metriche.istogramma(
+    'parse_packet_secondi', "Durata di EnergyMonitor.parse_packet per pacchetto", BUCKET_PARSE)
+METRICA_DECISIONE = metriche.istogramma(
+    'latenza_decisione_secondi', "Dall'arrivo del primo pacchetto in attesa alla fine di run_logic", BUCKET_DECISIONE)
+METRICA_WALLBOX = metriche.istogramma(
+    'wallbox_rtt_secondi', "Round trip HTTP verso la wallbox per wallbox e tipo di comando", BUCKET_HTTP,
+    'btn', ('P', 'i', 'o', 'stato'))
+METRICA_TELEGRAM = metriche.istogramma(
+    'telegram_invio_secondi', "Durata degli invii delle notifiche Telegram", BUCKET_TELEGRAM)
+
+def _per_tag(valore):
+    return [((tag,), valore(conta)) for tag, conta in SYSTEM_STATE['INGRESSO_TAG'].items()]
+
+def _pacchetti_scartati():
+    righe = []
+    for tag, conta in SYSTEM_STATE['INGRESSO_TAG'].items():
+        righe.append(((tag, 'coalescato'), conta['coalescati']))
+        righe.append(((tag, 'non_valido'), conta['scartati']))
+    return righe
+
+def _comandi_wallbox():
+    righe = []
+    for btn, t in list(SYSTEM_STATE['WALLBOX_RTT'].items()):
+        righe.append(((btn, 'ok'), t['n'] - t['errori']))
+        righe.append(((btn, 'errore'), t['errori']))
+    return righe
+
+def _eta_letture():
+    stato = STATO.attuale
+    now = time.time()
+    return [((tipo,), round(now - t, 3))
+            for tipo, t in (('fasi', stato.ultima_lettura_fasi), ('solare', stato.ultima_lettura_solare))
+            if t is not None]
+
+metriche.contatore('pacchetti_ricevuti_total', "Pacchetti multicast ricevuti per tag radice",
+                   lambda: _per_tag(lambda c: c['ricevuti']), ('tag',))
+metriche.contatore('pacchetti_decodificati_total', "Pacchetti decodificati da parse_packet per tag radice",
+                   lambda: _per_tag(lambda c: c['elaborati'] - c['scartati']), ('tag',))
+metriche.contatore('pacchetti_scartati_total', "Pacchetti sostituiti nel coalescer o non decodificabili",
+                   _pacchetti_scartati, ('tag', 'motivo'))
+metriche.contatore('wallbox_comandi_total', "Richieste HTTP alla wallbox per tipo ed esito",
+                   _comandi_wallbox, ('btn', 'esito'))
+metriche.contatore('telegram_notifiche_total', "Notifiche Telegram per esito",
+                   lambda: [((k,), SYSTEM_STATE['NOTIFICHE'].get(k, 0))
+                            for k in ('accodati', 'inviati', 'errori', 'scartati', 'duplicati')], ('esito',))
+metriche.valore('eta_lettura_secondi', "Secondi trascorsi dall'ultima lettura del contatore",
+                _eta_letture, ('tipo',))
+
 # ... (tutti i tuoi import)
 
 load_dotenv()
@@ -77,19 +196,130 @@ logging.getLogger("werkzeug").setLevel(logging.ERROR)
 logging.getLogger("telegram").setLevel(logging.WARNING)
 # -----------------------
 
-def log_msg(msg):
-    """Salva il log sia su terminale che nel buffer per la Web UI"""
-    t_str = time.strftime("%H:%M:%S")
-    full_msg = f"[{t_str}] {msg}"
-    print(full_msg, flush=True)
-    SYSTEM_STATE['LOGS'].append(full_msg)
-    # Tieni solo gli ultimi 50 messaggi in memoria per non appesantire
-    if len(SYSTEM_STATE['LOGS']) > 50:
-        SYSTEM_STATE['LOGS'].pop(0)
+def log_msg(msg, livello=None):
+    """Salva il log nel buffer per la Web UI e lo stampa su terminale.
+    Il livello, se non indicato, viene dal prefisso ([INFO], [DECISIONE], ...)"""
+    SYSTEM_STATE['LOGS'].scrivi(msg, livello)
+    push.segnala()
+
+# Notifiche unilaterali: un solo bot persistente, messaggi accodati e inviati in background
+notifier = TelegramNotifier(API_KEY, CHAT_ID, log=log_msg, istogramma=METRICA_TELEGRAM)
+SYSTEM_STATE['NOTIFICHE'] = notifier.stats
+
+def notifica(messaggio):
+    """Accoda una notifica Telegram; chi chiama non aspetta mai l'invio"""
+    notifier.invia(messaggio)
+
+# Stream live della dashboard: chi aggiorna lo stato chiama push.segnala()
+push = PushHub(log=log_msg)
+SYSTEM_STATE['PUSH'] = push.stats
+
+# Archivio su disco, aperto in main() (None finché non è attivo)
+archivio = None
+
+# Storico e aggregati vengono sostituiti una volta sola, quando la ricarica dall'archivio è pronta
+_storico_lock = threading.Lock()
+
+def avvia_archivio():
+    """Apre l'archivio SQLite; le letture salvate vengono ricaricate in background"""
+    global archivio
+    if not CONFIG['ARCHIVIO_DB']:
+        return
+    try:
+        archivio = TelemetryStore(CONFIG['ARCHIVIO_DB'], batch_s=CONFIG['ARCHIVIO_BATCH_S'], log=log_msg)
+    except Exception as e:
+        log_msg(f"[ERRORE] Archivio non disponibile: {e}")
+        archivio = None
+        return
+    SYSTEM_STATE['ARCHIVIO'] = archivio.stats
+    threading.Thread(target=ricarica_storico, args=(time.time(),), name='ricarica', daemon=True).start()
+
+def ricarica_storico(t_avvio):
+    """Ricostruisce storico e aggregati con le letture archiviate prima di t_avvio.
+
+    Il controllo non aspetta: le letture live vanno intanto nelle strutture vuote
+    create all'avvio. A ricarica finita quelle letture vengono copiate in coda
+    alle nuove strutture, che prendono il loro posto.
+    """
+    try:
+        righe = archivio.ultime_letture(CONFIG['STORICO_CAMPIONI'], prima_di=t_avvio)
+        storico = TelemetryRing(CONFIG['STORICO_CAMPIONI'])
+        for t, l1, l2, l3, l4, l5, l6, grid, solar, wb in righe:
+            storico.append(t, (l1, l2, l3, l4, l5, l6), grid, solar, wb)
+        # Aggregati dall'archivio, ogni livello per la sua durata: i bucket salvati ai riavvii
+        # precedenti si leggono, solo quelli successivi si ricalcolano dalle letture
+        piramide = RollupPyramid()
+        for risoluzione, capacita in LIVELLI:
+            piramide.carica(risoluzione, archivio.aggregati(risoluzione, t_avvio - risoluzione * capacita, t_avvio))
+    except Exception as e:
+        log_msg(f"[ERRORE] Ricarica storico dall'archivio: {e}")
+        return
+
+    with _storico_lock:
+        live = SYSTEM_STATE['STORICO']
+        colonne = {nome: live.valori(nome) for nome in ('t', 'l1', 'l2', 'l3', 'l4', 'l5', 'l6', 'grid', 'solar', 'wb')}
+        for i, t in enumerate(colonne['t']):
+            fasi = tuple(colonne[f'l{j}'][i] for j in range(1, 7))
+            storico.append(t, fasi, colonne['grid'][i], colonne['solar'][i], colonne['wb'][i])
+            piramide.aggiungi(t, fasi, colonne['grid'][i], colonne['solar'][i], colonne['wb'][i])
+        SYSTEM_STATE['STORICO'] = storico
+        SYSTEM_STATE['ROLLUP'] = piramide
+    profilo.segna('storico')
+    log_msg(f"Archivio {CONFIG['ARCHIVIO_DB']}: ricaricate {len(righe)} letture")
+
+def registra_lettura(t, fasi, grid, solar, wb):
+    """Aggiunge un campione allo storico e agli aggregati in memoria e lo accoda per l'archivio"""
+    with _storico_lock:
+        SYSTEM_STATE['STORICO'].append(t, fasi, grid, solar, wb)
+        SYSTEM_STATE['ROLLUP'].aggiungi(t, fasi, grid, solar, wb)
+    if archivio is not None:
+        archivio.lettura(t, fasi, grid, solar, wb)
+    if uplink is not None:
+        uplink.lettura(t, fasi, wb)
+    push.segnala()
+
+def registra_comando(btn, watts):
+    t = time.time()
+    if archivio is not None:
+        archivio.comando(t, btn, watts)
+    if registratore is not None:
+        registratore.comando(f'P{watts}' if btn == 'P' else btn, t)
+    if uplink is not None:
+        uplink.comando(t, btn, watts)
+
+# Registrazione dei pacchetti grezzi per il replay, aperta in main() se configurata
+registratore = None
+
+# Invio della telemetria all'aggregatore di flotta, aperto in main() se configurato
+uplink = None
+
+def stato_uplink():
+    """Riassunto inviato all'aggregatore con ogni lotto"""
+    stato = STATO.attuale
+    return {
+        'wb_on': stato.wallbox_on,
+        'setpoint': stato.wallbox_potenza,
+        'fase': stato.impianto_fase,
+        'prelevabile': CONFIG['POTENZA_PRELEVABILE'],
+        'protezione': CONFIG['POTENZA_PROTEZIONE'],
+        'coda': dict(SYSTEM_STATE['WALLBOX_CODA']),
+        'wallbox': SYSTEM_STATE['WALLBOX_GRUPPO'],
+    }
 
 # -----------------------------------------------------------
 # GESTIONE TELEGRAM BOT (RICEZIONE COMANDI)
 # -----------------------------------------------------------
+def log_esito(descrizione):
+    """Callback per i Future della coda wallbox: registra l'esito senza che il chiamante aspetti"""
+    def callback(future):
+        try:
+            ok = future.result()
+        except Exception as e:
+            log_msg(f"[ERRORE] {descrizione}: {e}")
+            return
+        log_msg(f"[INFO] {descrizione}: {'confermato' if ok else 'FALLITO'}")
+    return callback
+
 def check_auth(update: Update) -> bool:
     """Verifica che il comando provenga dall'utente autorizzato."""
     if str(update.effective_chat.id) != str(CHAT_ID):
@@ -106,18 +336,18 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/spegni - Forza lo spegnimento della Wallbox\n"
         "/setPotenzaPrelevabile <W> - Imposta potenza prelevabile dalla rete\n"
         "/setPotenzaProtezione <W> - Imposta la soglia di protezione\n"
-        "/grafici - Invia il grafico real-time delle potenze\n"
+        "/grafici [6h] - Invia il grafico delle potenze (ultime letture o finestra: 30m, 6h, 7d)\n"
     )
     await update.message.reply_text(msg, parse_mode='Markdown')
 
 async def cmd_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not check_auth(update): return
-    fasi = SYSTEM_STATE['MONITOR_FASI']
-    tot_grid = sum(fasi[0:3])
-    tot_solar = sum(fasi[3:6])
-    wb_status = "🟢 ON" if SYSTEM_STATE['WALLBOX_STATUS'] else "🔴 OFF"
-    wb_power = SYSTEM_STATE['WALLBOX_POWER'] if SYSTEM_STATE['WALLBOX_STATUS'] else 0
-    modalita = "Trifase" if SYSTEM_STATE['IMPIANTO_FASE'] == 1 else "Monofase"
+    stato = STATO.attuale
+    tot_grid = stato.rete
+    tot_solar = stato.solare
+    wb_status = "🟢 ON" if stato.wallbox_on else "🔴 OFF"
+    wb_power = stato.potenza_wallbox
+    modalita = "Trifase" if stato.impianto_fase == 1 else "Monofase"
     
     msg = (
         "📊 *Stato Sistema*\n\n"
@@ -135,7 +365,9 @@ async def cmd_accendi(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if wallbox_instance:
         # clear any manual off override so automation can resume
         wallbox_instance.manual_off = False
-        wallbox_instance.turn_on()
+        future = wallbox_instance.turn_on()
+        if future:
+            future.add_done_callback(log_esito("[TELEGRAM] Accensione Wallbox"))
         await update.message.reply_text("✅ *Comando inviato:* Accensione Wallbox (override manuale disattivato)", parse_mode='Markdown')
 
 async def cmd_spegni(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -143,7 +375,9 @@ async def cmd_spegni(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if wallbox_instance:
         # activate manual off override so it stays off until /accendi
         wallbox_instance.manual_off = True
-        wallbox_instance.turn_off(force=True)
+        future = wallbox_instance.turn_off(force=True)
+        if future:
+            future.add_done_callback(log_esito("[TELEGRAM] Spegnimento Wallbox"))
         await update.message.reply_text("🛑 *Comando inviato:* Spegnimento Wallbox (override manuale attivo)", parse_mode='Markdown')
 
 async def cmd_set_prelevabile(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -166,55 +400,55 @@ async def cmd_set_protezione(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except (IndexError, ValueError):
         await update.message.reply_text("⚠️ Usa il formato: `/setPotenzaProtezione 300`", parse_mode='Markdown')
 
+def serie_grafico(finestra):
+    """Dati per /grafici: le ultime letture, oppure la finestra in secondi dagli aggregati"""
+    storico = SYSTEM_STATE['STORICO']
+    if finestra is None:
+        n = CONFIG['GRAFICO_PUNTI']
+        return "Andamento Energetico Real-Time", {nome: storico.valori(nome, ultimi=n) for nome in ('t', 'grid', 'solar', 'wb')}
+    now = time.time()
+    _, serie = storico_finestra(storico, SYSTEM_STATE['ROLLUP'], now - finestra, now + 1, CONFIG['GRAFICO_MAX_PUNTI'])
+    return f"Andamento Energetico - ultime {testo_durata(finestra)}", serie
+
+# Rendering su un thread dedicato, PNG in cache finché non arrivano letture nuove
+renderer_grafici = ChartRenderer(serie_grafico)
+SYSTEM_STATE['GRAFICI'] = renderer_grafici.stats
+
 async def cmd_grafici(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not check_auth(update): return
-    
-    history = SYSTEM_STATE['ULTIME_LETTURE_FASI']
-    if not history or len(history) < 2:
+
+    finestra = None
+    if context.args:
+        finestra = durata_da_testo(context.args[0])
+        if finestra is None:
+            await update.message.reply_text("⚠️ Usa il formato: `/grafici` oppure `/grafici 6h` (anche 30m, 7d)", parse_mode='Markdown')
+            return
+
+    storico = SYSTEM_STATE['STORICO']
+    if len(storico) < 2:
         await update.message.reply_text("⏳ Non ci sono ancora abbastanza dati per generare il grafico. Riprova tra poco.")
         return
 
-    await update.message.reply_text("📊 Generazione grafico in corso...")
-    
-    # Prepara i dati per matplotlib
-    times = [time.strftime("%H:%M:%S", time.localtime(h[3])) for h in history]
-    grid = [h[0] for h in history]
-    solar = [h[1] for h in history]
-    wb = [h[4] if len(h) > 4 else 0 for h in history]
-
-    # Crea il grafico
-    plt.figure(figsize=(10, 5))
-    plt.plot(times, grid, label='Consumo Rete (W)', color='#ff6384', linewidth=2)
-    plt.fill_between(times, solar, color='#4bc0c0', alpha=0.2)
-    plt.plot(times, solar, label='Produzione Solare (W)', color='#4bc0c0', linewidth=2)
-    plt.fill_between(times, wb, color='#36a2eb', alpha=0.1)
-    plt.plot(times, wb, label='Potenza Wallbox (W)', color='#36a2eb', linewidth=2)
-    
-    plt.title("Andamento Energetico Real-Time")
-    plt.xlabel("Orario")
-    plt.ylabel("Watt (W)")
-    plt.legend(loc="upper left")
-    plt.grid(True, linestyle='--', alpha=0.6)
-    
-    # Mostra solo alcuni tick sull'asse X per evitare sovrapposizioni
-    plt.xticks(rotation=45)
-    plt.gca().xaxis.set_major_locator(plt.MaxNLocator(8)) 
-    plt.tight_layout()
-
-    # Salva in memoria (BytesIO)
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
+    future = renderer_grafici.png(finestra, storico.seq)
+    if not future.done():
+        await update.message.reply_text("📊 Generazione grafico in corso...")
+    try:
+        png = await asyncio.wrap_future(future)
+    except Exception as e:
+        log_msg(f"[ERRORE] Grafico: {e}")
+        await update.message.reply_text("❌ Errore nella generazione del grafico.")
+        return
 
     # Invia l'immagine
-    await update.message.reply_photo(photo=buf)
+    await update.message.reply_photo(photo=png)
 
 def run_telegram_polling():
     """Inizializza e avvia il polling di Telegram in un thread separato"""
     if not API_KEY:
         log_msg("[TELEGRAM] API_KEY mancante. Bot disabilitato.")
         return
+
+    from telegram.ext import Application, CommandHandler
     
     app = Application.builder().token(API_KEY).build()
     
@@ -227,6 +461,7 @@ def run_telegram_polling():
     app.add_handler(CommandHandler("setPotenzaProtezione", cmd_set_protezione))
     app.add_handler(CommandHandler("grafici", cmd_grafici))
     
+    profilo.segna('telegram')
     log_msg(">>> BOT TELEGRAM ATTIVO. In attesa di comandi... <<<")
     # stop_signals=None evita conflitti di segnali con il thread principale
     app.run_polling(stop_signals=None)
@@ -234,282 +469,157 @@ def run_telegram_polling():
 # -----------------------------------------------------------
 # INTERFACCIA WEB (HTML/JS)
 # -----------------------------------------------------------
-# (Il template HTML rimane invariato, l'ho tenuto per completezza dello script)
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="it">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Solar Monitor - by Eric and Gemini</title>
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-    <style>
-        body { font-family: 'Segoe UI', sans-serif; background: #f4f4f9; padding: 20px; color: #333; }
-        .container { max-width: 1000px; margin: 0 auto; }
-        .card { background: white; padding: 20px; border-radius: 10px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); margin-bottom: 20px; }
-        h2 { margin-top: 0; color: #444; }
-        .grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 20px; }
-        .stat { font-size: 1.2em; margin: 10px 0; }
-        .stat span { font-weight: bold; color: #007bff; }
-        .input-group { margin-bottom: 15px; }
-        label { display: block; margin-bottom: 5px; font-weight: bold; }
-        input[type="number"] { width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px; }
-        button { background: #28a745; color: white; border: none; padding: 10px 20px; border-radius: 4px; cursor: pointer; width: 100%; font-size: 1em; }
-        button:hover { background: #218838; }
-        .btn-warning { background: #ffc107; color: #333; margin-top: 15px; }
-        .btn-warning:hover { background: #e0a800; }
-        .phase-box { display: flex; justify-content: space-between; border-bottom: 1px solid #eee; padding: 5px 0; }
-        .tot-box { display: flex; justify-content: space-between; background-color: #e9ecef; padding: 8px 5px; margin-top: 10px; border-radius: 4px; font-weight: bold; }
-        .status-on { color: green; font-weight: bold; }
-        .status-off { color: red; font-weight: bold; }
-        .time-ago { font-weight: normal !important; font-style: italic; color: #888 !important; font-size: 0.9em; margin-left: 5px; }
-        
-        /* Stile per la Console */
-        .console-box { 
-            background: #1e1e1e; 
-            color: #00ff00; 
-            font-family: 'Courier New', Courier, monospace; 
-            height: 250px; 
-            overflow-y: scroll; 
-            padding: 15px; 
-            border-radius: 5px; 
-            font-size: 0.9em; 
-            line-height: 1.4;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>☀️ Solar Controller</h1>
-        
-        <div class="grid">
-            <div class="card">
-                <h2>⚙️ Impostazioni</h2>
-                <div class="input-group">
-                    <label>Potenza Prelevabile (W)</label>
-                    <input type="number" id="prelevabile" value="0">
-                </div>
-                <div class="input-group">
-                    <label>Potenza Protezione (W)</label>
-                    <input type="number" id="protezione" value="300">
-                </div>
-                <button onclick="updateSettings()">Salva Impostazioni</button>
-                <button class="btn-warning" onclick="reinitWallbox()">🔄 Re-Inizializza Wallbox</button>
-            </div>
-
-            <div class="card">
-                <h2>🔌 Stato Sistema</h2>
-                <div class="stat">Wallbox: <span id="wb_status">--</span></div>
-                <div class="stat">Potenza WB: <span id="wb_power">0</span> W</div>
-                <div class="stat">Modalità: <span id="wb_mode">--</span></div>
-                <div class="stat" style="font-size: 0.9em; color: #666;">Ultimo Agg. Fasi: <span id="last_fasi">--</span> <span id="sec_fasi" class="time-ago"></span></div>
-                <div class="stat" style="font-size: 0.9em; color: #666;">Ultimo Agg. Solare: <span id="last_solar">--</span> <span id="sec_solar" class="time-ago"></span></div>
-            </div>
-        </div>
-
-        <div class="card">
-            <h2>⚡ Dettaglio Fasi</h2>
-            <div class="grid">
-                <div>
-                    <h3>Consumo Rete (Grid)</h3>
-                    <div class="phase-box"><span>L1:</span> <span><span id="l1">0</span> W</span></div>
-                    <div class="phase-box"><span>L2:</span> <span><span id="l2">0</span> W</span></div>
-                    <div class="phase-box"><span>L3:</span> <span><span id="l3">0</span> W</span></div>
-                    <div class="tot-box"><span>TOTALE RETE:</span> <span><span id="tot_grid">0</span> W</span></div>
-                </div>
-                <div>
-                    <h3>Produzione (Solar)</h3>
-                    <div class="phase-box"><span>L4:</span> <span><span id="l4">0</span> W</span></div>
-                    <div class="phase-box"><span>L5:</span> <span><span id="l5">0</span> W</span></div>
-                    <div class="phase-box"><span>L6:</span> <span><span id="l6">0</span> W</span></div>
-                    <div class="tot-box"><span>TOTALE SOLARE:</span> <span><span id="tot_solar">0</span> W</span></div>
-                </div>
-            </div>
-        </div>
-
-        <div class="card">
-            <h2>📈 Grafico Real-time</h2>
-            <canvas id="energyChart"></canvas>
-        </div>
-
-        <div class="card">
-            <h2>🖥️ Console Live</h2>
-            <div id="console" class="console-box"></div>
-        </div>
-    </div>
-
-    <script>
-        const ctx = document.getElementById('energyChart').getContext('2d');
-        const chart = new Chart(ctx, {
-            type: 'line',
-            data: {
-                labels: [],
-                datasets: [{
-                    label: 'Consumo Rete (W)',
-                    borderColor: 'rgb(255, 99, 132)',
-                    data: [],
-                    fill: false,
-                    tension: 0.1
-                }, {
-                    label: 'Produzione Solare (W)',
-                    borderColor: 'rgb(75, 192, 192)',
-                    data: [],
-                    fill: true,
-                    backgroundColor: 'rgba(75, 192, 192, 0.2)',
-                    tension: 0.1
-                }, {
-                    label: 'Potenza Wallbox (W)',
-                    borderColor: 'rgb(54, 162, 235)',
-                    data: [],
-                    fill: true,
-                    backgroundColor: 'rgba(54, 162, 235, 0.1)',
-                    tension: 0.1
-                }]
-            },
-            options: {
-                responsive: true,
-                scales: { 
-                    x: { display: false },
-                    y: { beginAtZero: true }
-                },
-                animation: { duration: 0 }
-            }
-        });
-
-        function formatTime(timestamp) {
-            if (!timestamp) return "Mai";
-            const date = new Date(timestamp * 1000);
-            return date.toLocaleTimeString();
-        }
-
-        async function fetchData() {
-            try {
-                const response = await fetch('/api/data');
-                const data = await response.json();
+# La pagina, il suo CSS/JS e Chart.js stanno in static/ e vengono serviti da
+# AssetStatici: già compressi, con ETag e cache immutabile per gli URL
+# versionati. La porta dello stream push arriva con lo status di /api/data.
+asset_statici = AssetStatici(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
 
-                if (document.activeElement.id !== 'prelevabile') 
-                    document.getElementById('prelevabile').placeholder = data.config.prelevabile;
-                if (document.activeElement.id !== 'protezione') 
-                    document.getElementById('protezione').placeholder = data.config.protezione;
+def servi_asset(nome):
+    return asset_statici.risposta(nome, request, app.response_class)
 
-                const wbSpan = document.getElementById('wb_status');
-                wbSpan.innerText = data.status.wb_on ? "ON" : "OFF";
-                wbSpan.className = data.status.wb_on ? "status-on" : "status-off";
-                
-                document.getElementById('wb_power').innerText = data.status.wb_power;
-                document.getElementById('wb_mode').innerText = data.status.fase_mode === 1 ? "Trifase" : "Monofase";
-                
-                const serverTime = data.status.server_time;
-                const lastFasi = data.status.last_fasi;
-                const lastSolar = data.status.last_solar;
-
-                document.getElementById('last_fasi').innerText = formatTime(lastFasi);
-                document.getElementById('sec_fasi').innerText = lastFasi ? `(${Math.max(0, Math.round(serverTime - lastFasi))}s fa)` : '';
-                
-                document.getElementById('last_solar').innerText = formatTime(lastSolar);
-                document.getElementById('sec_solar').innerText = lastSolar ? `(${Math.max(0, Math.round(serverTime - lastSolar))}s fa)` : '';
-
-                const f = data.status.fasi;
-                for(let i=0; i<6; i++) {
-                    document.getElementById('l'+(i+1)).innerText = Math.round(f[i]);
-                }
-                document.getElementById('tot_grid').innerText = Math.round(data.status.grid_total);
-                document.getElementById('tot_solar').innerText = Math.round(data.status.solar_total);
-
-                const history = data.history;
-                chart.data.labels = history.map(h => formatTime(h.time));
-                chart.data.datasets[0].data = history.map(h => h.grid);
-                chart.data.datasets[1].data = history.map(h => h.solar);
-                chart.data.datasets[2].data = history.map(h => h.wb);
-                chart.update();
-
-                const consoleDiv = document.getElementById('console');
-                const isScrolledToBottom = consoleDiv.scrollHeight - consoleDiv.clientHeight <= consoleDiv.scrollTop + 5;
-                
-                consoleDiv.innerHTML = data.logs.join('<br>');
-                
-                if (isScrolledToBottom) {
-                    consoleDiv.scrollTop = consoleDiv.scrollHeight;
-                }
-
-            } catch (e) { console.error("Errore fetch:", e); }
-        }
-
-        async function updateSettings() {
-            const prelevabile = document.getElementById('prelevabile').value;
-            const protezione = document.getElementById('protezione').value;
-            
-            await fetch('/api/settings', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ 
-                    prelevabile: parseInt(prelevabile), 
-                    protezione: parseInt(protezione) 
-                })
-            });
-            alert("Impostazioni salvate!");
-            fetchData();
-        }
+@app.route('/')
+def index():
+    return servi_asset('index.html')
 
-        async function reinitWallbox() {
-            if (!confirm("Sei sicuro di voler forzare la re-inizializzazione della Wallbox?")) return;
-            try {
-                const response = await fetch('/api/init_wallbox', { method: 'POST' });
-                const result = await response.json();
-                if (result.success) {
-                    alert("Comando inviato! Controlla la console per l'esito.");
-                    fetchData();
-                } else {
-                    alert("Errore nell'invio del comando.");
-                }
-            } catch (e) { console.error("Errore:", e); }
-        }
+@app.route('/static/<path:nome>')
+def file_statico(nome):
+    return servi_asset(nome)
 
-        fetchData();
-        setInterval(fetchData, 2000); 
-    </script>
-</body>
-</html>
-"""
+comprimi_risposte(app)
 
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
+cache_api_data = CacheRisposte()
+SYSTEM_STATE['CACHE_API'] = cache_api_data.stats
 
 @app.route('/api/data')
 def get_data():
+    """Stato per la dashboard.
+
+    Cursori: ?seq=<n>&log_seq=<n> sono i valori 'seq' e 'log_seq' dell'ultima
+    risposta ricevuta; tornano solo le letture e i log successivi (history_reset /
+    logs_reset = true se il cursore non è più valido e la lista è completa).
+    I log sono voci {id, seq, livello, n, riga}: una voce ripetuta torna con lo
+    stesso id, una seq nuova e il contatore n aggiornato.
+    Con If-None-Match uguale all'ETag corrente risponde 304 senza corpo.
+    Il corpo (e la sua versione gzip) è condiviso tra le richieste con stesso
+    ETag e stessi cursori: con più dashboard aperte viene prodotto una volta sola.
+    """
+    # L'ETag cambia con nuove letture o nuovi log, con i parametri e con ogni istantanea di stato
+    parametri = (CONFIG['POTENZA_PRELEVABILE'], CONFIG['POTENZA_PROTEZIONE'],
+                 request.args.get('finestra'), request.args.get('punti'))
+    etag = (f"{SYSTEM_STATE['STORICO'].seq}-{SYSTEM_STATE['LOGS'].seq}-{STATO.attuale.versione}-"
+            f"{zlib.crc32(repr(parametri).encode()):08x}")
+    if request.if_none_match.contains(etag):
+        risposta = app.response_class(status=304)
+        risposta.set_etag(etag)
+        return risposta
+
+    argomenti = (request.args.get('seq', type=int), request.args.get('log_seq', type=int),
+                 request.args.get('finestra', type=int), request.args.get('punti', type=int))
+    if CONFIG['CACHE_API_DATA']:
+        voce = cache_api_data.voce((etag,) + argomenti, lambda: app.json.dumps(dati_dashboard(*argomenti)).encode())
+        corpo, compresso = cache_api_data.corpo(voce, request.accept_encodings['gzip'] > 0)
+        risposta = app.response_class(corpo, mimetype='application/json')
+        if compresso:
+            risposta.headers['Content-Encoding'] = 'gzip'
+        risposta.vary.add('Accept-Encoding')
+    else:
+        risposta = jsonify(dati_dashboard(*argomenti))
+    risposta.set_etag(etag)
+    risposta.headers['Cache-Control'] = 'no-cache'
+    return risposta
+
+def copia_stats(valore):
+    """Copia dei contatori condivisi, da serializzare senza i thread che li aggiornano:
+    dict() e list() copiano in un colpo solo sotto il GIL, json invece itera a pezzi e
+    fallisce se nel frattempo un altro thread aggiunge una chiave."""
+    if isinstance(valore, dict):
+        return {k: copia_stats(v) for k, v in dict(valore).items()}
+    if isinstance(valore, (list, tuple)):
+        return [copia_stats(v) for v in list(valore)]
+    return valore
+
+def dati_dashboard(seq=None, log_seq=None, finestra=None, punti=None):
+    """Corpo di /api/data e degli eventi push: solo letture e log dopo i cursori"""
+    stato = STATO.attuale
+    storico = SYSTEM_STATE['STORICO']
+    seq_attuale = storico.seq
+    logs, log_seq_attuale, logs_reset = SYSTEM_STATE['LOGS'].dopo(log_seq)
+
+    # finestra=<secondi>: grafico su una finestra lunga, dagli aggregati
+    risoluzione = 0
+    if finestra:
+        punti = max(3, min(punti or CONFIG['GRAFICO_MAX_PUNTI'], CONFIG['GRAFICO_MAX_PUNTI']))
+        now = time.time()
+        risoluzione, serie = storico_finestra(storico, SYSTEM_STATE['ROLLUP'], now - finestra, now + 1, punti)
+        righe = zip(serie['t'], serie['grid'], serie['solar'], serie['wb'])
+        history_reset = True
+    else:
+        punti = CONFIG['GRAFICO_PUNTI']
+        history_reset = seq is None or not storico.intervallo()[0] <= seq <= seq_attuale
+        da = None if history_reset else seq
+        righe = zip(*(storico.valori(nome, ultimi=punti, da_seq=da, a_seq=seq_attuale)
+                      for nome in ('t', 'grid', 'solar', 'wb')))
     history = []
-    for item in SYSTEM_STATE['ULTIME_LETTURE_FASI']:
+    for t, grid, solar, wb in righe:
         history.append({
-            'grid': item[0],
-            'solar': item[1],
-            'time': item[3],
-            'wb': item[4] if len(item) > 4 else 0 
+            'grid': round(grid, 1),
+            'solar': round(solar, 1),
+            'time': t,
+            'wb': round(wb, 1)
         })
-    
-    fasi = SYSTEM_STATE['MONITOR_FASI']
-    tot_grid = sum(fasi[0:3])
-    tot_solar = sum(fasi[3:6])
 
-    return jsonify({
+    
+    return {
         'config': {
             'prelevabile': CONFIG['POTENZA_PRELEVABILE'],
             'protezione': CONFIG['POTENZA_PROTEZIONE']
         },
         'status': {
             'server_time': time.time(),
-            'wb_on': SYSTEM_STATE['WALLBOX_STATUS'],
-            'wb_power': SYSTEM_STATE['WALLBOX_POWER'] if SYSTEM_STATE['WALLBOX_STATUS'] else 0,
-            'fase_mode': SYSTEM_STATE['IMPIANTO_FASE'],
-            'last_fasi': SYSTEM_STATE['ULTIMA_LETTURA_FASI'],
-            'last_solar': SYSTEM_STATE['ULTIMA_LETTURA_SOLARE'],
-            'fasi': fasi,
-            'grid_total': tot_grid,
-            'solar_total': tot_solar
+            'wb_on': stato.wallbox_on,
+            'wb_power': stato.potenza_wallbox,
+            'fase_mode': stato.impianto_fase,
+            'last_fasi': stato.ultima_lettura_fasi,
+            'last_solar': stato.ultima_lettura_solare,
+            'fasi': stato.fasi,
+            'grid_total': stato.rete,
+            'solar_total': stato.solare,
+            'surplus_previsto': stato.surplus_previsto,
+            'ingresso': copia_stats(SYSTEM_STATE['INGRESSO']),
+            'wallbox_rtt': copia_stats(SYSTEM_STATE['WALLBOX_RTT']),
+            'wallbox_coda': copia_stats(SYSTEM_STATE['WALLBOX_CODA']),
+            'notifiche': copia_stats(SYSTEM_STATE['NOTIFICHE']),
+            'archivio': copia_stats(SYSTEM_STATE['ARCHIVIO']),
+            'push': copia_stats(SYSTEM_STATE['PUSH']),
+            'cache_api': copia_stats(SYSTEM_STATE['CACHE_API']),
+            'wallbox_gruppo': copia_stats(SYSTEM_STATE['WALLBOX_GRUPPO']),
+            'uplink': copia_stats(SYSTEM_STATE['UPLINK']),
+            'push_port': CONFIG['PUSH_PORT'],
+            'log': copia_stats(SYSTEM_STATE['LOGS'].stats),
+            'avvio': copia_stats(SYSTEM_STATE['AVVIO'])
         },
+        'seq': seq_attuale,
         'history': history,
-        'logs': SYSTEM_STATE['LOGS']
-    })
+        'history_reset': history_reset,
+        'punti': punti,
+        'risoluzione': risoluzione,
+        'log_seq': log_seq_attuale,
+        'logs': logs,
+        'logs_reset': logs_reset
+    }
+
+@app.route('/metrics')
+def get_metrics():
+    """Metriche nel formato testuale di Prometheus"""
+    return app.response_class(metriche.testo(), content_type=CONTENT_TYPE)
+
+@app.route('/api/logs')
+def get_logs():
+    """Pagine di log più vecchi: ?prima_di=<seq>&limite=<n>&livello=DECISIONE,ERRORE"""
+    livelli = [l for l in request.args.get('livello', '').upper().split(',') if l in LIVELLI_LOG]
+    voci, altre = SYSTEM_STATE['LOGS'].pagina(request.args.get('prima_di', type=int),
+                                              max(1, min(request.args.get('limite', 100, type=int), 500)), livelli)
+    return jsonify({'logs': voci, 'altre': altre})
 
 @app.route('/api/settings', methods=['POST'])
 def update_settings():
@@ -526,24 +636,36 @@ def force_init_wallbox():
     global wallbox_instance
     if wallbox_instance:
         log_msg("[WEB] Richiesta manuale di re-inizializzazione Wallbox!")
-        wallbox_instance.initialize()
+        future = wallbox_instance.dispatcher.esegui(wallbox_instance.initialize)
+        future.add_done_callback(log_esito("[WEB] Re-inizializzazione Wallbox"))
         return jsonify({'success': True})
     return jsonify({'success': False, 'error': 'Controller non disponibile'})
 
 def run_flask():
-    app.run(host='0.0.0.0', port=CONFIG['PORT'], debug=False, use_reloader=False)
+    asset_statici.carica()
+    server = ServerWeb(app, '0.0.0.0', CONFIG['PORT'], CONFIG['SERVER_WEB'], CONFIG['WEB_THREADS'],
+                       CONFIG['WEB_CONNESSIONI'], log=log_msg)
+    profilo.segna('web')
+    log_msg(f"[SISTEMA] Server web {server.modo}" + (f" ({server.threads} thread)" if server.threads else ""))
+    server.servi()
 
 # -----------------------------------------------------------
 # GESTORE WALLBOX E CLASSI SOTTOSTANTI
 # -----------------------------------------------------------
 class WallboxController:
-    def __init__(self):
+    def __init__(self, nome='wallbox', url=WALLBOX_URL, minima=None, massima=None, principale=True):
+        self.nome = nome
+        self.url = url
+        self.minima = minima    # None = dalla CONFIG in base alla fase
+        self.massima = massima
+        self.gruppo = None      # GruppoWallbox di cui fa parte, se ce ne sono più di una
         self.current_set_power = 0
         self.is_on = False
         self.last_update_time = 0
         self.fase = 0
         self.time_turned_off = 0  
         self.pending_off_until = 0
+        self.timer_spegnimento = 0  # volte in cui run_logic è passata al minimo in attesa di spegnere
         self.smoothing_alpha = CONFIG.get('SMOOTHING_ALPHA', 0.25)
         self.max_delta_per_sec = CONFIG.get('MAX_DELTA_PER_SEC', 1500)
         self.last_power_cmd_time = time.time()
@@ -554,26 +676,52 @@ class WallboxController:
         # tracking for sustained max power notifications
         self.max_reached_start = None   # timestamp when we first hit max
         self.max_notified = False      # whether notification was already sent
+        # connessione keep-alive condivisa da tutti i comandi verso la wallbox
+        # serie sue nell'istogramma: ogni coda comandi scrive solo le proprie
+        self.client = WallboxClient(url, istogramma=METRICA_WALLBOX.per(wallbox=nome))
+        # coda comandi: chi chiama riceve un Future, lo stato cambia solo a comando confermato.
+        # Ogni wallbox ha la sua coda, così i comandi a wallbox diverse partono insieme
+        self.dispatcher = WallboxDispatcher(self.send_command, nome)
+        if principale:
+            SYSTEM_STATE['WALLBOX_RTT'] = self.client.tempi
+            SYSTEM_STATE['WALLBOX_CODA'] = self.dispatcher.stats
+        self._ultimo_onoff = (None, None)   # ('i'|'o', future) dell'ultima accensione/spegnimento accodata
+        # impostato quando la sequenza di initialize() è stata eseguita: prima run_logic non decide
+        self.pronto = threading.Event()
+
+    def potenza_minima(self):
+        if self.minima is not None:
+            return self.minima
+        return CONFIG['MONOFASE_MIN_POWER'] if self.fase == 0 else CONFIG['TRIFASE_MIN_POWER']
+
+    def potenza_massima(self):
+        if self.massima is not None:
+            return self.massima
+        return CONFIG['MONOFASE_MAX_POWER'] if self.fase == 0 else CONFIG['TRIFASE_MAX_POWER']
 
     def update_shared_state(self):
-        SYSTEM_STATE['WALLBOX_POWER'] = int(round(self.display_power))
-        SYSTEM_STATE['WALLBOX_STATUS'] = self.is_on
-        SYSTEM_STATE['IMPIANTO_FASE'] = self.fase
+        if self.gruppo is not None:
+            self.gruppo.update_shared_state()
+            return
+        STATO.pubblica(wallbox_potenza=int(round(self.display_power)), wallbox_on=self.is_on, impianto_fase=self.fase)
 
     def send_command(self, params):
-        try:
-            response = requests.get(WALLBOX_URL, params=params, timeout=3)
-            return response.status_code == 200
-        except Exception:
-            return False
+        return self.client.comando(params)
+
+    def _onoff_in_corso(self, btn):
+        tipo, future = self._ultimo_onoff
+        if tipo == btn and not future.done():
+            return future
+        return None
+
+    def _onoff(self, btn, on_success, pausa=0.0):
+        future = self.dispatcher.invia({'btn': btn}, on_success, pausa)
+        self._ultimo_onoff = (btn, future)
+        return future
 
     def set_power(self, watts, bypass):
-        if self.fase == 0:
-            min_p = CONFIG['MONOFASE_MIN_POWER']
-            max_p = CONFIG['MONOFASE_MAX_POWER']
-        else:
-            min_p = CONFIG['TRIFASE_MIN_POWER']
-            max_p = CONFIG['TRIFASE_MAX_POWER']
+        min_p = self.potenza_minima()
+        max_p = self.potenza_massima()
         requested = int(max(min_p, min(max_p, int(watts))))
 
         now = time.time()
@@ -610,7 +758,7 @@ class WallboxController:
                 send_value = requested
                 smoothed = float(send_value)
 
-        if self.send_command({'btn': f'P{send_value}'}):
+        def confermato():
             self.current_set_power = send_value
             self.last_update_time = now
             self.last_power_cmd_time = now
@@ -618,17 +766,19 @@ class WallboxController:
             self.update_shared_state()
             try:
                 now_t = time.time()
-                fasi = SYSTEM_STATE.get('MONITOR_FASI', [0,0,0,0,0,0])
-                grid_total = sum(fasi[0:3])
-                solar_total = sum(fasi[3:6])
-                SYSTEM_STATE['ULTIME_LETTURE_FASI'].append((grid_total, solar_total, fasi.copy(), now_t, int(round(self.display_power))))
-                if len(SYSTEM_STATE['ULTIME_LETTURE_FASI']) > 30:
-                    SYSTEM_STATE['ULTIME_LETTURE_FASI'].pop(0)
+                stato = STATO.attuale
+                registra_lettura(now_t, stato.fasi, stato.rete, stato.solare, int(round(self.display_power)))
             except Exception:
                 pass
-        
+            registra_comando('P', send_value)
+
+        return self.dispatcher.invia({'btn': f'P{send_value}'}, confermato)
+
     def turn_on(self):
-        if not self.is_on:
+        in_corso = self._onoff_in_corso('i')
+        if in_corso:
+            return in_corso
+        if not self.is_on or self._onoff_in_corso('o'):
             if self.time_turned_off > 0:
                 tempo_trascorso = time.time() - self.time_turned_off
                 if tempo_trascorso < CONFIG['COOLDOWN_ACCENSIONE']:
@@ -636,26 +786,34 @@ class WallboxController:
                     return
             
             log_msg("[AZIONE] ACCENSIONE (ON)")
-            self.set_power(CONFIG['MONOFASE_MIN_POWER'] if self.fase == 0 else CONFIG['TRIFASE_MIN_POWER'], bypass=True) 
+            self.set_power(self.potenza_minima(), bypass=True)
 
-            if self.send_command({'btn': 'i'}):
+            def confermato():
                 self.is_on = True
                 self.last_update_time = time.time()
                 self.update_shared_state()
+                registra_comando('i', self.current_set_power)
+
+            return self._onoff('i', confermato)
             
     def turn_off(self, force=False):
         now = time.time()
         if force and self.last_update_time != 0 and (now - self.last_update_time < CONFIG['UPDATE_INTERVAL_S']):
             return
 
-        if self.is_on or force:
+        in_corso = self._onoff_in_corso('o')
+        if in_corso:
+            return in_corso
+        if self.is_on or force or self._onoff_in_corso('i'):
             log_msg("[AZIONE] SPEGNIMENTO (OFF)")
-            if self.send_command({'btn': 'o'}):
+
+            def confermato():
                 self.is_on = False
                 self.time_turned_off = time.time() 
                 self.last_update_time = time.time()
-                time.sleep(0.5)
-                min_p = CONFIG['MONOFASE_MIN_POWER'] if self.fase == 0 else CONFIG['TRIFASE_MIN_POWER']
+                registra_comando('o', 0)
+                # la potenza minima parte dopo la pausa di 0.5s, sempre dalla coda
+                min_p = self.potenza_minima()
                 try:
                     self.set_power(min_p, bypass=True)
                 except Exception:
@@ -663,11 +821,18 @@ class WallboxController:
                     self.display_power = float(self.current_set_power)
                     self.update_shared_state()
 
+            return self._onoff('o', confermato, pausa=0.5)
+
+    def shutdown(self, timeout=5):
+        """Spegne la wallbox e aspetta che la coda comandi sia stata inviata"""
+        self.turn_off(force=True)
+        return self.dispatcher.attendi(timeout)
+
     def initialize(self):
         log_msg("=== INIZIALIZZAZIONE SISTEMA ===")
         try:
-            log_msg(f"Richiesta dati a {WALLBOX_URL}...")
-            response = requests.get(WALLBOX_URL, timeout=5)
+            log_msg(f"Richiesta dati a {self.url}...")
+            response = self.client.get(timeout=5)
 
             if response.status_code == 200:
                 dati = response.json()
@@ -694,16 +859,101 @@ class WallboxController:
         self.last_update_time = 0 
         self.turn_off(force=True)
         
-        if self.fase == 0:
-            log_msg("1. Imposto potenza minima (1380W)...")
-            self.set_power(CONFIG['MONOFASE_MIN_POWER'], bypass=True)
-        elif self.fase == 1:
-            log_msg("1. Imposto potenza minima (4140)...")
-            self.set_power(CONFIG['TRIFASE_MIN_POWER'], bypass=True)
-
-        time.sleep(1)
+        log_msg(f"1. Imposto potenza minima ({self.potenza_minima()}W)...")
+        self.set_power(self.potenza_minima(), bypass=True)
+
+        # pausa di assestamento in coda, prima dei comandi di run_logic
+        self.dispatcher.esegui(time.sleep, 1)
+        self.dispatcher.esegui(self._pronto)
+
+    def _pronto(self):
+        self.pronto.set()
+        profilo.segna('wallbox')
         log_msg("=== PRONTO. IN ATTESA PACCHETTI ===")
 
+def _insieme(futures):
+    """Future che si completa quando tutti i futures sono completati (esito: tutti True)"""
+    futures = [f for f in futures if f is not None]
+    tutti = Future()
+    if not futures:
+        tutti.set_result(True)
+        return tutti
+    restanti = [len(futures)]
+    lock = threading.Lock()
+
+    def fatto(_):
+        with lock:
+            restanti[0] -= 1
+            if restanti[0]:
+                return
+        tutti.set_result(all(not f.cancelled() and f.exception() is None and f.result() is not False for f in futures))
+
+    for f in futures:
+        f.add_done_callback(fatto)
+    return tutti
+
+class _TuttePronte:
+    def __init__(self, wallbox):
+        self.wallbox = wallbox
+
+    def is_set(self):
+        return all(w.pronto.is_set() for w in self.wallbox)
+
+class GruppoWallbox:
+    """Più wallbox controllate insieme: run_logic_gruppo divide il surplus con
+    allocazione.ripartisci() e ogni wallbox riceve i comandi sulla sua coda.
+    Telegram, Web e main() la usano come una WallboxController: accensione,
+    spegnimento e inizializzazione valgono per tutte."""
+    def __init__(self, wallbox, priorita=None, garantite=None):
+        self.wallbox = list(wallbox)
+        self.priorita = priorita or [0] * len(self.wallbox)
+        self.garantite = garantite or [0] * len(self.wallbox)
+        self.assegnate = [0] * len(self.wallbox)
+        self.dispatcher = self.wallbox[0].dispatcher  # initialize() parte dalla coda della prima
+        self.pronto = _TuttePronte(self.wallbox)
+        for w in self.wallbox:
+            w.gruppo = self
+
+    @property
+    def manual_off(self):
+        return all(w.manual_off for w in self.wallbox)
+
+    @manual_off.setter
+    def manual_off(self, valore):
+        for w in self.wallbox:
+            w.manual_off = valore
+
+    def update_shared_state(self):
+        accese = [w for w in self.wallbox if w.is_on]
+        STATO.pubblica(wallbox_potenza=int(round(sum(w.display_power for w in accese))), wallbox_on=bool(accese),
+                       impianto_fase=self.wallbox[0].fase)
+        SYSTEM_STATE['WALLBOX_GRUPPO'] = {
+            w.nome: {'on': w.is_on, 'potenza': int(round(w.display_power)), 'assegnata': a, 'fase': w.fase}
+            for w, a in zip(self.wallbox, self.assegnate)
+        }
+
+    def richieste(self):
+        return [Richiesta(w.nome, w.potenza_minima(), w.potenza_massima(), p, g, w.is_on)
+                for w, p, g in zip(self.wallbox, self.priorita, self.garantite)]
+
+    def turn_on(self):
+        return _insieme(w.turn_on() for w in self.wallbox)
+
+    def turn_off(self, force=False):
+        return _insieme(w.turn_off(force) for w in self.wallbox)
+
+    def shutdown(self, timeout=5):
+        fine = time.monotonic() + timeout
+        for w in self.wallbox:
+            w.turn_off(force=True)
+        return all(w.dispatcher.attendi(max(0.0, fine - time.monotonic())) for w in self.wallbox)
+
+    def initialize(self):
+        # la prima sulla coda corrente, le altre sulle loro code in parallelo
+        for w in self.wallbox[1:]:
+            w.dispatcher.esegui(w.initialize)
+        self.wallbox[0].initialize()
+
 class EnergyMonitor:
     def __init__(self):
         self.solar_now = 0.0        
@@ -712,62 +962,78 @@ class EnergyMonitor:
         self.fases = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
         self.ctrletturefasi = 0
         self.time = None
+        self.decoder = PacketDecoder()
+        self.previsione = PrevisioneSurplus(CONFIG['PREVISIONE_ORIZZONTE_S'], CONFIG['PREVISIONE_PERSISTENZA_S'],
+                                            CONFIG['PREVISIONE_PERSISTENZA_CASA_S'])
+
+    def aggiorna_previsione(self):
+        """Dopo i pacchetti di un tick: un passo O(1) della previsione, pubblicato per la dashboard"""
+        self.previsione.aggiorna(time.time(), self.solar_now, self.house_load)
+        STATO.pubblica(surplus_previsto=(round(self.previsione.solare_previsto()), round(self.previsione.casa_prevista())))
 
     def parse_packet(self, data):
-        try:
-            xml_str = data.decode('utf-8', errors='ignore')
-            root = ET.fromstring(xml_str)
+        pacchetto = self.decoder.decode(data)
+        if pacchetto is None:
+            return None
+        tipo, valori = pacchetto
+
+        if tipo == ELECTRICITY:
+            l1, l2, l3, l4, l5, l6 = valori
+
+            self.total_grid_load = l1 + l2 + l3
+            self.solar_now = l4 + l5 + l6 
+            self.fases = [l1, l2, l3, l4, l5, l6]
             
-            if root.tag == 'electricity': 
-                channels = root.find('channels')
-                if channels:
-                    p = {}
-                    for c in channels.findall('chan'):
-                        try:
-                            val = float(c.find('curr').text)
-                        except:
-                            val = 0.0
-                        p[c.get('id')] = val
-                    
-                    l1, l2, l3 = p.get('0',0), p.get('1',0), p.get('2',0)
-                    l4, l5, l6 = p.get('3',0), p.get('4',0), p.get('5',0)
-                    
-                    self.total_grid_load = l1 + l2 + l3
-                    self.solar_now = l4 + l5 + l6 
-                    self.fases = [l1, l2, l3, l4, l5, l6]
-                    
-                    self.ctrletturefasi += 1
-                    SYSTEM_STATE['ULTIMA_LETTURA_FASI'] = time.time()
-                    SYSTEM_STATE['MONITOR_FASI'] = self.fases
-                    self.time = SYSTEM_STATE['ULTIMA_LETTURA_FASI']
-                    
-                    wb_status = SYSTEM_STATE.get('WALLBOX_STATUS', False)
-                    wb_power = SYSTEM_STATE.get('WALLBOX_POWER', 0) if wb_status else 0
-                    self.house_load = self.total_grid_load - wb_power
-                    
-                    SYSTEM_STATE['ULTIME_LETTURE_FASI'].append((self.total_grid_load, self.solar_now, self.fases, self.time, wb_power))
-                    if len(SYSTEM_STATE['ULTIME_LETTURE_FASI']) > 30:
-                        SYSTEM_STATE['ULTIME_LETTURE_FASI'].pop(0)    
+            self.ctrletturefasi += 1
+            self.time = time.time()
+            stato = STATO.pubblica(fasi=tuple(self.fases), ultima_lettura_fasi=self.time)
             
-                    return "TRIGGER"
-
-            elif root.tag == 'solar': 
-                curr = root.find('current')
-                if curr is not None:
-                    gen = float(curr.find('generating').text)
-                    self.solar_now = gen
-                    SYSTEM_STATE['ULTIMA_LETTURA_SOLARE'] = time.time()
-                    self.time = SYSTEM_STATE['ULTIMA_LETTURA_SOLARE']
-                    
-                    SYSTEM_STATE['ULTIME_LETTURE_SOLARE'].append((gen, self.time))
-                    if len(SYSTEM_STATE['ULTIME_LETTURE_SOLARE']) > 30:
-                        SYSTEM_STATE['ULTIME_LETTURE_SOLARE'].pop(0)
-                    return "TRIGGER"
-                
-        except Exception:
-            pass
+            wb_power = stato.potenza_wallbox
+            self.house_load = self.total_grid_load - wb_power
+            
+            registra_lettura(self.time, self.fases, self.total_grid_load, self.solar_now, wb_power)
+    
+            return "TRIGGER"
+
+        elif tipo == SOLAR: 
+            gen = valori
+            self.solar_now = gen
+            self.time = time.time()
+            STATO.pubblica(ultima_lettura_solare=self.time)
+            push.segnala()
+            return "TRIGGER"
+
         return None
 
+def controlla_potenza_massima(wallbox, potenza_carica, potenza_massima, prefisso=""):
+    """Notifica la potenza massima solo se mantenuta per almeno 60s.
+    prefisso: nome della wallbox nei messaggi quando sono più di una"""
+    if not wallbox.is_on:
+        return
+    now = time.time()
+    # verifica se siamo al massimo o sopra
+    if potenza_carica >= potenza_massima:
+        if wallbox.max_reached_start is None:
+            wallbox.max_reached_start = now
+        elif not wallbox.max_notified and now - wallbox.max_reached_start >= 60:
+            if wallbox.fase == 1:
+                notifica(f"⚠️ {prefisso}Potenza massima raggiunta ({potenza_massima:.0f}W).")
+            else:
+                notifica(f"⚠️ {prefisso}Potenza massima raggiunta ({potenza_massima:.0f}W). Consiglio: mettere l'impianto in modalità trifase per sfruttare meglio la potenza disponibile.")
+            wallbox.max_notified = True
+    else:
+        # siamo scesi sotto, resettiamo contatori
+        wallbox.max_reached_start = None
+        wallbox.max_notified = False
+
+def notifica_spegnimento(wallbox, potenza_generata, potenza_casa, prefisso=""):
+    """Avviso Telegram quando il sole non basta e la wallbox viene spenta"""
+    notifica(f"⚠️ {prefisso}Potenza insufficiente ({potenza_generata:.0f}W) consumo casa ({potenza_casa:.0f}W). Spengo wallbox.")
+    if wallbox.fase == 1:
+        notifica(f"⚠️ {prefisso}Consiglio: mettere l'impianto in modalità monofase per sfruttare meglio la potenza disponibile.")
+    else:
+        notifica(f"⚠️ {prefisso}Consiglio: staccare la macchina")
+
 def run_logic(monitor, wallbox):
     # if user has manually requested the wallbox to remain off, skip all automatic decisions
     if getattr(wallbox, 'manual_off', False):
@@ -785,31 +1051,10 @@ def run_logic(monitor, wallbox):
     #log_msg(f"\n[INFO] Potenza Generata (+ prelevabile: {POTENZA_PRELEVABILE}W): {potenza_generata:.0f}W | Potenza Consumata: {monitor.total_grid_load:.0f}W | Consumata Live: {potenza_live:.0f}W | Potenza Esportata: {potenza_esportata:.0f}W | Wallbox: {'ON' if wallbox.is_on else 'OFF'} ({wallbox.current_set_power:.0f}W)")
     log_msg(f"\n[INFO] Gen: {potenza_generata:.0f}W  | Casa: {potenza_casa:.0f}W | Esp: {potenza_esportata:.0f}W | WB: {'ON' if wallbox.is_on else 'OFF'} ({potenza_carica:.0f}W)")
 
-    potenza_minima = CONFIG['MONOFASE_MIN_POWER'] if wallbox.fase == 0 else CONFIG['TRIFASE_MIN_POWER']
-    potenza_massima = CONFIG['MONOFASE_MAX_POWER'] if wallbox.fase == 0 else CONFIG['TRIFASE_MAX_POWER']
+    potenza_minima = wallbox.potenza_minima()
+    potenza_massima = wallbox.potenza_massima()
 
-    # ------------------------------------------------------------------
-    # notifica potenza massima solo se mantenuta per almeno 60s
-    now = time.time()
-    if wallbox.is_on:
-        # verifica se siamo al massimo o sopra
-        if potenza_carica >= potenza_massima:
-            if wallbox.max_reached_start is None:
-                wallbox.max_reached_start = now
-            elif not wallbox.max_notified and now - wallbox.max_reached_start >= 60:
-                try:
-                    if wallbox.fase == 1:
-                        asyncio.run(invia_notifica(f"⚠️ Potenza massima raggiunta ({potenza_massima:.0f}W)."))
-                    else:
-                        asyncio.run(invia_notifica(f"⚠️ Potenza massima raggiunta ({potenza_massima:.0f}W). Consiglio: mettere l'impianto in modalità trifase per sfruttare meglio la potenza disponibile."))
-                except Exception:
-                    pass
-                wallbox.max_notified = True
-        else:
-            # siamo scesi sotto, resettiamo contatori
-            wallbox.max_reached_start = None
-            wallbox.max_notified = False
-    # ------------------------------------------------------------------
+    controlla_potenza_massima(wallbox, potenza_carica, potenza_massima)
 
     if potenza_consumata == 0:
         return
@@ -829,15 +1074,9 @@ def run_logic(monitor, wallbox):
                 return
             else:
                 wallbox.pending_off_until = 0
-                if potenza_generata < potenza_minima or potenza_esportata < -200:#spengo se continuo ad importare piu di 200w
+                if potenza_generata < potenza_minima or potenza_esportata < -CONFIG['IMPORT_SPEGNIMENTO_W']:#spengo se continuo ad importare
                     log_msg(f"[DECISIONE] Sole insufficiente. Spengo.")
-                    try: 
-                        asyncio.run(invia_notifica(f"⚠️ Potenza insufficiente ({potenza_generata:.0f}W) consumo casa ({potenza_casa:.0f}W). Spengo wallbox."))
-                        if wallbox.fase == 1:
-                            asyncio.run(invia_notifica(f"⚠️ Consiglio: mettere l'impianto in modalità monofase per sfruttare meglio la potenza disponibile."))
-                        else:
-                            asyncio.run(invia_notifica(f"⚠️ Consiglio: staccare la macchina"))
-                    except Exception: pass
+                    notifica_spegnimento(wallbox, potenza_generata, potenza_casa)
                     wallbox.turn_off(force=True)
                     return
                 else:
@@ -846,7 +1085,7 @@ def run_logic(monitor, wallbox):
                     return
 
         if potenza_consumata > potenza_generata:
-            nuova_potenza = potenza_generata - potenza_casa - 200#200W evito on/off
+            nuova_potenza = potenza_generata - potenza_casa - CONFIG['MARGINE_RIDUZIONE_W']#evito on/off
             log_msg(f"[DECISIONE]2 Diminuisco a {nuova_potenza:.0f}W")
             wallbox.set_power(nuova_potenza, bypass=False)
         if potenza_carica > (potenza_generata - potenza_casa) or potenza_esportata < 0:
@@ -855,12 +1094,13 @@ def run_logic(monitor, wallbox):
                 log_msg(f"[DECISIONE] Sole insufficiente. Minimo per {CONFIG['TIMER_SPEGNIMENTO']}s.")
                 wallbox.set_power(potenza_minima, bypass=True)
                 wallbox.pending_off_until = now + CONFIG['TIMER_SPEGNIMENTO']
+                wallbox.timer_spegnimento += 1
             else:
                 log_msg(f"[DECISIONE] Diminuisco a {nuova_potenza:.0f}W")
                 wallbox.set_power(nuova_potenza, bypass=False)
 
         else: 
-            nuova_potenza = potenza_carica + abs(potenza_generata-potenza_consumata)- 100
+            nuova_potenza = potenza_carica + abs(potenza_generata-potenza_consumata) - CONFIG['MARGINE_AUMENTO_W']
             if nuova_potenza > potenza_generata:
                 return
             delta_potenza = nuova_potenza - potenza_carica
@@ -877,68 +1117,299 @@ def run_logic(monitor, wallbox):
             log_msg(f"[DECISIONE] Aumento a {nuova_potenza:.0f}W")
             wallbox.set_power(nuova_potenza, bypass=False)
 
-async def invia_notifica(messaggio):
-    """Invia notifiche unilaterali (usato dal thread principale)"""
-    if not API_KEY or not CHAT_ID: return
+def run_logic_gruppo(monitor, gruppo):
+    """run_logic per più wallbox: il surplus viene diviso con la politica
+    RIPARTIZIONE e ogni wallbox va verso la sua quota. I comandi finiscono
+    nelle code delle singole wallbox, quindi la decisione non aspetta l'HTTP
+    e le wallbox ricevono i comandi in parallelo."""
+    if gruppo.manual_off:
+        log_msg("[INFO] Override manuale attivo, wallbox rimangono spente fino a comando /accendi")
+        return
+    if monitor.total_grid_load == 0:
+        return
+    potenza_generata = monitor.solar_now + CONFIG['POTENZA_PRELEVABILE']
+    # house_load è già al netto di tutte le wallbox (STATO.potenza_wallbox è la somma)
+    potenza_casa = monitor.house_load
+    disponibile = potenza_generata - potenza_casa - CONFIG['MARGINE_RIDUZIONE_W']  # evito on/off, come run_logic
+    assegnate = ripartisci(disponibile, gruppo.richieste(), CONFIG['RIPARTIZIONE'])
+    gruppo.assegnate = assegnate
+    log_msg(f"[INFO] Gen: {potenza_generata:.0f}W  | Casa: {potenza_casa:.0f}W | Disponibile: {disponibile:.0f}W | "
+            + " ".join(f"{w.nome}: {'ON' if w.is_on else 'OFF'} ({w.display_power if w.is_on else 0:.0f}W)" for w in gruppo.wallbox))
+
+    now = time.time()
+    for wallbox, quota in zip(gruppo.wallbox, assegnate):
+        if getattr(wallbox, 'manual_off', False):
+            continue
+        controlla_potenza_massima(wallbox, wallbox.display_power, wallbox.potenza_massima(), f"{wallbox.nome}: ")
+        if quota > 0:
+            wallbox.pending_off_until = 0
+            if not wallbox.is_on:
+                log_msg(f"[DECISIONE] {wallbox.nome}: quota {quota}W. Accendo a {wallbox.potenza_minima()}W.")
+                wallbox.turn_on()
+            elif abs(quota - wallbox.current_set_power) >= CONFIG['POTENZA_PROTEZIONE']:
+                log_msg(f"[DECISIONE] {wallbox.nome}: porto a {quota}W")
+                wallbox.set_power(quota, bypass=False)
+        elif wallbox.is_on:
+            # stessa attesa di run_logic: minimo per TIMER_SPEGNIMENTO, poi spengo se la quota è ancora 0
+            if wallbox.pending_off_until == 0:
+                log_msg(f"[DECISIONE] {wallbox.nome}: nessuna quota. Minimo per {CONFIG['TIMER_SPEGNIMENTO']}s.")
+                wallbox.set_power(wallbox.potenza_minima(), bypass=True)
+                wallbox.pending_off_until = now + CONFIG['TIMER_SPEGNIMENTO']
+                wallbox.timer_spegnimento += 1
+            elif now >= wallbox.pending_off_until:
+                wallbox.pending_off_until = 0
+                log_msg(f"[DECISIONE] {wallbox.nome}: sole insufficiente. Spengo.")
+                notifica_spegnimento(wallbox, potenza_generata, potenza_casa, f"{wallbox.nome}: ")
+                wallbox.turn_off(force=True)
+    gruppo.update_shared_state()
+
+# -----------------------------------------------------------
+# INGESTIONE ASYNCIO
+# -----------------------------------------------------------
+class MulticastProtocol(asyncio.DatagramProtocol):
+    """Riceve i pacchetti del contatore sul loop asyncio"""
+    def __init__(self, controllo):
+        self.controllo = controllo
+
+    def datagram_received(self, data, addr):
+        if registratore is not None:
+            registratore.registra(data)
+        self.controllo.on_packet(data)
+
+    def error_received(self, exc):
+        log_msg(f"[ERRORE] Socket multicast: {exc}")
+
+def elabora_pacchetti(monitor, wallbox, coalescer, pacchetti, t_pacchetto=None):
+    """Decodifica i pacchetti coalescati e valuta run_logic una sola volta.
+    t_pacchetto: time.monotonic() di arrivo del primo pacchetto, per la latenza"""
+    trigger = False
+    for data in pacchetti:
+        inizio = time.perf_counter()
+        esito = monitor.parse_packet(data)
+        METRICA_PARSE.osserva(time.perf_counter() - inizio)
+        if esito == "TRIGGER":
+            trigger = True
+        else:
+            coalescer.scartato(data)
+    if trigger and CONFIG['PREVISIONE']:
+        monitor.aggiorna_previsione()
+    if trigger and profilo.segna('primo pacchetto'):
+        log_msg("[INFO] Primo pacchetto elaborato")
+    # Finché la wallbox non è inizializzata le letture aggiornano storico e dashboard ma non si decide
+    if not (trigger and wallbox.pronto.is_set()):
+        return False
+    if isinstance(wallbox, GruppoWallbox):
+        run_logic_gruppo(monitor, wallbox)
+    else:
+        run_logic(monitor, wallbox)
+    if t_pacchetto is not None:
+        METRICA_DECISIONE.osserva(time.monotonic() - t_pacchetto)
+    if profilo.segna('prima decisione'):
+        log_msg(f"[INFO] Avvio: {profilo.riepilogo()}")
+    return True
+
+class ControlloAsync:
+    """Separa la ricezione dei pacchetti dalle decisioni.
+
+    I pacchetti arrivano sul loop asyncio e restano nel coalescer (solo l'ultimo
+    per tipo). Ogni TICK_CONTROLLO_S il contenuto viene decodificato e passato a
+    run_logic su un unico thread worker, dove avviene anche l'I/O verso la
+    wallbox. Se la decisione precedente è ancora in corso il tick viene saltato
+    e i pacchetti continuano a coalescare: niente arretrati dopo uno stallo.
+    """
+    def __init__(self, monitor, wallbox):
+        self.monitor = monitor
+        self.wallbox = wallbox
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='controllo')
+        self.coalescer = PacketCoalescer()
+        SYSTEM_STATE['INGRESSO'] = self.coalescer.stats
+        SYSTEM_STATE['INGRESSO_TAG'] = self.coalescer.per_tag
+        self._in_corso = None
+        self.decisioni = 0
+        self.latenza_ultima = 0.0  # secondi tra arrivo pacchetto e avvio della decisione
+        self.latenza_max = 0.0
+
+    def on_packet(self, data):
+        self.coalescer.offri(data)
+
+    def _decidi(self, pacchetti, t_pacchetto):
+        latenza = time.monotonic() - t_pacchetto
+        self.latenza_ultima = latenza
+        self.latenza_max = max(self.latenza_max, latenza)
+        if elabora_pacchetti(self.monitor, self.wallbox, self.coalescer, pacchetti, t_pacchetto):
+            self.decisioni += 1
+
+    def _esito(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            log_msg(f"[ERRORE] {future.exception()}")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        prossimo = loop.time()
+        while True:
+            prossimo += CONFIG['TICK_CONTROLLO_S']
+            if prossimo < loop.time():
+                prossimo = loop.time()
+            await asyncio.sleep(prossimo - loop.time())
+
+            if self._in_corso is not None and not self._in_corso.done():
+                continue
+            pacchetti, t_pacchetto = self.coalescer.preleva()
+            if pacchetti:
+                self._in_corso = loop.run_in_executor(self.executor, self._decidi, pacchetti, t_pacchetto)
+                self._in_corso.add_done_callback(self._esito)
+
+async def ingestione_async(monitor, wallbox, sock):
+    loop = asyncio.get_running_loop()
+    controllo = ControlloAsync(monitor, wallbox)
+    transport, _ = await loop.create_datagram_endpoint(lambda: MulticastProtocol(controllo), sock=sock)
     try:
-        bot = Bot(token=API_KEY)
-        await bot.send_message(chat_id=CHAT_ID, text=messaggio)
-    except Exception as e:
-        log_msg(f"[ERRORE TELEGRAM] {e}")
+        await controllo.run()
+    finally:
+        transport.close()
+        controllo.executor.shutdown(wait=True)
+
+def ciclo_ricezione(sock, monitor, wallbox):
+    """Ciclo su thread: svuota il socket a ogni risveglio e decide a tick fissi"""
+    coalescer = PacketCoalescer()
+    SYSTEM_STATE['INGRESSO'] = coalescer.stats
+    SYSTEM_STATE['INGRESSO_TAG'] = coalescer.per_tag
+    buf = bytearray(65535)
+    view = memoryview(buf)
+    sock.setblocking(False)
+    prossimo = time.monotonic()
+
+    while True:
+        try:
+            attesa = prossimo - time.monotonic()
+            if attesa > 0:
+                select.select([sock], [], [], attesa)
+            while True:
+                try:
+                    n = sock.recv_into(buf)
+                except BlockingIOError:
+                    break
+                data = bytes(view[:n])
+                if registratore is not None:
+                    registratore.registra(data)
+                coalescer.offri(data)
+
+            now = time.monotonic()
+            if now < prossimo:
+                continue
+            prossimo = max(prossimo + CONFIG['TICK_CONTROLLO_S'], now)
+
+            pacchetti, t_pacchetto = coalescer.preleva()
+            if pacchetti:
+                elabora_pacchetti(monitor, wallbox, coalescer, pacchetti, t_pacchetto)
+
+        except Exception as e:
+            log_msg(f"[ERRORE] {e}")
+            time.sleep(0.5)
+
+def apri_socket_multicast():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    try:
+        sock.bind(('0.0.0.0', CONFIG['MCAST_PORT'])) 
+        mreq = struct.pack("4s4s", socket.inet_aton(CONFIG['MCAST_GRP']), socket.inet_aton(CONFIG['IFACE']))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        log_msg(f"In ascolto su {CONFIG['IFACE']}:{CONFIG['MCAST_PORT']}...")
+    except OSError as e:
+        logging.critical(f"Errore Rete (Bind): {e}")
+        sock.close()
+        return None
+    return sock
 
 # -----------------------------------------------------------
 # MAIN
 # -----------------------------------------------------------
+def crea_wallbox():
+    """La wallbox di WALLBOX_IP, oppure un GruppoWallbox se ci sono WALLBOX_AGGIUNTIVE"""
+    principale = WallboxController()
+    if not CONFIG['WALLBOX_AGGIUNTIVE']:
+        return principale
+    wallbox, priorita, garantite = [principale], [0], [0]
+    for i, extra in enumerate(CONFIG['WALLBOX_AGGIUNTIVE'], 2):
+        wallbox.append(WallboxController(extra.get('nome', f'wallbox{i}'), f"http://{extra['ip']}/index.json",
+                                         extra.get('min'), extra.get('max'), principale=False))
+        priorita.append(extra.get('priorita', 0))
+        garantite.append(extra.get('garantita', 0))
+    log_msg(f"[SISTEMA] {len(wallbox)} wallbox, ripartizione '{CONFIG['RIPARTIZIONE']}'")
+    return GruppoWallbox(wallbox, priorita, garantite)
+
 def main():
-    global wallbox_instance
+    global wallbox_instance, registratore, uplink
 
     monitor = EnergyMonitor()
-    wallbox_instance = WallboxController()
+    wallbox_instance = crea_wallbox()
     wallbox = wallbox_instance
 
-    # 1. AVVIO THREAD SERVER WEB
+    # Le fasi di avvio non si aspettano a vicenda: web, bot, ricarica archivio e
+    # sonda wallbox girano sui loro thread e il controllo parte appena il socket
+    # è aperto. I tempi di ogni fase finiscono nel log alla prima decisione.
+
+    # 1. INIZIALIZZAZIONE WALLBOX (sonda HTTP e comandi iniziali sulla coda comandi)
+    wallbox.dispatcher.esegui(wallbox.initialize)
+
+    # 2. AVVIO THREAD SERVER WEB
     flask_thread = threading.Thread(target=run_flask)
     flask_thread.daemon = True 
     flask_thread.start()
     log_msg(">>> INTERFACCIA WEB ATTIVA SU http://localhost:5000 <<<")
+    if CONFIG['PUSH_PORT']:
+        with profilo.fase('push'):
+            push.avvia('0.0.0.0', CONFIG['PUSH_PORT'], dati_dashboard, CONFIG['PORT'])
 
-    # 2. AVVIO THREAD BOT TELEGRAM
+    # 3. AVVIO THREAD BOT TELEGRAM
     tg_thread = threading.Thread(target=run_telegram_polling)
     tg_thread.daemon = True
     tg_thread.start()
 
-    try: 
-        asyncio.run(invia_notifica(f"✅ SISTEMA AVVIATO."))
-    except Exception: pass
-
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-    try:
-        sock.bind(('0.0.0.0', CONFIG['MCAST_PORT'])) 
-        mreq = struct.pack("4s4s", socket.inet_aton(CONFIG['MCAST_GRP']), socket.inet_aton(CONFIG['IFACE']))
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-        log_msg(f"In ascolto su {CONFIG['IFACE']}:{CONFIG['MCAST_PORT']}...")
-    except OSError as e:
-        logging.critical(f"Errore Rete (Bind): {e}")
+    notifier.avvia()
+    notifica(f"✅ SISTEMA AVVIATO.")
+    with profilo.fase('archivio'):
+        avvia_archivio()
+    if CONFIG['REGISTRA_PACCHETTI']:
+        registratore = PacketRecorder(CONFIG['REGISTRA_PACCHETTI'])
+        log_msg(f"[SISTEMA] Registrazione pacchetti su {CONFIG['REGISTRA_PACCHETTI']}")
+    if CONFIG['AGGREGATORE_URL']:
+        uplink = UplinkAggregatore(CONFIG['AGGREGATORE_URL'], CONFIG['SITO_NOME'], CONFIG['AGGREGATORE_BATCH_S'],
+                                   stato=stato_uplink, log=log_msg, token=CONFIG['AGGREGATORE_TOKEN'])
+        SYSTEM_STATE['UPLINK'] = uplink.stats
+        log_msg(f"[SISTEMA] Telemetria verso {CONFIG['AGGREGATORE_URL']} come '{CONFIG['SITO_NOME']}'")
+
+    with profilo.fase('socket'):
+        sock = apri_socket_multicast()
+    if sock is None:
         return
 
-    wallbox.initialize()
-    
-    while True:
+    if CONFIG['INGESTIONE_ASYNC']:
         try:
-            data, _ = sock.recvfrom(65535)
-            evt = monitor.parse_packet(data)
-
-            if evt == "TRIGGER":
-                run_logic(monitor, wallbox)
-
+            asyncio.run(ingestione_async(monitor, wallbox, sock))
         except KeyboardInterrupt:
-            wallbox.turn_off(force=True)
-            break
-        except Exception as e:
-            log_msg(f"[ERRORE] {e}")
-            time.sleep(0.5)
+            wallbox.shutdown()
+            notifier.attendi(5)
+            if archivio is not None:
+                archivio.chiudi()
+            if registratore is not None:
+                registratore.chiudi()
+            if uplink is not None:
+                uplink.chiudi()
+        return
+
+    try:
+        ciclo_ricezione(sock, monitor, wallbox)
+    except KeyboardInterrupt:
+        wallbox.shutdown()
+        notifier.attendi(5)
+        if archivio is not None:
+            archivio.chiudi()
+        if registratore is not None:
+            registratore.chiudi()
+        if uplink is not None:
+            uplink.chiudi()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
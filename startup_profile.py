@@ -0,0 +1,42 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# -----------------------------------------------------------
+# PROFILO DI AVVIO
+# -----------------------------------------------------------
+# Con Restart=always ogni riavvio è tempo senza controllo della wallbox.
+# Il profilo registra quando ogni fase dell'avvio è pronta (secondi dall'inizio
+# del processo) e quanto è durata, anche per le fasi che girano su altri
+# thread, così il riepilogo mostra cosa ritarda la prima decisione.
+
+class StartupProfile:
+    def __init__(self, t0=None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.tempi = {}   # fase -> secondi dall'avvio a fine fase
+        self.durate = {}  # fase -> durata, per le fasi misurate con fase()
+        self._lock = threading.Lock()
+
+    def segna(self, nome):
+        """Registra il momento in cui `nome` è pronto; True solo la prima volta"""
+        with self._lock:
+            if nome in self.tempi:
+                return False
+            self.tempi[nome] = round(time.perf_counter() - self.t0, 3)
+            return True
+
+    @contextmanager
+    def fase(self, nome):
+        inizio = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.durate[nome] = round(time.perf_counter() - inizio, 3)
+            self.segna(nome)
+
+    def riepilogo(self):
+        with self._lock:
+            voci = sorted(self.tempi.items(), key=lambda v: v[1])
+            return " | ".join(f"{nome} {t:.2f}s" + (f" ({self.durate[nome]:.2f}s)" if nome in self.durate else "")
+                              for nome, t in voci)
@@ -0,0 +1,92 @@
+import threading
+
+# -----------------------------------------------------------
+# ISTANTANEE DELLO STATO LIVE
+# -----------------------------------------------------------
+# Letture del contatore e stato della wallbox vengono pubblicati come un
+# oggetto immutabile. Chi aggiorna crea una nuova istantanea e la sostituisce
+# alla precedente con una sola assegnazione; chi legge (Flask, Telegram, push,
+# /metrics) prende il riferimento a `attuale` una volta e usa sempre quello:
+# niente lock in lettura e nessun valore a metà tra due aggiornamenti.
+# Il lock serve solo tra chi scrive (thread di controllo e coda wallbox),
+# perché ogni istantanea parte dalla precedente.
+
+CAMPI = (
+    'fasi',                   # (l1..l6) dell'ultima lettura electricity
+    'ultima_lettura_fasi',    # epoch dell'ultima lettura electricity (None = nessuna)
+    'ultima_lettura_solare',  # epoch dell'ultimo pacchetto solar (None = nessuno)
+    'wallbox_on',
+    'wallbox_potenza',        # W impostati (display_power arrotondata)
+    'impianto_fase',          # 0 = monofase, 1 = trifase
+    'surplus_previsto',       # (solare, casa) previsti con CONFIG['PREVISIONE'], altrimenti None
+)
+
+_CAMPI = frozenset(CAMPI)
+_imposta = object.__setattr__
+
+INIZIALE = {
+    'fasi': (0.0, 0.0, 0.0, 0.0, 0.0, 0.0),
+    'ultima_lettura_fasi': None,
+    'ultima_lettura_solare': None,
+    'wallbox_on': False,
+    'wallbox_potenza': 0,
+    'impianto_fase': 0,
+    'surplus_previsto': None,
+}
+
+
+class Istantanea:
+    """Stato live in sola lettura; versione cresce a ogni pubblicazione"""
+    __slots__ = CAMPI + ('versione',)
+
+    def __init__(self, versione=0, **valori):
+        if valori.keys() != _CAMPI:
+            raise TypeError(f"campi istantanea: attesi {CAMPI}, ricevuti {tuple(valori)}")
+        _imposta(self, 'versione', versione)
+        for campo in CAMPI:
+            _imposta(self, campo, valori[campo])
+
+    def __setattr__(self, nome, valore):
+        raise AttributeError("Istantanea è immutabile: usa StatoLive.pubblica()")
+
+    def __delattr__(self, nome):
+        raise AttributeError("Istantanea è immutabile")
+
+    def con(self, **modifiche):
+        """Nuova istantanea con i campi indicati cambiati e versione + 1"""
+        if not modifiche.keys() <= _CAMPI:
+            raise TypeError(f"campi istantanea sconosciuti: {tuple(modifiche.keys() - _CAMPI)}")
+        nuova = object.__new__(Istantanea)
+        _imposta(nuova, 'versione', self.versione + 1)
+        for campo in CAMPI:
+            _imposta(nuova, campo, modifiche[campo] if campo in modifiche else getattr(self, campo))
+        return nuova
+
+    @property
+    def rete(self):
+        return sum(self.fasi[0:3])
+
+    @property
+    def solare(self):
+        return sum(self.fasi[3:6])
+
+    @property
+    def potenza_wallbox(self):
+        """Potenza della wallbox se accesa, altrimenti 0"""
+        return self.wallbox_potenza if self.wallbox_on else 0
+
+    def __repr__(self):
+        return f"Istantanea(v{self.versione}, " + ", ".join(f"{c}={getattr(self, c)!r}" for c in CAMPI) + ")"
+
+
+class StatoLive:
+    def __init__(self):
+        self.attuale = Istantanea(**INIZIALE)
+        self._lock = threading.Lock()
+
+    def pubblica(self, **modifiche):
+        """Sostituisce l'istantanea corrente; ritorna quella nuova"""
+        with self._lock:
+            nuova = self.attuale.con(**modifiche)
+            self.attuale = nuova
+        return nuova
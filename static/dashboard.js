@@ -0,0 +1,220 @@
+const ctx = document.getElementById('energyChart').getContext('2d');
+const chart = new Chart(ctx, {
+    type: 'line',
+    data: {
+        labels: [],
+        datasets: [{
+            label: 'Consumo Rete (W)',
+            borderColor: 'rgb(255, 99, 132)',
+            data: [],
+            fill: false,
+            tension: 0.1
+        }, {
+            label: 'Produzione Solare (W)',
+            borderColor: 'rgb(75, 192, 192)',
+            data: [],
+            fill: true,
+            backgroundColor: 'rgba(75, 192, 192, 0.2)',
+            tension: 0.1
+        }, {
+            label: 'Potenza Wallbox (W)',
+            borderColor: 'rgb(54, 162, 235)',
+            data: [],
+            fill: true,
+            backgroundColor: 'rgba(54, 162, 235, 0.1)',
+            tension: 0.1
+        }]
+    },
+    options: {
+        responsive: true,
+        scales: { 
+            x: { display: false },
+            y: { beginAtZero: true }
+        },
+        animation: { duration: 0 }
+    }
+});
+
+function formatTime(timestamp) {
+    if (!timestamp) return "Mai";
+    const date = new Date(timestamp * 1000);
+    return date.toLocaleTimeString();
+}
+
+// Cursori dell'ultimo aggiornamento: il server manda solo letture e log nuovi
+let cursore = { seq: null, logSeq: null, etag: null, finestra: '' };
+let history = [];
+let logLines = [];
+let ultimoStato = null;
+let pushAttivo = false;
+let pushAvviato = false;
+
+function aggiornaEta() {
+    // I "secondi fa" avanzano anche quando non arrivano dati nuovi
+    if (!ultimoStato) return;
+    const serverTime = ultimoStato.server_time + (Date.now() - ultimoStato.ricevuto) / 1000;
+    const lastFasi = ultimoStato.last_fasi;
+    const lastSolar = ultimoStato.last_solar;
+
+    document.getElementById('last_fasi').innerText = formatTime(lastFasi);
+    document.getElementById('sec_fasi').innerText = lastFasi ? `(${Math.max(0, Math.round(serverTime - lastFasi))}s fa)` : '';
+
+    document.getElementById('last_solar').innerText = formatTime(lastSolar);
+    document.getElementById('sec_solar').innerText = lastSolar ? `(${Math.max(0, Math.round(serverTime - lastSolar))}s fa)` : '';
+}
+
+const MAX_LOG = 2000;
+
+function escapeHtml(testo) {
+    return testo.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+}
+
+function mostraLog() {
+    document.getElementById('console').innerHTML =
+        logLines.map(v => `<span class="log-${v.livello}">${escapeHtml(v.riga)}</span>`).join('<br>');
+}
+
+async function caricaLogPrecedenti() {
+    // Pagina di log più vecchi della prima riga mostrata
+    const primo = logLines.length ? logLines[0].seq : '';
+    const response = await fetch(`/api/logs?prima_di=${primo}&limite=100`);
+    const data = await response.json();
+    const ids = new Set(logLines.map(v => v.id));
+    logLines = data.logs.filter(v => !ids.has(v.id)).concat(logLines);
+    mostraLog();
+    document.getElementById('log_precedenti').disabled = !data.altre;
+}
+
+function nuovi(lista, reset, seqDati, seqNostro) {
+    // Polling e push possono consegnare le stesse righe: si tengono solo quelle dopo il nostro cursore
+    if (reset || seqNostro === null) return { reset: true, righe: lista };
+    const n = seqDati - seqNostro;
+    return { reset: false, righe: n > 0 ? lista.slice(-n) : [] };
+}
+
+function applica(data, daPush) {
+    if (document.activeElement.id !== 'prelevabile') 
+        document.getElementById('prelevabile').placeholder = data.config.prelevabile;
+    if (document.activeElement.id !== 'protezione') 
+        document.getElementById('protezione').placeholder = data.config.protezione;
+
+    const wbSpan = document.getElementById('wb_status');
+    wbSpan.innerText = data.status.wb_on ? "ON" : "OFF";
+    wbSpan.className = data.status.wb_on ? "status-on" : "status-off";
+
+    document.getElementById('wb_power').innerText = data.status.wb_power;
+    document.getElementById('wb_mode').innerText = data.status.fase_mode === 1 ? "Trifase" : "Monofase";
+
+    ultimoStato = Object.assign({ ricevuto: Date.now() }, data.status);
+    aggiornaEta();
+
+    const f = data.status.fasi;
+    for(let i=0; i<6; i++) {
+        document.getElementById('l'+(i+1)).innerText = Math.round(f[i]);
+    }
+    document.getElementById('tot_grid').innerText = Math.round(data.status.grid_total);
+    document.getElementById('tot_solar').innerText = Math.round(data.status.solar_total);
+
+    // Con una finestra lunga il grafico arriva dal polling, il push porta solo le letture grezze
+    if (!(daPush && cursore.finestra)) {
+        const h = nuovi(data.history, data.history_reset, data.seq, cursore.seq);
+        history = h.reset ? h.righe : history.concat(h.righe).slice(-data.punti);
+        if (h.reset || data.seq > cursore.seq) cursore.seq = data.seq;
+        chart.data.labels = history.map(h => data.risoluzione >= 3600 ? new Date(h.time * 1000).toLocaleString() : formatTime(h.time));
+        chart.data.datasets[0].data = history.map(h => h.grid);
+        chart.data.datasets[1].data = history.map(h => h.solar);
+        chart.data.datasets[2].data = history.map(h => h.wb);
+        chart.update();
+    }
+
+    const consoleDiv = document.getElementById('console');
+    const isScrolledToBottom = consoleDiv.scrollHeight - consoleDiv.clientHeight <= consoleDiv.scrollTop + 5;
+
+    // Le voci ripetute tornano con lo stesso id: la vecchia riga viene sostituita
+    const reset = data.logs_reset || cursore.logSeq === null;
+    const voci = reset ? data.logs : data.logs.filter(v => v.seq > cursore.logSeq);
+    const ids = new Set(voci.map(v => v.id));
+    logLines = (reset ? [] : logLines.filter(v => !ids.has(v.id))).concat(voci).slice(-MAX_LOG);
+    if (reset || data.log_seq > cursore.logSeq) cursore.logSeq = data.log_seq;
+    mostraLog();
+
+    if (isScrolledToBottom) {
+        consoleDiv.scrollTop = consoleDiv.scrollHeight;
+    }
+}
+
+async function fetchData() {
+    try {
+        const finestra = document.getElementById('finestra').value;
+        if (finestra !== cursore.finestra) {
+            cursore = { seq: null, logSeq: cursore.logSeq, etag: null, finestra: finestra };
+        }
+        const params = new URLSearchParams();
+        if (finestra) {
+            params.set('finestra', finestra);
+            params.set('punti', 300);
+        } else if (cursore.seq !== null) {
+            params.set('seq', cursore.seq);
+        }
+        if (cursore.logSeq !== null) params.set('log_seq', cursore.logSeq);
+
+        const response = await fetch('/api/data?' + params, {
+            cache: 'no-store',
+            headers: cursore.etag ? { 'If-None-Match': cursore.etag } : {}
+        });
+        if (response.status === 304) {
+            aggiornaEta();
+            return;
+        }
+        const data = await response.json();
+        cursore.etag = response.headers.get('ETag');
+        applica(data, false);
+        // la porta dello stream arriva con i dati: la pagina è statica
+        avviaPush(data.status.push_port);
+
+    } catch (e) { console.error("Errore fetch:", e); }
+}
+
+function avviaPush(porta) {
+    // Stream Server-Sent Events; se non è disponibile resta il polling ogni 2 s
+    if (pushAvviato || !porta || !window.EventSource) return;
+    pushAvviato = true;
+    const stream = new EventSource(`${location.protocol}//${location.hostname}:${porta}/stream`);
+    stream.onopen = () => { pushAttivo = true; };
+    stream.onmessage = (e) => { applica(JSON.parse(e.data), true); };
+    // EventSource si ricollega da solo; nel frattempo riparte il polling
+    stream.onerror = () => { pushAttivo = false; };
+}
+
+async function updateSettings() {
+    const prelevabile = document.getElementById('prelevabile').value;
+    const protezione = document.getElementById('protezione').value;
+
+    await fetch('/api/settings', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ 
+            prelevabile: parseInt(prelevabile), 
+            protezione: parseInt(protezione) 
+        })
+    });
+    alert("Impostazioni salvate!");
+    fetchData();
+}
+
+async function reinitWallbox() {
+    if (!confirm("Sei sicuro di voler forzare la re-inizializzazione della Wallbox?")) return;
+    try {
+        const response = await fetch('/api/init_wallbox', { method: 'POST' });
+        const result = await response.json();
+        if (result.success) {
+            alert("Comando inviato! Controlla la console per l'esito.");
+            fetchData();
+        } else {
+            alert("Errore nell'invio del comando.");
+        }
+    } catch (e) { console.error("Errore:", e); }
+}
+
+fetchData();
+setInterval(() => { if (!pushAttivo || cursore.finestra) fetchData(); else aggiornaEta(); }, 2000); 
@@ -0,0 +1,73 @@
+const chart = new Chart(document.getElementById('energyChart').getContext('2d'), {
+    type: 'line',
+    data: {
+        labels: [],
+        datasets: [
+            { label: 'Consumo Rete (W)', borderColor: 'rgb(255, 99, 132)', data: [], fill: false, tension: 0.1 },
+            { label: 'Produzione Solare (W)', borderColor: 'rgb(75, 192, 192)', data: [], fill: true,
+              backgroundColor: 'rgba(75, 192, 192, 0.2)', tension: 0.1 },
+            { label: 'Potenza Wallbox (W)', borderColor: 'rgb(54, 162, 235)', data: [], fill: true,
+              backgroundColor: 'rgba(54, 162, 235, 0.1)', tension: 0.1 }
+        ]
+    },
+    options: { responsive: true, scales: { x: { display: false }, y: { beginAtZero: true } }, animation: { duration: 0 } }
+});
+
+let sitoScelto = null;
+
+function watt(v) {
+    return v === undefined ? '-' : `${Math.round(v)} W`;
+}
+
+function testo(tag, contenuto) {
+    const el = document.createElement(tag);
+    el.innerText = contenuto;
+    return el;
+}
+
+async function aggiornaSiti() {
+    try {
+        const data = await (await fetch('/api/siti')).json();
+        const tot = data.totali;
+        document.getElementById('tot_siti').innerText = tot.siti;
+        document.getElementById('tot_online').innerText = tot.online;
+        document.getElementById('tot_lotti').innerText = data.stats.lotti;
+        document.getElementById('tot_solare').innerText = watt(tot.solare);
+        document.getElementById('tot_rete').innerText = watt(tot.rete);
+        document.getElementById('tot_wb').innerText = watt(tot.wb);
+        document.getElementById('tot_surplus').innerText = watt(tot.surplus);
+
+        const corpo = document.getElementById('siti');
+        corpo.replaceChildren(...data.siti.map(s => {
+            const riga = document.createElement('tr');
+            if (!s.online) riga.classList.add('offline');
+            if (s.nome === sitoScelto) riga.classList.add('scelto');
+            const eta = s.ultimo_contatto ? `${Math.round(data.server_time - s.ultimo_contatto)}s fa` : 'mai';
+            const coda = (s.stato && s.stato.coda) || {};
+            riga.append(
+                testo('td', s.nome), testo('td', eta), testo('td', watt(s.solare)), testo('td', watt(s.rete)),
+                testo('td', watt(s.wb)), testo('td', s.stato && s.stato.wb_on ? watt(s.stato.setpoint) : 'OFF'),
+                testo('td', watt(s.surplus)), testo('td', `${coda.inviati ?? '-'} / ${coda.falliti ?? '-'}`)
+            );
+            riga.onclick = () => { sitoScelto = s.nome; aggiornaGrafico(); aggiornaSiti(); };
+            return riga;
+        }));
+    } catch (e) { console.error("Errore fetch:", e); }
+}
+
+async function aggiornaGrafico() {
+    if (!sitoScelto) return;
+    try {
+        const data = await (await fetch(`/api/siti/${encodeURIComponent(sitoScelto)}?finestra=86400&punti=300`)).json();
+        document.getElementById('sito_scelto').innerText = `${data.nome} - ultime 24 ore`;
+        chart.data.labels = data.history.map(h => new Date(h.t * 1000).toLocaleTimeString());
+        chart.data.datasets[0].data = data.history.map(h => h.grid);
+        chart.data.datasets[1].data = data.history.map(h => h.solar);
+        chart.data.datasets[2].data = data.history.map(h => h.wb);
+        chart.update();
+    } catch (e) { console.error("Errore fetch:", e); }
+}
+
+aggiornaSiti();
+setInterval(aggiornaSiti, 5000);
+setInterval(aggiornaGrafico, 30000);
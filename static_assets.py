@@ -0,0 +1,166 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+import threading
+
+try:
+    import brotli
+except ImportError:  # opzionale: senza il modulo si servono solo i .br già presenti su disco
+    brotli = None
+
+# -----------------------------------------------------------
+# FILE STATICI DELLA DASHBOARD
+# -----------------------------------------------------------
+# HTML, CSS, JS e Chart.js stanno in static/ e vengono letti una volta sola,
+# già compressi (gzip e, se disponibile, brotli). Se accanto a un file c'è
+# una versione .gz / .br più recente (creata con `python static_assets.py`)
+# si usa quella, altrimenti la compressione avviene in memoria al primo uso.
+# Ogni file ha un ETag forte dal suo hash. Nelle pagine HTML i riferimenti a
+# /static/... ricevono ?v=<hash>: con la versione giusta nell'URL la risposta
+# si può tenere in cache per sempre, così un ricaricamento della pagina costa
+# solo la validazione dell'HTML (304) e funziona anche senza internet.
+
+CACHE_IMMUTABILE = 'public, max-age=31536000, immutable'
+CACHE_VALIDA = 'no-cache'
+CODIFICHE = ('br', 'gzip')  # in ordine di preferenza
+_ESTENSIONI = {'br': '.br', 'gzip': '.gz'}
+_COMPRIMIBILI = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+class _Asset:
+    __slots__ = ('nome', 'tipo', 'versione', 'varianti')
+
+    def __init__(self, nome, tipo, corpo):
+        self.nome = nome
+        self.tipo = tipo
+        self.versione = hashlib.sha256(corpo).hexdigest()[:16]
+        self.varianti = {None: corpo}  # codifica (None = nessuna) -> bytes
+
+    def etag(self, codifica):
+        # ETag forte diverso per ogni codifica, come richiesto per rappresentazioni diverse
+        return self.versione if codifica is None else f"{self.versione}-{codifica}"
+
+    def etag_noti(self):
+        return [self.etag(c) for c in self.varianti]
+
+
+class AssetStatici:
+    def __init__(self, cartella, livello_gzip=9, livello_brotli=11):
+        self.cartella = cartella
+        self.livello_gzip = livello_gzip
+        self.livello_brotli = livello_brotli
+        self._asset = None  # nome relativo -> _Asset
+        self._lock = threading.Lock()
+
+    def carica(self):
+        """Legge e comprime tutti i file; chiamato all'avvio del server web o al primo uso"""
+        with self._lock:
+            if self._asset is not None:
+                return
+            nomi = []
+            for radice, _, files in os.walk(self.cartella):
+                for f in files:
+                    if not f.endswith(('.gz', '.br')):
+                        nomi.append(os.path.relpath(os.path.join(radice, f), self.cartella).replace(os.sep, '/'))
+            asset = {}
+            # prima gli altri file, poi l'HTML che ne riporta le versioni negli URL
+            for nome in sorted(nomi, key=lambda n: (n.endswith('.html'), n)):
+                path = os.path.join(self.cartella, nome)
+                with open(path, 'rb') as f:
+                    corpo = f.read()
+                if nome.endswith('.html'):
+                    corpo = self._versiona(corpo, asset)
+                    compressi = {}
+                else:
+                    compressi = self._compressi_su_disco(path)
+                tipo = mimetypes.guess_type(nome)[0] or 'application/octet-stream'
+                if tipo.startswith('text/') or tipo == 'application/javascript':
+                    tipo += '; charset=utf-8'
+                a = _Asset(nome, tipo, corpo)
+                if tipo.startswith(_COMPRIMIBILI):
+                    for codifica in CODIFICHE:
+                        dati = compressi.get(codifica) or self._comprimi(corpo, codifica)
+                        if dati is not None and len(dati) < len(corpo):
+                            a.varianti[codifica] = dati
+                asset[nome] = a
+            self._asset = asset
+
+    def _versiona(self, corpo, asset):
+        for nome, a in asset.items():
+            corpo = corpo.replace(f'"/static/{nome}"'.encode(), f'"/static/{nome}?v={a.versione}"'.encode())
+        return corpo
+
+    def _compressi_su_disco(self, path):
+        """Versioni .gz / .br create con precomprimi(), se più recenti del file"""
+        compressi = {}
+        for codifica, estensione in _ESTENSIONI.items():
+            try:
+                if os.path.getmtime(path + estensione) >= os.path.getmtime(path):
+                    with open(path + estensione, 'rb') as f:
+                        compressi[codifica] = f.read()
+            except OSError:
+                pass
+        return compressi
+
+    def _comprimi(self, corpo, codifica):
+        if codifica == 'gzip':
+            return gzip.compress(corpo, self.livello_gzip, mtime=0)
+        if brotli is not None:
+            return brotli.compress(corpo, quality=self.livello_brotli)
+        return None
+
+    def trova(self, nome):
+        if self._asset is None:
+            self.carica()
+        return self._asset.get(nome)
+
+    def risposta(self, nome, request, response_class):
+        """Risposta Flask per il file `nome`: 404, 304 sull'ETag o corpo nella codifica migliore"""
+        asset = self.trova(nome)
+        if asset is None:
+            return response_class('Non trovato', status=404, content_type='text/plain; charset=utf-8')
+        codifica = self.codifica(asset, request.accept_encodings)
+        headers = {
+            'ETag': f'"{asset.etag(codifica)}"',
+            'Vary': 'Accept-Encoding',
+            # con la versione giusta nell'URL il contenuto non cambia mai
+            'Cache-Control': CACHE_IMMUTABILE if request.args.get('v') == asset.versione else CACHE_VALIDA,
+        }
+        if any(request.if_none_match.contains(etag) for etag in asset.etag_noti()):
+            return response_class(status=304, headers=headers)
+        if codifica:
+            headers['Content-Encoding'] = codifica
+        return response_class(asset.varianti[codifica], content_type=asset.tipo, headers=headers)
+
+    @staticmethod
+    def codifica(asset, accept_encodings):
+        """La codifica migliore tra quelle disponibili e accettate dal client (None = nessuna)"""
+        for codifica in CODIFICHE:
+            if codifica in asset.varianti and accept_encodings[codifica] > 0:
+                return codifica
+        return None
+
+
+def precomprimi(cartella):
+    """Scrive accanto ai file le versioni .gz (e .br se c'è il modulo brotli)"""
+    statici = AssetStatici(cartella)
+    for radice, _, files in os.walk(cartella):
+        for f in files:
+            path = os.path.join(radice, f)
+            tipo = mimetypes.guess_type(f)[0] or ''
+            if f.endswith(('.gz', '.br', '.html')) or not tipo.startswith(_COMPRIMIBILI):
+                continue
+            with open(path, 'rb') as sorgente:
+                corpo = sorgente.read()
+            for codifica, estensione in _ESTENSIONI.items():
+                dati = statici._comprimi(corpo, codifica)
+                if dati is not None:
+                    with open(path + estensione, 'wb') as out:
+                        out.write(dati)
+                    print(f"{path}{estensione}: {len(corpo)} -> {len(dati)} bytes")
+
+
+if __name__ == '__main__':
+    precomprimi(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
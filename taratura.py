@@ -0,0 +1,496 @@
+"""Taratura offline delle costanti di controllo su registrazioni di packet_recorder.py.
+
+Prova migliaia di combinazioni di SMOOTHING_ALPHA, MAX_DELTA_PER_SEC,
+POTENZA_PROTEZIONE, UPDATE_INTERVAL_S, TIMER_SPEGNIMENTO, COOLDOWN_ACCENSIONE
+e dei margini di run_logic sulle stesse giornate e riporta il fronte di Pareto
+su prelievo dalla rete, autoconsumo, comandi all'ora e accensioni.
+
+replay.py fa passare ogni pacchetto dal codice vero (decoder, storico, log):
+corretto ma qualche secondo a giornata per ogni combinazione. Qui invece:
+- i pacchetti di ogni registrazione vengono decodificati una volta sola, con
+  gli stessi tick di replay.py, negli ingressi di run_logic (solare, casa,
+  previsione) a ogni decisione
+- la macchina a stati di run_logic / set_power / turn_on / turn_off gira su
+  tutte le combinazioni insieme: ogni variabile di stato della wallbox è un
+  array numpy con una cella per combinazione e ogni ramo di run_logic una
+  maschera. Le decisioni restano in sequenza nel tempo, le combinazioni no
+- registrazioni e blocchi di combinazioni sono divisi su un pool di processi
+Ogni modifica a run_logic va riportata in simula(): --verifica confronta le
+due su alcune combinazioni con replay.rigioca().
+
+Le chiavi di PREVISIONE e TICK_CONTROLLO_S cambiano gli ingressi e non la
+macchina a stati: nella griglia funzionano, ma ogni loro valore è una
+estrazione in più. Con PREVISIONE=True la simulazione decide su solare e
+consumi previsti da previsione.py invece che sull'ultima lettura: è la
+variante sperimentale, che run_logic nel servizio non usa, quindi --verifica
+non la confronta con replay.py.
+
+Uso:
+    python taratura.py giorno1.rec.gz giorno2.rec.gz
+    python taratura.py registrazioni/*.rec.gz --griglia POTENZA_PROTEZIONE=200,300,500 --griglia PREVISIONE=False,True
+    python taratura.py giorno.rec.gz --verifica 4 --json taratura.json
+"""
+import argparse
+import ast
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+
+from packet_decoder import ELECTRICITY, SOLAR, PacketCoalescer, PacketDecoder
+from packet_recorder import PACCHETTO, COMANDO, leggi_registrazione
+from previsione import PrevisioneSurplus
+from replay import BUCO_MAX_S, WallboxRegistrata
+
+# Valori provati per chiave (prodotto cartesiano): 2592 combinazioni
+GRIGLIA = {
+    'SMOOTHING_ALPHA': (0.5, 0.75, 0.9, 1.0),
+    'MAX_DELTA_PER_SEC': (500, 1500, 5000),
+    'POTENZA_PROTEZIONE': (150, 300, 500),
+    'UPDATE_INTERVAL_S': (5, 10, 20),
+    'TIMER_SPEGNIMENTO': (30, 60, 120),
+    'COOLDOWN_ACCENSIONE': (60, 180),
+    'MARGINE_AUMENTO_W': (100, 300),
+    'MARGINE_RIDUZIONE_W': (100, 200),
+}
+# Chiavi della macchina a stati: una cella per combinazione in simula()
+CHIAVI_STATO = ('SMOOTHING_ALPHA', 'MAX_DELTA_PER_SEC', 'POTENZA_PROTEZIONE', 'UPDATE_INTERVAL_S',
+                'TIMER_SPEGNIMENTO', 'COOLDOWN_ACCENSIONE', 'MARGINE_AUMENTO_W', 'MARGINE_RIDUZIONE_W',
+                'IMPORT_SPEGNIMENTO_W', 'POTENZA_PRELEVABILE')
+# Chiavi degli ingressi: un'estrazione per ogni combinazione di valori
+CHIAVI_TRACCIA = ('PREVISIONE', 'PREVISIONE_ORIZZONTE_S', 'PREVISIONE_PERSISTENZA_S',
+                  'PREVISIONE_PERSISTENZA_CASA_S', 'TICK_CONTROLLO_S')
+# (nome, da minimizzare): autoconsumo entra col segno cambiato
+OBIETTIVI = (('rete_kwh', 1), ('autoconsumo_pct', -1), ('comandi_ora', 1), ('accensioni', 1))
+
+
+def config_attuale():
+    from solar_webinterface import CONFIG
+    return {k: CONFIG[k] for k in CHIAVI_STATO + CHIAVI_TRACCIA + (
+        'MONOFASE_MIN_POWER', 'MONOFASE_MAX_POWER', 'TRIFASE_MIN_POWER', 'TRIFASE_MAX_POWER')}
+
+
+# -----------------------------------------------------------
+# INGRESSI DI RUN_LOGIC
+# -----------------------------------------------------------
+# Gli stessi passi di replay.rigioca(): tick ogni TICK_CONTROLLO_S, coalescer,
+# consumo della casa al netto della wallbox registrata (anello chiuso). Per
+# ogni tick con pacchetti nuovi una riga: quello che run_logic legge da
+# EnergyMonitor e dalla previsione. Le righe con una lettura electricity
+# portano anche il tratto di energia che replay.py integra a quella lettura.
+
+def estrai_traccia(path, config):
+    record = list(leggi_registrazione(path))
+    if not record:
+        raise ValueError(f"{path}: registrazione vuota")
+    decoder = PacketDecoder()
+    coalescer = PacketCoalescer()
+    registrata = WallboxRegistrata()
+    previsione = None
+    if config['PREVISIONE']:
+        previsione = PrevisioneSurplus(config['PREVISIONE_ORIZZONTE_S'], config['PREVISIONE_PERSISTENZA_S'],
+                                       config['PREVISIONE_PERSISTENZA_CASA_S'])
+    righe = []
+    # initialize(): 'o', 'P' e 'P' dopo 0.5s, poi 1s di pausa in coda prima di decidere
+    t_pronto = record[0][1] + 1.5
+    stato = {'solare': 0.0, 'casa': 0.0, 'precedente': None}
+
+    def elabora(t):
+        t = max(t, t_pronto)
+        elettrica = trigger = False
+        ore = solare_p = casa_p = 0.0
+        for data in coalescer.preleva()[0]:
+            pacchetto = decoder.decode(data)
+            if pacchetto is None:
+                continue
+            tipo, valori = pacchetto
+            trigger = True
+            if tipo == ELECTRICITY:
+                stato['solare'] = sum(valori[3:])
+                stato['casa'] = max(0.0, sum(valori[:3]) - registrata.assorbita())
+                precedente = stato['precedente']
+                if precedente is not None and 0 < t - precedente[0] <= BUCO_MAX_S:
+                    ore = (t - precedente[0]) / 3600
+                    solare_p, casa_p = precedente[1], precedente[2]
+                stato['precedente'] = (t, stato['solare'], stato['casa'])
+                elettrica = True
+            elif tipo == SOLAR:
+                stato['solare'] = valori
+        if not trigger:
+            return
+        solare, casa = stato['solare'], stato['casa']
+        if previsione is not None:
+            previsione.aggiorna(t, solare, casa)
+            gen, casa_dec = previsione.solare_previsto(), previsione.casa_prevista()
+        else:
+            gen, casa_dec = solare, casa
+        righe.append((t, solare, casa, gen, casa_dec, elettrica, ore, solare_p, casa_p))
+
+    tick = config['TICK_CONTROLLO_S']
+    prossimo_tick = (math.floor(record[0][1] / tick) + 1) * tick
+    for tipo, t, payload in record:
+        if t >= prossimo_tick:
+            if coalescer.t_primo is not None:
+                elabora(prossimo_tick)
+            prossimo_tick = (math.floor(t / tick) + 1) * tick
+        if tipo == PACCHETTO:
+            coalescer.offri(payload, t)
+        elif tipo == COMANDO:
+            registrata.applica(payload.decode())
+    if coalescer.t_primo is not None:
+        elabora(prossimo_tick)
+
+    colonne = list(zip(*righe)) if righe else [()] * 9
+    traccia = {nome: np.array(c, dtype=bool if nome == 'elettrica' else float) for nome, c in zip(
+        ('t', 'solare', 'casa', 'gen', 'casa_dec', 'elettrica', 'ore', 'solare_p', 'casa_p'), colonne)}
+    traccia['nome'] = os.path.basename(path).split('.')[0]
+    traccia['previsione'] = previsione is not None
+    traccia['durata_s'] = record[-1][1] - record[0][1]
+    traccia['t0'] = record[0][1]
+    return traccia
+
+
+# -----------------------------------------------------------
+# MACCHINA A STATI VETTORIALE
+# -----------------------------------------------------------
+# WallboxController + run_logic + WallboxSimulata di replay.py, con uno stato
+# per combinazione. Ogni metodo riceve la maschera delle combinazioni che in
+# run_logic arrivano a quella chiamata; i `return` anticipati di run_logic
+# diventano combinazioni tolte dalla maschera.
+
+class WallboxVettore:
+    def __init__(self, parametri, n, t0, pmin, pmax):
+        self.p = {k: np.asarray(v, dtype=float) for k, v in parametri.items()}
+        self.pmin, self.pmax = pmin, pmax
+        self.is_on = np.zeros(n, bool)
+        self.corrente = np.full(n, float(pmin))     # current_set_power
+        self.display = np.full(n, float(pmin))      # display_power
+        self.ultimo_update = np.full(n, t0 + 0.5)   # last_update_time
+        self.ultimo_comando = np.full(n, t0 + 0.5)  # last_power_cmd_time
+        self.spenta_a = np.full(n, t0)              # time_turned_off
+        self.timer_fino = np.zeros(n)               # pending_off_until
+        self.comandi = {'potenza': np.full(n, 2), 'accensioni': np.zeros(n, int),
+                        'spegnimenti': np.ones(n, int), 'timer': np.zeros(n, int)}
+
+    def assorbita(self):
+        return np.where(self.is_on, self.corrente, 0.0)
+
+    def _invia(self, m, valore, smoothed, now):
+        np.copyto(self.corrente, valore, where=m)
+        np.copyto(self.display, smoothed, where=m)
+        self.ultimo_update[m] = now
+        self.ultimo_comando[m] = now
+        self.comandi['potenza'] += m
+
+    def potenza_diretta(self, m, watts, now):
+        """set_power(watts, bypass=True)"""
+        if m.any():
+            valore = np.clip(np.trunc(watts), self.pmin, self.pmax)
+            self._invia(m, valore, valore, now)
+
+    def potenza(self, m, watts, now):
+        """set_power(watts, bypass=False)"""
+        if not m.any():
+            return
+        p = self.p
+        richiesta = np.clip(np.trunc(watts), self.pmin, self.pmax)
+        m = m & ~((np.abs(richiesta - self.corrente) < p['POTENZA_PROTEZIONE']) & self.is_on)
+        m &= ~((self.ultimo_update > 0) & (now - self.ultimo_update < p['UPDATE_INTERVAL_S']))
+        if not m.any():
+            return
+        consentito = p['MAX_DELTA_PER_SEC'] * np.maximum(now - self.ultimo_comando, 0.01)
+        limitata = np.where(richiesta > self.corrente + consentito, np.trunc(self.corrente + consentito),
+                            np.where(richiesta < self.corrente - consentito, np.trunc(self.corrente - consentito),
+                                     richiesta))
+        alpha = p['SMOOTHING_ALPHA']
+        smoothed = np.where(self.display == 0, limitata, alpha * limitata + (1 - alpha) * self.display)
+        invio = np.round(smoothed)
+        uguale = m & (invio == self.corrente)
+        np.copyto(self.display, smoothed, where=uguale)
+        self._invia(m & ~uguale, invio, smoothed, now)
+
+    def accendi(self, m, now):
+        m = m & ~((self.spenta_a > 0) & (now - self.spenta_a < self.p['COOLDOWN_ACCENSIONE']))
+        if m.any():
+            self.potenza_diretta(m, self.pmin, now)
+            self.is_on |= m
+            self.ultimo_update[m] = now
+            self.comandi['accensioni'] += m
+
+    def spegni(self, m, now):
+        """turn_off(force=True)"""
+        m = m & ~((self.ultimo_update != 0) & (now - self.ultimo_update < self.p['UPDATE_INTERVAL_S']))
+        if m.any():
+            self.is_on &= ~m
+            self.spenta_a[m] = now
+            self.ultimo_update[m] = now
+            self.comandi['spegnimenti'] += m
+            self.potenza_diretta(m, self.pmin, now)
+
+    def decidi(self, now, gen, casa, consumata):
+        """run_logic; consumata è None con la previsione (casa prevista + carica)"""
+        p = self.p
+        acceso = self.is_on.copy()
+        carica = np.where(acceso, self.display, 0.0)
+        if consumata is None:
+            consumata = casa + carica
+        gen = gen + p['POTENZA_PRELEVABILE']
+        esportata = gen - consumata
+        attive = consumata != 0
+
+        self.accendi(attive & ~acceso & (esportata > self.pmin), now)
+
+        m = attive & acceso
+        in_timer = m & (self.timer_fino > 0)
+        if in_timer.any():
+            scaduto = in_timer & (now >= self.timer_fino)
+            self.timer_fino[scaduto] = 0
+            spegni = scaduto & ((gen < self.pmin) | (esportata < -p['IMPORT_SPEGNIMENTO_W']))
+            self.spegni(spegni, now)
+            self.potenza_diretta(scaduto & ~spegni, self.pmin, now)
+            m &= ~in_timer
+
+        self.potenza(m & (consumata > gen), gen - casa - p['MARGINE_RIDUZIONE_W'], now)
+        giu = m & ((carica > gen - casa) | (esportata < 0))
+        nuova = carica - np.abs(esportata)
+        minimo = giu & ((nuova < self.pmin) | (gen < self.pmin))
+        if minimo.any():
+            self.potenza_diretta(minimo, self.pmin, now)
+            self.timer_fino[minimo] = now + p['TIMER_SPEGNIMENTO'][minimo]
+            self.comandi['timer'] += minimo
+        self.potenza(giu & ~minimo, nuova, now)
+
+        su = m & ~giu
+        nuova = carica + np.abs(gen - consumata) - p['MARGINE_AUMENTO_W']
+        su &= ~((nuova > gen) | (casa + nuova - carica > gen) | (nuova + casa > gen))
+        massima = su & (nuova > self.pmax)
+        self.potenza_diretta(massima, self.pmax, now)
+        self.potenza(su & ~massima, nuova, now)
+
+
+def simula(traccia, parametri, pmin, pmax):
+    """Risultati di una registrazione per ogni combinazione: dict di array lunghi quanto i parametri"""
+    n = len(next(iter(parametri.values())))
+    wb = WallboxVettore(parametri, n, traccia['t0'], pmin, pmax)
+    energia = {k: np.zeros(n) for k in ('wallbox', 'autoconsumo', 'wallbox_solare', 'rete')}
+    solare = casa = 0.0
+    wb_p = np.zeros(n)
+    consumata = np.zeros(n)
+    previsione = traccia['previsione']
+    for t, s, c, gen, casa_dec, elettrica, ore, s_p, c_p in zip(
+            traccia['t'].tolist(), traccia['solare'].tolist(), traccia['casa'].tolist(), traccia['gen'].tolist(),
+            traccia['casa_dec'].tolist(), traccia['elettrica'].tolist(), traccia['ore'].tolist(),
+            traccia['solare_p'].tolist(), traccia['casa_p'].tolist()):
+        if elettrica:
+            if ore:
+                # il tratto precedente, a potenza costante fino a questa lettura (come replay.py)
+                solare += s_p * ore
+                casa += c_p * ore
+                energia['wallbox'] += wb_p * ore
+                energia['autoconsumo'] += np.minimum(s_p, c_p + wb_p) * ore
+                energia['wallbox_solare'] += np.minimum(wb_p, max(0.0, s_p - c_p)) * ore
+                energia['rete'] += np.maximum(0.0, c_p + wb_p - s_p) * ore
+            wb_p = wb.assorbita()
+            consumata = c + wb_p
+        wb.decidi(t, gen, casa_dec, None if previsione else consumata)
+    esito = {k + '_kwh': v / 1000 for k, v in energia.items()}
+    esito['solare_kwh'] = np.full(n, solare / 1000)
+    esito['casa_kwh'] = np.full(n, casa / 1000)
+    esito.update({k: v.copy() for k, v in wb.comandi.items()})
+    esito['durata_s'] = np.full(n, traccia['durata_s'])
+    return esito
+
+
+def indicatori(totale):
+    """Aggiunge ai totali di più registrazioni percentuali e comandi all'ora"""
+    comandi = totale['potenza'] + totale['accensioni'] + totale['spegnimenti']
+    totale['comandi_ora'] = comandi / (totale['durata_s'] / 3600)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        totale['autoconsumo_pct'] = np.nan_to_num(100 * totale['autoconsumo_kwh'] / totale['solare_kwh'])
+        totale['wallbox_da_solare_pct'] = np.nan_to_num(100 * totale['wallbox_solare_kwh'] / totale['wallbox_kwh'])
+    return totale
+
+
+def fronte_pareto(obiettivi, blocco=512):
+    """Indici delle righe non dominate di `obiettivi` (N x k, tutti da minimizzare)"""
+    dominata = np.zeros(len(obiettivi), bool)
+    for inizio in range(0, len(obiettivi), blocco):
+        b = obiettivi[inizio:inizio + blocco, None, :]
+        meglio_o_uguale = (obiettivi[None, :, :] <= b).all(axis=2)
+        meglio = (obiettivi[None, :, :] < b).any(axis=2)
+        dominata[inizio:inizio + blocco] = (meglio_o_uguale & meglio).any(axis=1)
+    return np.flatnonzero(~dominata)
+
+
+# -----------------------------------------------------------
+# GRIGLIA E POOL DI PROCESSI
+# -----------------------------------------------------------
+
+def combinazioni(griglia, base):
+    """Lista di config complete: la prima è `base` (i valori attuali), poi il prodotto della griglia"""
+    chiavi = list(griglia)
+    lista = [dict(base)]
+    for valori in itertools.product(*(griglia[k] for k in chiavi)):
+        lista.append({**base, **dict(zip(chiavi, valori))})
+    return lista
+
+
+def _lavoro_traccia(path, config):
+    return estrai_traccia(path, config)
+
+
+def _lavoro_simula(traccia, parametri, pmin, pmax):
+    return simula(traccia, parametri, pmin, pmax)
+
+
+def tara(registrazioni, griglia, base, trifase=False, processi=None, blocco=None):
+    """Simula tutte le combinazioni su tutte le registrazioni: (combinazioni, totali per combinazione)"""
+    processi = processi or os.cpu_count()
+    lista = combinazioni(griglia, base)
+    pmin = base['TRIFASE_MIN_POWER'] if trifase else base['MONOFASE_MIN_POWER']
+    pmax = base['TRIFASE_MAX_POWER'] if trifase else base['MONOFASE_MAX_POWER']
+
+    gruppi = {}  # valori delle chiavi degli ingressi -> indici delle combinazioni
+    for i, config in enumerate(lista):
+        gruppi.setdefault(tuple(config[k] for k in CHIAVI_TRACCIA), []).append(i)
+    blocco = blocco or max(1, math.ceil(max(len(v) for v in gruppi.values()) / processi))
+
+    with multiprocessing.Pool(processi) as pool:
+        lavori_tracce = [(path, lista[indici[0]]) for indici in gruppi.values() for path in registrazioni]
+        tracce = pool.starmap(_lavoro_traccia, lavori_tracce)
+        lavori, destinazioni = [], []
+        for g, indici in enumerate(gruppi.values()):
+            for inizio in range(0, len(indici), blocco):
+                parte = indici[inizio:inizio + blocco]
+                parametri = {k: [lista[i][k] for i in parte] for k in CHIAVI_STATO}
+                for r in range(len(registrazioni)):
+                    lavori.append((tracce[g * len(registrazioni) + r], parametri, pmin, pmax))
+                    destinazioni.append(parte)
+        esiti = pool.starmap(_lavoro_simula, lavori)
+
+    # per combinazione: la somma delle registrazioni
+    per_combinazione = [[] for _ in lista]
+    for parte, esito in zip(destinazioni, esiti):
+        for j, i in enumerate(parte):
+            per_combinazione[i].append({k: v[j] for k, v in esito.items()})
+    totali = {k: np.array([sum(e[k] for e in lista_e) for lista_e in per_combinazione]) for k in esiti[0]}
+    return lista, indicatori(totali)
+
+
+# -----------------------------------------------------------
+# CONFRONTO CON REPLAY.PY
+# -----------------------------------------------------------
+
+def _replay(path, config, trifase):
+    from replay import rigioca
+    esito = rigioca(path, trifase=trifase, config=config)
+    esito.pop('sequenza_comandi')
+    return esito
+
+
+def verifica(path, configurazioni, trifase, processi):
+    """replay.rigioca() e simula() sulle stesse combinazioni: righe (config, replay, taratura)"""
+    with multiprocessing.get_context('spawn').Pool(processi, maxtasksperchild=1) as pool:
+        veri = pool.starmap(_replay, [(path, c, trifase) for c in configurazioni])
+    righe = []
+    for config, vero in zip(configurazioni, veri):
+        _, totali = tara([path], {}, config, trifase, processi=1)
+        righe.append((config, vero, {k: v[0] for k, v in totali.items()}))
+    return righe
+
+
+def _valore(v):
+    return f"{v:g}" if isinstance(v, (int, float)) and not isinstance(v, bool) else str(v)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fronte di Pareto delle costanti di controllo su registrazioni")
+    parser.add_argument('registrazioni', nargs='+')
+    parser.add_argument('--griglia', action='append', default=[], metavar='CHIAVE=V1,V2,...',
+                        help="valori da provare per una chiave di CONFIG, ripetibile (sostituisce la griglia predefinita)")
+    parser.add_argument('--imposta', action='append', default=[], metavar='CHIAVE=VALORE',
+                        help="valore di CONFIG fisso per tutte le combinazioni, ripetibile")
+    parser.add_argument('--trifase', action='store_true', help="impianto trifase (potenze minima e massima)")
+    parser.add_argument('--processi', type=int, default=os.cpu_count())
+    parser.add_argument('--righe', type=int, default=40, help="righe del fronte da stampare")
+    parser.add_argument('--verifica', type=int, default=0, metavar='N',
+                        help="confronta N combinazioni con replay.py sulla prima registrazione")
+    parser.add_argument('--json', help="salva combinazioni e risultati in questo file")
+    args = parser.parse_args()
+
+    base = config_attuale()
+    for voce in args.imposta:
+        chiave, _, valore = voce.partition('=')
+        base[chiave] = ast.literal_eval(valore)
+    griglia = dict(GRIGLIA)
+    if args.griglia:
+        griglia = {}
+        for voce in args.griglia:
+            chiave, _, valori = voce.partition('=')
+            griglia[chiave] = tuple(ast.literal_eval(v) for v in valori.split(','))
+    sconosciute = set(griglia) - set(CHIAVI_STATO + CHIAVI_TRACCIA)
+    if sconosciute:
+        parser.error(f"chiavi non tarabili: {', '.join(sorted(sconosciute))}")
+
+    if args.verifica:
+        # replay.py fa girare il run_logic vero, che non decide sul previsto
+        lista = [c for c in combinazioni(griglia, base) if not c['PREVISIONE']]
+        if not lista:
+            parser.error("--verifica: nessuna combinazione con PREVISIONE=False")
+        scelte = [lista[0]] + random.Random(1).sample(lista[1:], min(args.verifica - 1, len(lista) - 1))
+        print(f"{'':<10} {'comandi':>15} {'accensioni':>11} {'timer':>9} {'autoconsumo %':>15} {'rete kWh':>15}")
+        for config, vero, stima in verifica(args.registrazioni[0], scelte, args.trifase, args.processi):
+            comandi = stima['potenza'] + stima['accensioni'] + stima['spegnimenti']
+            print(f"{'replay':<10} {vero['comandi']:>15} {vero['comandi_per_tipo']['accensioni']:>11} "
+                  f"{vero['timer_spegnimento']:>9} {vero['autoconsumo_pct'] or 0:>15.2f} {vero['energia_kwh']['rete']:>15.3f}")
+            print(f"{'taratura':<10} {comandi:>15} {stima['accensioni']:>11} {stima['timer']:>9} "
+                  f"{stima['autoconsumo_pct']:>15.2f} {stima['rete_kwh']:>15.3f}")
+            print("  " + " ".join(f"{k}={_valore(config[k])}" for k in griglia) + "\n")
+        return
+
+    inizio = time.perf_counter()
+    lista, totali = tara(args.registrazioni, griglia, base, args.trifase, args.processi)
+    durata = time.perf_counter() - inizio
+    obiettivi = np.column_stack([segno * totali[nome] for nome, segno in OBIETTIVI])
+    fronte = fronte_pareto(obiettivi)
+    print(f"{len(lista)} combinazioni x {len(args.registrazioni)} registrazioni in {durata:.1f} s "
+          f"({len(lista) * len(args.registrazioni) / durata:.0f} giornate simulate/s, {args.processi} processi); "
+          f"fronte di Pareto: {len(fronte)} combinazioni\n")
+
+    chiavi = list(griglia)
+    print(f"{'':>5} {'rete kWh':>9} {'autocons':>9} {'cmd/h':>7} {'accens':>6} {'timer':>6}  " + "  ".join(chiavi))
+
+    def stampa(etichetta, i):
+        valori = "  ".join(f"{_valore(lista[i][k]):>{len(k)}}" for k in chiavi)
+        print(f"{etichetta:>5} {totali['rete_kwh'][i]:>9.2f} {totali['autoconsumo_pct'][i]:>8.1f}% "
+              f"{totali['comandi_ora'][i]:>7.1f} {totali['accensioni'][i]:>6} {totali['timer'][i]:>6}  {valori}")
+
+    stampa('ora', 0)
+    print(f"      (valori attuali: {'sul fronte' if 0 in fronte else 'dominati'})")
+    # combinazioni con gli stessi risultati (una chiave che non conta): una riga sola, con quante sono
+    equivalenti = {}
+    for i in sorted(fronte, key=lambda i: (totali['comandi_ora'][i], totali['rete_kwh'][i])):
+        equivalenti.setdefault(tuple(obiettivi[i]) + (totali['timer'][i],), []).append(i)
+    for indici in list(equivalenti.values())[:args.righe]:
+        stampa(f"x{len(indici)}" if len(indici) > 1 else '', indici[0])
+    if len(equivalenti) > args.righe:
+        print(f"... altri {len(equivalenti) - args.righe} risultati sul fronte (--righe, --json)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'registrazioni': args.registrazioni,
+                'griglia': griglia,
+                'combinazioni': [{k: c[k] for k in chiavi} for c in lista],
+                'risultati': {k: v.tolist() for k, v in totali.items()},
+                'fronte': fronte.tolist(),
+            }, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
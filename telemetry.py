@@ -0,0 +1,83 @@
+import threading
+from array import array
+
+# -----------------------------------------------------------
+# STORICO TELEMETRIA (RING BUFFER)
+# -----------------------------------------------------------
+# Una colonna preallocata per grandezza: le 6 fasi, rete, solare e wallbox in
+# float32, il timestamp in float64 (in float32 un epoch ha una risoluzione di
+# ~2 minuti). append() scrive in posizione fissa, senza allocazioni né
+# pop(0); le letture ritornano memoryview sulle colonne, senza copie.
+# 86400 campioni (un giorno a 1 lettura/s) occupano circa 3.8 MB.
+
+COLONNE = ('l1', 'l2', 'l3', 'l4', 'l5', 'l6', 'grid', 'solar', 'wb')
+
+
+class TelemetryRing:
+    def __init__(self, capacita):
+        self.capacita = int(capacita)
+        self.colonne = {nome: array('f', bytes(4 * self.capacita)) for nome in COLONNE}
+        self.colonne['t'] = array('d', bytes(8 * self.capacita))
+        self.seq = 0  # campioni scritti dall'avvio = numero di sequenza del prossimo
+        self._lock = threading.Lock()  # scrivono sia il controllo che la coda wallbox
+
+    def __len__(self):
+        return min(self.seq, self.capacita)
+
+    def memoria(self):
+        """Byte occupati dalle colonne"""
+        return sum(c.itemsize * len(c) for c in self.colonne.values())
+
+    def append(self, t, fasi, grid, solar, wb):
+        c = self.colonne
+        with self._lock:
+            i = self.seq % self.capacita
+            c['l1'][i], c['l2'][i], c['l3'][i], c['l4'][i], c['l5'][i], c['l6'][i] = fasi
+            c['grid'][i] = grid
+            c['solar'][i] = solar
+            c['wb'][i] = wb
+            c['t'][i] = t
+            self.seq += 1
+
+    def intervallo(self, ultimi=None, da_seq=None, a_seq=None):
+        """(seq_inizio, seq_fine) dei campioni ancora nel buffer, limitati a
+        quelli con da_seq <= seq < a_seq e agli ultimi `ultimi`"""
+        seq = self.seq
+        fine = seq if a_seq is None else min(seq, a_seq)
+        inizio = max(0, seq - self.capacita)
+        if da_seq is not None:
+            inizio = max(inizio, da_seq)
+        if ultimi is not None:
+            inizio = max(inizio, fine - ultimi)
+        return inizio, max(inizio, fine)
+
+    def viste(self, nome, ultimi=None, da_seq=None, a_seq=None):
+        """Tuple di 1 o 2 memoryview (il buffer può fare il giro) in ordine cronologico"""
+        inizio, fine = self.intervallo(ultimi, da_seq, a_seq)
+        col = memoryview(self.colonne[nome])
+        if inizio == fine:
+            return (col[0:0],)
+        a = inizio % self.capacita
+        b = a + (fine - inizio)
+        if b <= self.capacita:
+            return (col[a:b],)
+        return (col[a:], col[:b - self.capacita])
+
+    def valori(self, nome, ultimi=None, da_seq=None, a_seq=None):
+        """Come viste() ma in una lista (copia)"""
+        out = []
+        for v in self.viste(nome, ultimi, da_seq, a_seq):
+            out.extend(v.tolist())
+        return out
+
+    def seq_da_tempo(self, t):
+        """Primo seq con timestamp >= t (ricerca binaria, i campioni sono in ordine di tempo)"""
+        col = self.colonne['t']
+        lo, hi = self.intervallo()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if col[mid % self.capacita] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
@@ -0,0 +1,248 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# -----------------------------------------------------------
+# ARCHIVIO TELEMETRIA SU DISCO (SQLITE)
+# -----------------------------------------------------------
+# Letture fasi e comandi wallbox finiscono in un database SQLite in modalità
+# WAL, così sopravvivono ai riavvii del servizio. Le scritture non toccano il
+# thread di controllo: le righe vanno in una coda e un thread dedicato le
+# inserisce a blocchi (una transazione ogni BATCH_S secondi). Poche commit
+# grandi al posto di tante piccole limitano le scritture sulla SD del Pi.
+# Se una transazione fallisce (database occupato, disco pieno) il blocco
+# resta in attesa e viene riprovato con pause che raddoppiano fino a
+# RIPROVA_MAX_S. Il blocco in attesa tiene al massimo max_coda letture e
+# max_coda comandi, e lo stesso vale per la coda che si riempie nel
+# frattempo: durante una pausa lunga restano in memoria fino a 2 x max_coda
+# righe per tipo. Le righe più vecchie che non ci stanno si perdono, sia
+# dalla coda sia dal blocco, e vengono contate in stats['righe_perse'].
+# Gli aggregati chiusi vengono salvati nella tabella `aggregati` la prima
+# volta che servono: all'avvio si ricalcolano dalle letture solo i bucket
+# successivi all'ultimo salvato, non un anno di letture a ogni riavvio.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS letture (
+    t REAL NOT NULL,
+    l1 REAL, l2 REAL, l3 REAL, l4 REAL, l5 REAL, l6 REAL,
+    grid REAL, solar REAL, wb REAL
+);
+CREATE INDEX IF NOT EXISTS letture_t ON letture (t);
+CREATE TABLE IF NOT EXISTS comandi (
+    t REAL NOT NULL,
+    btn TEXT NOT NULL,
+    watts INTEGER
+);
+CREATE INDEX IF NOT EXISTS comandi_t ON comandi (t);
+CREATE TABLE IF NOT EXISTS aggregati (
+    risoluzione INTEGER NOT NULL,
+    k INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    acc TEXT NOT NULL,
+    PRIMARY KEY (risoluzione, k)
+) WITHOUT ROWID;
+"""
+
+COLONNE_LETTURE = ('t', 'l1', 'l2', 'l3', 'l4', 'l5', 'l6', 'grid', 'solar', 'wb')
+RIPROVA_MAX_S = 300
+
+
+def _connetti(path):
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # NORMAL in WAL: nessun fsync a ogni commit, solo ai checkpoint
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class TelemetryStore:
+    def __init__(self, path, batch_s=5.0, max_coda=100000, log=print):
+        self.path = path
+        self.batch_s = batch_s
+        self.max_coda = max_coda
+        self.log = log
+        self._letture = deque(maxlen=max_coda)
+        self._comandi = deque(maxlen=max_coda)
+        self._in_attesa = ([], [])  # (letture, comandi) di un blocco non scritto, da riprovare
+        self._pausa = batch_s
+        self._cond = threading.Condition()
+        self._chiuso = False
+        self._occupato = False
+        self._subito = False  # flush richiesto: scrivi senza aspettare BATCH_S
+        self._locale = threading.local()  # connessione di lettura per thread
+        self.stats = {'righe_scritte': 0, 'batch': 0, 'ultimo_batch_ms': 0.0, 'errori': 0, 'righe_perse': 0}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = _connetti(path)
+        conn.executescript(SCHEMA)
+        conn.close()
+
+        self._thread = threading.Thread(target=self._run, name='archivio', daemon=True)
+        self._thread.start()
+
+    # --- scrittura (non bloccante) ---
+    def lettura(self, t, fasi, grid, solar, wb):
+        if len(self._letture) == self.max_coda:
+            self.stats['righe_perse'] += 1  # la coda piena scarta la più vecchia
+        self._letture.append((t, *fasi, grid, solar, wb))
+
+    def comando(self, t, btn, watts):
+        if len(self._comandi) == self.max_coda:
+            self.stats['righe_perse'] += 1
+        self._comandi.append((t, btn, watts))
+
+    def flush(self, timeout=None):
+        """Chiede un batch immediato e aspetta che la coda sia scritta"""
+        fine = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._subito = True
+            self._cond.notify_all()
+            while self._letture or self._comandi or self._in_attesa[0] or self._in_attesa[1] or self._occupato:
+                restante = None if fine is None else fine - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return False
+                self._cond.wait(restante)
+        return True
+
+    def chiudi(self, timeout=10):
+        self.flush(timeout)
+        with self._cond:
+            self._chiuso = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        conn = _connetti(self.path)
+        while True:
+            with self._cond:
+                if not self._chiuso and not self._subito:
+                    self._cond.wait(self._pausa)
+                self._subito = False
+                chiuso = self._chiuso
+                self._occupato = True
+            try:
+                self._scrivi(conn)
+            finally:
+                with self._cond:
+                    self._occupato = False
+                    self._cond.notify_all()
+            if chiuso:
+                conn.close()
+                return
+
+    def _scrivi(self, conn):
+        letture, comandi = self._in_attesa
+        letture += [self._letture.popleft() for _ in range(len(self._letture))]
+        comandi += [self._comandi.popleft() for _ in range(len(self._comandi))]
+        if not letture and not comandi:
+            return
+        inizio = time.perf_counter()
+        try:
+            with conn:
+                if letture:
+                    conn.executemany("INSERT INTO letture VALUES (?,?,?,?,?,?,?,?,?,?)", letture)
+                if comandi:
+                    conn.executemany("INSERT INTO comandi VALUES (?,?,?)", comandi)
+        except sqlite3.Error as e:
+            # il blocco resta in attesa per il giro dopo; oltre max_coda si perdono le righe più vecchie
+            perse = max(0, len(letture) - self.max_coda) + max(0, len(comandi) - self.max_coda)
+            self._in_attesa = (letture[-self.max_coda:], comandi[-self.max_coda:])
+            self._pausa = min(self._pausa * 2, RIPROVA_MAX_S)
+            self.stats['errori'] += 1
+            self.stats['righe_perse'] += perse
+            self.log(f"[ERRORE] Archivio telemetria: {e} ({len(letture) + len(comandi)} righe in attesa, "
+                     f"riprovo tra {self._pausa:.0f}s)")
+            return
+        self._in_attesa = ([], [])
+        self._pausa = self.batch_s
+        self.stats['righe_scritte'] += len(letture) + len(comandi)
+        self.stats['batch'] += 1
+        self.stats['ultimo_batch_ms'] = (time.perf_counter() - inizio) * 1000
+
+    # --- lettura ---
+    def _conn_lettura(self):
+        conn = getattr(self._locale, 'conn', None)
+        if conn is None:
+            conn = self._locale.conn = _connetti(self.path)
+        return conn
+
+    def letture(self, t_da, t_a=None, limite=None):
+        """Letture con t_da <= t < t_a in ordine di tempo (tuple nell'ordine di COLONNE_LETTURE)"""
+        sql = "SELECT t, l1, l2, l3, l4, l5, l6, grid, solar, wb FROM letture WHERE t >= ?"
+        args = [t_da]
+        if t_a is not None:
+            sql += " AND t < ?"
+            args.append(t_a)
+        sql += " ORDER BY t"
+        if limite is not None:
+            sql += " LIMIT ?"
+            args.append(limite)
+        return self._conn_lettura().execute(sql, args).fetchall()
+
+    def ultime_letture(self, n, prima_di=None):
+        """Le ultime n letture (con t < prima_di) in ordine di tempo, per ricaricare lo storico all'avvio"""
+        sql = "SELECT t, l1, l2, l3, l4, l5, l6, grid, solar, wb FROM letture"
+        args = []
+        if prima_di is not None:
+            sql += " WHERE t < ?"
+            args.append(prima_di)
+        righe = self._conn_lettura().execute(sql + " ORDER BY t DESC LIMIT ?", args + [n]).fetchall()
+        righe.reverse()
+        return righe
+
+    def comandi(self, t_da, t_a=None):
+        sql = "SELECT t, btn, watts FROM comandi WHERE t >= ?"
+        args = [t_da]
+        if t_a is not None:
+            sql += " AND t < ?"
+            args.append(t_a)
+        return self._conn_lettura().execute(sql + " ORDER BY t", args).fetchall()
+
+    def aggregati(self, risoluzione, t_da, t_a):
+        """Bucket di `risoluzione` secondi con t_da <= t < t_a, come [(k, n, acc)] con
+        acc = [min, max, somma, ultimo] per ogni grandezza (per RollupPyramid.carica).
+
+        I bucket già salvati vengono letti dalla tabella aggregati; quelli dopo
+        l'ultimo salvato si calcolano dalle letture e, se chiusi prima di t_a,
+        vengono salvati per i prossimi avvii."""
+        conn = self._conn_lettura()
+        salvati = [(k, n, json.loads(acc)) for k, n, acc in conn.execute(
+            "SELECT k, n, acc FROM aggregati WHERE risoluzione = ? AND k >= ? AND k < ? ORDER BY k",
+            (risoluzione, math.ceil(t_da / risoluzione), int(t_a // risoluzione)))]
+        testa = []
+        if salvati:
+            # il bucket tagliato da t_da viene dalle letture, come se non ci fosse la tabella
+            testa = self._aggregati_letture(risoluzione, t_da, salvati[0][0] * risoluzione)
+        inizio = (salvati[-1][0] + 1) * risoluzione if salvati else t_da
+        nuovi = self._aggregati_letture(risoluzione, inizio, t_a)
+        # chiusi: interi (dall'inizio del bucket) e finiti prima di t_a
+        chiusi = [(k, n, acc) for k, n, acc in nuovi
+                  if k * risoluzione >= inizio and (k + 1) * risoluzione <= t_a]
+        if chiusi:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO aggregati VALUES (?,?,?,?)",
+                                 [(risoluzione, k, n, json.dumps(acc)) for k, n, acc in chiusi])
+        return testa + salvati + nuovi
+
+    def _aggregati_letture(self, risoluzione, t_da, t_a):
+        serie = COLONNE_LETTURE[1:]
+        agg = ", ".join(f"MIN({c}), MAX({c}), SUM({c})" for c in serie)
+        ultimi = ", ".join(f"l.{c}" for c in serie)
+        filtro = "t >= ? AND t < ?"
+        sql = (f"WITH b AS (SELECT CAST(t / ? AS INTEGER) AS k, COUNT(*) AS n, MAX(t) AS tl, {agg} "
+               f"FROM letture WHERE {filtro} GROUP BY k) "
+               f"SELECT b.*, {ultimi} FROM b JOIN letture l "
+               f"ON l.rowid = (SELECT rowid FROM letture WHERE t = b.tl LIMIT 1) ORDER BY b.k")
+        out = []
+        for riga in self._conn_lettura().execute(sql, (risoluzione, t_da, t_a)):
+            k, n = riga[0], riga[1]
+            stat = riga[3:3 + 3 * len(serie)]
+            ultimo = riga[3 + 3 * len(serie):]
+            acc = [[stat[3 * j], stat[3 * j + 1], stat[3 * j + 2], ultimo[j]] for j in range(len(serie))]
+            out.append((k, n, acc))
+        return out
@@ -0,0 +1,98 @@
+"""Sequenza dei lotti nell'aggregatore: reinvii scartati, riavvio del controller,
+lotti malformati rifiutati senza toccare il sito, siti ammessi e massimo di siti.
+
+Uso:
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregatore import Aggregatore, SitoRifiutato  # noqa: E402
+from uplink import lotto  # noqa: E402
+
+T0 = 1718190000.0
+
+
+def corpo(seq, avvio, t):
+    return lotto('casa', seq, [(t, (500, 0, 0, 3000, 0, 0), 1380)], [], {'wb_on': True}, avvio)
+
+
+class TestSequenza(unittest.TestCase):
+    def setUp(self):
+        self.ag = Aggregatore(campioni=100)
+
+    def ingerisci(self, seq, avvio, t):
+        self.ag.ingerisci(corpo(seq, avvio, t), compresso=False)
+        return self.ag.siti['casa']
+
+    def test_reinvio_scartato(self):
+        self.ingerisci(1, 'a', T0)
+        sito = self.ingerisci(1, 'a', T0)
+        self.assertEqual(sito.stats['lotti'], 1)
+        self.assertEqual(sito.stats['duplicati'], 1)
+
+    def test_riavvio_ricomincia_la_sequenza(self):
+        for seq in range(1, 6):
+            self.ingerisci(seq, 'prima', T0 + seq)
+        # il servizio riparte: nuovo avvio, seq di nuovo da 1
+        for seq in range(1, 4):
+            sito = self.ingerisci(seq, 'dopo', T0 + 10 + seq)
+        self.assertEqual(sito.stats['lotti'], 8)
+        self.assertEqual(sito.stats['duplicati'], 0)
+        self.assertEqual(sito.stats['riavvii'], 1)
+        self.assertEqual(sito.ultima[0], T0 + 13)
+        # i reinvii del nuovo avvio restano scartati
+        self.ingerisci(3, 'dopo', T0 + 13)
+        self.assertEqual(sito.stats['duplicati'], 1)
+
+    def test_lotto_malformato_non_tocca_il_sito(self):
+        self.ingerisci(1, 'a', T0)
+        sito = self.ag.siti['casa']
+        dati = json.loads(corpo(2, 'a', T0 + 1))
+        dati['letture'].append([1, 2])
+        senza_t0 = {k: v for k, v in dati.items() if k != 't0'}
+        for guasto in (dati, senza_t0):
+            with self.assertRaises(ValueError):
+                self.ag.ingerisci(json.dumps(guasto).encode(), compresso=False)
+        self.assertEqual(sito.ultimo_seq, 1)
+        self.assertEqual(sito.stats['lotti'], 1)
+        self.assertEqual(len(sito.storico), 1)
+        self.assertEqual(self.ag.stats['errori'], 2)
+        # il reinvio corretto con la stessa seq viene accettato
+        self.ingerisci(2, 'a', T0 + 1)
+        self.assertEqual(sito.stats['lotti'], 2)
+        self.assertEqual(sito.stats['duplicati'], 0)
+
+    def test_lotto_json_ha_avvio(self):
+        self.assertEqual(json.loads(corpo(1, 'x', T0))['avvio'], 'x')
+
+
+class TestSiti(unittest.TestCase):
+    def lotto(self, nome):
+        return lotto(nome, 1, [(T0, (500, 0, 0, 3000, 0, 0), 1380)], [], {}, 'a')
+
+    def test_massimo_siti(self):
+        ag = Aggregatore(campioni=10, max_siti=2)
+        for nome in ('a', 'b'):
+            ag.ingerisci(self.lotto(nome), compresso=False)
+        with self.assertRaises(SitoRifiutato):
+            ag.ingerisci(self.lotto('c'), compresso=False)
+        # i siti già noti continuano a ricevere
+        ag.ingerisci(self.lotto('a').replace(b'"seq":1', b'"seq":2'), compresso=False)
+        self.assertEqual(sorted(ag.siti), ['a', 'b'])
+        self.assertEqual(ag.stats['rifiutati'], 1)
+
+    def test_siti_ammessi(self):
+        ag = Aggregatore(campioni=10, siti_ammessi=['casa'])
+        ag.ingerisci(self.lotto('casa'), compresso=False)
+        with self.assertRaises(SitoRifiutato):
+            ag.ingerisci(self.lotto('csa'), compresso=False)
+        self.assertEqual(list(ag.siti), ['casa'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import gzip
+import json
+import secrets
+import threading
+import time
+from collections import deque
+
+import requests
+
+# -----------------------------------------------------------
+# INVIO TELEMETRIA ALL'AGGREGATORE
+# -----------------------------------------------------------
+# Ogni controller può mandare letture, comandi confermati e un riassunto
+# dello stato (setpoint, parametri, esiti della coda comandi) a un
+# aggregatore centrale (aggregatore.py). Come per l'archivio, il controllo
+# accoda e basta: un thread dedicato ogni BATCH_S secondi impacchetta tutto
+# in un JSON compatto (tempi in decimi di secondo dal primo, watt interi)
+# compresso con gzip, su una connessione keep-alive. Se l'invio fallisce per
+# la rete o per un errore 5xx lo stesso lotto, con lo stesso numero di
+# sequenza, riparte al giro dopo: l'aggregatore scarta i lotti già visti. Un
+# 4xx invece vuol dire che quel lotto non verrà mai accettato (malformato,
+# versione diversa): si scarta e si conta, altrimenti bloccherebbe l'invio
+# per sempre. La sequenza riparte da 1 a ogni avvio del servizio, quindi ogni
+# lotto porta anche un identificativo casuale dell'avvio: quando cambia
+# l'aggregatore ricomincia a contare. Con l'aggregatore irraggiungibile a
+# lungo le code tengono le ultime max_coda righe; le più vecchie si perdono
+# e si contano in stats.
+
+VERSIONE = 1
+
+
+def lotto(sito, seq, letture, comandi, stato, avvio=None):
+    """Corpo JSON (bytes, non compresso) di un lotto; letture (t, fasi, wb), comandi (t, btn, watts).
+    avvio: identificativo dell'avvio del controller, a cui appartiene la sequenza seq"""
+    t0 = letture[0][0] if letture else (comandi[0][0] if comandi else time.time())
+    return json.dumps({
+        'v': VERSIONE,
+        'sito': sito,
+        'avvio': avvio,
+        'seq': seq,
+        't0': round(t0, 1),
+        # [decimi di secondo da t0, l1..l6, wb]
+        'letture': [[round((t - t0) * 10), *(round(f) for f in fasi), round(wb)] for t, fasi, wb in letture],
+        'comandi': [[round((t - t0) * 10), btn, watts] for t, btn, watts in comandi],
+        'stato': stato,
+    }, separators=(',', ':')).encode()
+
+
+class UplinkAggregatore:
+    def __init__(self, url, sito, batch_s=10.0, max_coda=36000, stato=None, timeout=5, log=print, token=None):
+        self.url = url.rstrip('/') + '/api/ingest'
+        self.sito = sito
+        self.batch_s = batch_s
+        self.timeout = timeout
+        self.stato = stato or (lambda: {})  # riassunto dello stato inviato con ogni lotto
+        self.log = log
+        self._letture = deque(maxlen=max_coda)
+        self._comandi = deque(maxlen=max_coda)
+        self._avvio = secrets.token_hex(8)
+        self._seq = 0
+        self._in_sospeso = None  # corpo compresso non ancora confermato
+        self._sessione = requests.Session()
+        if token:
+            self._sessione.headers['Authorization'] = 'Bearer ' + token  # aggregatore.py --token
+        self._ferma = threading.Event()
+        self._in_errore = False
+        self.stats = {'lotti': 0, 'letture': 0, 'comandi': 0, 'bytes': 0, 'errori': 0, 'lotti_rifiutati': 0,
+                      'letture_perse': 0, 'comandi_persi': 0, 'ultimo_invio': None}
+        self._thread = threading.Thread(target=self._run, name='uplink', daemon=True)
+        self._thread.start()
+
+    # --- dal controllo (non bloccante) ---
+    def lettura(self, t, fasi, wb):
+        if len(self._letture) == self._letture.maxlen:
+            self.stats['letture_perse'] += 1  # la coda piena scarta la più vecchia
+        self._letture.append((t, tuple(fasi), wb))
+
+    def comando(self, t, btn, watts):
+        if len(self._comandi) == self._comandi.maxlen:
+            self.stats['comandi_persi'] += 1
+        self._comandi.append((t, btn, watts))
+
+    # --- thread di invio ---
+    def _prepara(self):
+        letture = [self._letture.popleft() for _ in range(len(self._letture))]
+        comandi = [self._comandi.popleft() for _ in range(len(self._comandi))]
+        self._seq += 1
+        corpo = lotto(self.sito, self._seq, letture, comandi, self.stato(), self._avvio)
+        self._in_sospeso = (gzip.compress(corpo, 6, mtime=0), len(letture), len(comandi))
+
+    def invia(self):
+        """Un giro di invio: il lotto in sospeso o uno nuovo; True se confermato"""
+        if self._in_sospeso is None:
+            self._prepara()
+        corpo, n_letture, n_comandi = self._in_sospeso
+        try:
+            r = self._sessione.post(self.url, data=corpo, timeout=self.timeout, headers={
+                'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+            r.raise_for_status()
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code >= 500:
+                return self._errore(e)
+            # l'aggregatore non accetterà mai questo lotto: riprovarlo bloccherebbe tutti i successivi
+            self.stats['lotti_rifiutati'] += 1
+            self.log(f"[ERRORE] Aggregatore: lotto {self._seq} rifiutato ({e.response.status_code} "
+                     f"{e.response.text[:200]}), scartate {n_letture} letture e {n_comandi} comandi")
+            self._in_sospeso = None
+            return False
+        except requests.RequestException as e:
+            return self._errore(e)
+        if self._in_errore:
+            self.log("[INFO] Aggregatore di nuovo raggiungibile")
+            self._in_errore = False
+        self._in_sospeso = None
+        self.stats['lotti'] += 1
+        self.stats['letture'] += n_letture
+        self.stats['comandi'] += n_comandi
+        self.stats['bytes'] += len(corpo)
+        self.stats['ultimo_invio'] = time.time()
+        return True
+
+    def _errore(self, e):
+        """Errore di rete o 5xx: il lotto resta in sospeso e riparte al giro dopo"""
+        self.stats['errori'] += 1
+        if not self._in_errore:
+            self.log(f"[ERRORE] Aggregatore non raggiungibile ({e}): riprovo ogni {self.batch_s:.0f}s")
+            self._in_errore = True
+        return False
+
+    def _run(self):
+        while not self._ferma.wait(self.batch_s):
+            try:
+                self.invia()
+            except Exception as e:
+                self.log(f"[ERRORE] Uplink: {e}")
+
+    def chiudi(self, timeout=5):
+        """Ferma il thread e prova un ultimo invio"""
+        self._ferma.set()
+        self._thread.join(timeout)
+        self.timeout = min(self.timeout, timeout)
+        self.invia()
@@ -0,0 +1,106 @@
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# -----------------------------------------------------------
+# CLIENT HTTP WALLBOX
+# -----------------------------------------------------------
+# Una sola connessione keep-alive verso la centralina, condivisa da tutte le
+# chiamate (comandi P/i/o e lettura stato). Sulla LAN il costo di un comando
+# è quasi tutto apertura della connessione TCP: riusandola resta solo il
+# round trip. Ogni chiamata registra il suo tempo per tipo di comando.
+
+def tipo_comando(params):
+    """'P' per i cambi potenza, 'i'/'o' per on/off, 'stato' per la lettura senza parametri"""
+    if not params:
+        return 'stato'
+    btn = str(params.get('btn', ''))
+    return 'P' if btn.startswith('P') else btn
+
+
+class _TempiComandi:
+    def __init__(self, istogramma=None):
+        self.tempi = {}  # tipo comando -> statistiche round trip
+        self.istogramma = istogramma  # metrics.Istogramma per tipo comando (opzionale)
+
+    def registra(self, params, inizio, ok):
+        rtt_ms = (time.perf_counter() - inizio) * 1000
+        tipo = tipo_comando(params)
+        t = self.tempi.get(tipo)
+        if t is None:
+            t = self.tempi[tipo] = {'n': 0, 'errori': 0, 'ultimo_ms': 0.0, 'medio_ms': 0.0, 'max_ms': 0.0}
+        t['n'] += 1
+        if not ok:
+            t['errori'] += 1
+        t['ultimo_ms'] = rtt_ms
+        t['medio_ms'] += (rtt_ms - t['medio_ms']) / t['n']
+        t['max_ms'] = max(t['max_ms'], rtt_ms)
+        if self.istogramma is not None:
+            self.istogramma.osserva(rtt_ms / 1000, tipo)
+
+
+class WallboxClient(_TempiComandi):
+    """Client sincrono (requests.Session) con pool keep-alive"""
+
+    def __init__(self, url, timeout=3, istogramma=None):
+        super().__init__(istogramma)
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        # pochi slot: controllo, Flask e Telegram possono chiamare in contemporanea
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+
+    def get(self, params=None, timeout=None):
+        """GET su index.json; solleva requests.exceptions.RequestException come requests.get"""
+        inizio = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.get(self.url, params=params, timeout=timeout or self.timeout)
+            ok = response.status_code == 200
+            return response
+        finally:
+            self.registra(params, inizio, ok)
+
+    def comando(self, params):
+        try:
+            return self.get(params).status_code == 200
+        except Exception:
+            return False
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncWallboxClient(_TempiComandi):
+    """Variante asyncio (httpx.AsyncClient) con lo stesso pool keep-alive"""
+
+    def __init__(self, url, timeout=3, istogramma=None):
+        import httpx
+
+        super().__init__(istogramma)
+        self.url = url
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+        )
+
+    async def get(self, params=None, timeout=None):
+        inizio = time.perf_counter()
+        ok = False
+        try:
+            kwargs = {'timeout': timeout} if timeout is not None else {}
+            response = await self.client.get(self.url, params=params, **kwargs)
+            ok = response.status_code == 200
+            return response
+        finally:
+            self.registra(params, inizio, ok)
+
+    async def comando(self, params):
+        try:
+            return (await self.get(params)).status_code == 200
+        except Exception:
+            return False
+
+    async def close(self):
+        await self.client.aclose()
@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# -----------------------------------------------------------
+# CODA COMANDI WALLBOX
+# -----------------------------------------------------------
+# Tutti i comandi verso la wallbox passano da una coda eseguita da un solo
+# thread. Chi chiama (run_logic, Telegram, Flask) riceve subito un Future e
+# non aspetta mai l'HTTP. Se in coda c'è già un cambio potenza non ancora
+# inviato, quello nuovo lo sostituisce: parte solo l'ultimo P<watt>. I comandi
+# di accensione/spegnimento non vengono mai scavalcati né riordinati.
+
+class _Comando:
+    __slots__ = ('params', 'fn', 'args', 'on_success', 'pausa', 'future', 'superati')
+
+    def __init__(self, params=None, fn=None, args=(), on_success=None, pausa=0.0):
+        self.params = params
+        self.fn = fn
+        self.args = args
+        self.on_success = on_success
+        self.pausa = pausa
+        self.future = Future()
+        self.superati = []  # future dei cambi potenza sostituiti da questo
+
+    def is_potenza(self):
+        return self.params is not None and str(self.params.get('btn', '')).startswith('P')
+
+
+class WallboxDispatcher:
+    """Esegue in ordine i comandi wallbox su un thread dedicato.
+
+    invia() accoda un comando HTTP (params per send_command); on_success viene
+    chiamato sul thread della coda solo se la wallbox conferma. esegui() accoda
+    una funzione qualsiasi, ad esempio initialize(). Entrambi ritornano un
+    concurrent.futures.Future con l'esito.
+    """
+
+    def __init__(self, send_command, nome='wallbox'):
+        self._send_command = send_command
+        self._coda = deque()
+        self._cond = threading.Condition()
+        self._occupato = False
+        self.stats = {'inviati': 0, 'falliti': 0, 'coalescati': 0}
+        self._thread = threading.Thread(target=self._run, name=nome, daemon=True)
+        self._thread.start()
+
+    def invia(self, params, on_success=None, pausa=0.0):
+        """Accoda un comando; pausa = secondi di attesa dopo un esito positivo"""
+        return self._accoda(_Comando(params=params, on_success=on_success, pausa=pausa))
+
+    def esegui(self, fn, *args):
+        return self._accoda(_Comando(fn=fn, args=args))
+
+    def _accoda(self, comando):
+        with self._cond:
+            if comando.is_potenza() and self._coda and self._coda[-1].is_potenza():
+                superato = self._coda.pop()
+                comando.superati = superato.superati + [superato.future]
+                self.stats['coalescati'] += 1
+            self._coda.append(comando)
+            self._cond.notify_all()
+        return comando.future
+
+    def attendi(self, timeout=None):
+        """Aspetta che la coda sia vuota e nessun comando sia in corso"""
+        fine = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._coda or self._occupato:
+                restante = None if fine is None else fine - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return False
+                self._cond.wait(restante)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._coda:
+                    self._cond.wait()
+                comando = self._coda.popleft()
+                self._occupato = True
+
+            try:
+                self._esegui(comando)
+            finally:
+                with self._cond:
+                    self._occupato = False
+                    self._cond.notify_all()
+
+    def _esegui(self, comando):
+        futures = [comando.future] + comando.superati
+        try:
+            if comando.fn is not None:
+                risultato = comando.fn(*comando.args)
+                ok = True
+            else:
+                ok = risultato = bool(self._send_command(comando.params))
+                self.stats['inviati' if ok else 'falliti'] += 1
+            if ok and comando.on_success is not None:
+                comando.on_success()
+        except Exception as e:
+            for f in futures:
+                f.set_exception(e)
+            return
+
+        if ok and comando.pausa:
+            time.sleep(comando.pausa)
+        for f in futures:
+            f.set_result(risultato)
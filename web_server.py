@@ -0,0 +1,92 @@
+import gzip
+import logging
+import threading
+
+from werkzeug.serving import make_server
+
+try:
+    import waitress
+except ImportError:  # opzionale: senza waitress resta il server di sviluppo di werkzeug
+    waitress = None
+
+# -----------------------------------------------------------
+# SERVER WEB
+# -----------------------------------------------------------
+# Il server di sviluppo di werkzeug apre un thread per ogni connessione: con
+# tante dashboard (o un client che insiste) i thread si moltiplicano e si
+# contendono il GIL con il controllo. In modalità 'waitress' le connessioni,
+# keep-alive compreso, restano sul loop di I/O di waitress e solo `threads`
+# richieste alla volta eseguono codice Python: le altre aspettano in coda.
+# Le risposte che non sono già compresse (log, metriche, JSON piccoli) passano
+# per comprimi_risposte() se il client accetta gzip.
+
+MODI = ('waitress', 'sviluppo')
+_COMPRIMIBILI = ('text/', 'application/json', 'application/javascript')
+
+
+class ServerWeb:
+    """Server WSGI già in ascolto; servi() blocca fino a chiudi()"""
+
+    def __init__(self, app, host, porta, modo='waitress', threads=4, connessioni=100, log=print):
+        if modo not in MODI:
+            raise ValueError(f"modo server web sconosciuto: {modo} (validi: {', '.join(MODI)})")
+        if modo == 'waitress' and waitress is None:
+            log("[ATTENZIONE] waitress non installato: uso il server di sviluppo (pip install waitress)")
+            modo = 'sviluppo'
+        self.modo = modo
+        self.threads = threads if modo == 'waitress' else None  # None = un thread per connessione
+        if modo == 'waitress':
+            self._server = waitress.create_server(
+                app, host=host, port=porta, threads=threads, connection_limit=connessioni,
+                channel_timeout=60, ident='solar', asyncore_use_poll=True)
+            self.porta = self._server.effective_port
+            # "Task queue depth" a ogni coda: normale quando il pool è limitato
+            logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+        else:
+            self._server = make_server(host, porta, app, threaded=True)
+            self.porta = self._server.server_port
+        self._chiuso = threading.Event()
+
+    def servi(self):
+        if self.modo == 'waitress':
+            try:
+                self._server.run()
+            except Exception:
+                # chiudi() da un altro thread fa uscire il loop di I/O con un errore sul socket
+                if not self._chiuso.is_set():
+                    raise
+        else:
+            self._server.serve_forever()
+
+    def chiudi(self):
+        self._chiuso.set()
+        if self.modo == 'waitress':
+            # prima i thread delle richieste, poi il loop di I/O che li sveglia
+            self._server.task_dispatcher.shutdown(timeout=5)
+            self._server.close()
+        else:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def comprimi_risposte(app, minimo=1024, livello=6):
+    """Comprime con gzip le risposte testuali che la route non ha già compresso"""
+
+    @app.after_request
+    def _gzip(risposta):
+        if (risposta.status_code != 200 or risposta.direct_passthrough or risposta.is_streamed
+                or 'Content-Encoding' in risposta.headers
+                or not (risposta.mimetype or '').startswith(_COMPRIMIBILI)):
+            return risposta
+        from flask import request
+        if request.accept_encodings['gzip'] <= 0:
+            return risposta
+        corpo = risposta.get_data()
+        if len(corpo) < minimo:
+            return risposta
+        risposta.set_data(gzip.compress(corpo, livello, mtime=0))
+        risposta.headers['Content-Encoding'] = 'gzip'
+        risposta.vary.add('Accept-Encoding')
+        return risposta
+
+    return _gzip